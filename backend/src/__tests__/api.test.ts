@@ -36,7 +36,7 @@ const createTestApp = () => {
   app.get('/api/files', (req, res) => {
     try {
       const files = fs.readdirSync(UPLOAD_DIR)
-        .filter(file => file !== '.gitkeep')
+        .filter(file => !file.startsWith('.')) // pomiń .gitkeep i katalog cache .flows_cache
         .map(filename => {
           const filePath = path.join(UPLOAD_DIR, filename);
           const stats = fs.statSync(filePath);
@@ -52,7 +52,60 @@ const createTestApp = () => {
     }
   });
 
-  // Get entities endpoint
+  // Uproszczony odpowiednik flows.find_entities (profil + słownik podmiotów z Pythona):
+  // nazwy posortowane, wyszukiwanie prefiksu, strony jak w flows_entities.search
+  const findEntities = (filePath: string, params: any) => {
+    const csv = fs.readFileSync(filePath, 'utf-8');
+    const lines = csv.split(/\r?\n/).filter(line => !!line);
+    if (lines.length === 0) {
+      return { total: 0, items: [], profile: { header: null, columns: null } };
+    }
+    const delimiter = [';', '\t', '|'].find(d => lines[0].includes(d)) ?? ',';
+    const header = lines[0].split(delimiter);
+    const columns = {
+      sender: header.find(h => h.toLowerCase().includes('nadawca')) ?? null,
+      receiver: header.find(h => h.toLowerCase().includes('odbiorca')) ?? null
+    };
+    const profile = {
+      header,
+      columns,
+      flows_compatible: delimiter === ',' && [columns.sender, columns.receiver].every(
+        c => c === null || c === 'Nadawca' || c === 'Odbiorca')
+    };
+    if (!columns.sender || !columns.receiver || !profile.flows_compatible) {
+      return { total: 0, items: [], profile };
+    }
+    const senderIdx = header.indexOf(columns.sender);
+    const receiverIdx = header.indexOf(columns.receiver);
+    const names = new Set<string>();
+    for (const line of lines.slice(1)) {
+      const row = line.split(',');
+      [row[senderIdx], row[receiverIdx]].forEach(name => name && names.add(name));
+    }
+    const matches = Array.from(names).sort()
+      .filter(name => name.toLowerCase().startsWith(params.query.toLowerCase()));
+    const end = params.all ? matches.length : params.offset + Math.min(params.limit ?? 50, 1000);
+    const items = matches.slice(params.offset, end).map(name => ({ name, count: 0, total: 0 }));
+    return { total: matches.length, items, profile };
+  };
+
+  const entitiesError = (profile: any): string | null => {
+    if (profile.error) {
+      return profile.error;
+    }
+    if (!profile.header) {
+      return 'CSV file is empty';
+    }
+    if (!profile.columns.sender || !profile.columns.receiver) {
+      return 'CSV must contain Nadawca and Odbiorca columns';
+    }
+    if (profile.flows_compatible === false) {
+      return 'CSV must be comma-separated with exactly named Nadawca, Odbiorca and Kwota columns';
+    }
+    return null;
+  };
+
+  // Get entities endpoint (jak w index.ts; bez offset i limit - pełna lista nazw)
   app.get('/api/entities/:filename', async (req, res) => {
     try {
       const { filename } = req.params;
@@ -62,32 +115,24 @@ const createTestApp = () => {
         return res.status(404).json({ error: 'File not found' });
       }
       
-      const csv = fs.readFileSync(filePath, 'utf-8');
-      const lines = csv.split(/\r?\n/);
-      if (!lines || lines.length === 0) {
-        return res.status(400).json({ error: 'CSV file is empty' });
+      const { q, offset, limit } = req.query;
+      const paged = offset !== undefined || limit !== undefined;
+      const params = {
+        query: typeof q === 'string' ? q : '',
+        offset: Number(offset) || 0,
+        limit: limit === undefined ? undefined : Number(limit) || 0,
+        all: !paged
+      };
+      const page = findEntities(filePath, params);
+      const error = entitiesError(page.profile);
+      if (error) {
+        return res.status(400).json({ error });
       }
-      
-      const header = lines[0].split(',');
-      const idxNadawca = header.findIndex(h => h.toLowerCase().includes('nadawca'));
-      const idxOdbiorca = header.findIndex(h => h.toLowerCase().includes('odbiorca'));
-      
-      if (idxNadawca === -1 || idxOdbiorca === -1) {
-        return res.status(400).json({ error: 'CSV must contain Nadawca and Odbiorca columns' });
-      }
-      
-      const entities = new Set();
-      for (let i = 1; i < lines.length; i++) {
-        const line = lines[i];
-        if (typeof line !== 'string' || !line) continue;
-        const row = line.split(',');
-        if (row.length > Math.max(idxNadawca, idxOdbiorca)) {
-          entities.add(row[idxNadawca]);
-          entities.add(row[idxOdbiorca]);
-        }
+      const entities = page.items.map(item => item.name);
+      if (!paged) {
+        return res.json({ entities, total: page.total });
       }
-      
-      res.json({ entities: Array.from(entities).filter(e => !!e) });
+      res.json({ entities, items: page.items, total: page.total, offset: params.offset });
     } catch (error: any) {
       res.status(500).json({ error: error.message });
     }
@@ -157,6 +202,18 @@ describe('Backend API Tests', () => {
       // Cleanup
       fs.unlinkSync(testFile);
     });
+
+    it('nie powinien zwracać ukrytych plików i katalogów cache', async () => {
+      const cacheDir = path.join(UPLOAD_DIR, '.flows_cache');
+      fs.mkdirSync(cacheDir, { recursive: true });
+
+      const response = await request(app).get('/api/files');
+      expect(response.status).toBe(200);
+      expect(response.body.files.map((f: any) => f.filename)).not.toContain('.flows_cache');
+
+      // Cleanup
+      fs.rmSync(cacheDir, { recursive: true, force: true });
+    });
   });
 
   describe('GET /api/entities/:filename', () => {
@@ -201,6 +258,53 @@ describe('Backend API Tests', () => {
       expect(response.body.entities).toContain('Firma C');
     });
 
+    it('powinien zwrócić pełną listę bez stron, gdy brak offset i limit', async () => {
+      const response = await request(app).get('/api/entities/test_entities.csv');
+      expect(response.status).toBe(200);
+      expect(response.body.entities).toEqual(['Firma A', 'Firma B', 'Firma C']);
+      expect(response.body.total).toBe(3);
+      expect(response.body).not.toHaveProperty('items');
+      expect(response.body).not.toHaveProperty('offset');
+    });
+
+    it('powinien zwrócić stronę podmiotów dla offset i limit', async () => {
+      const first = await request(app).get('/api/entities/test_entities.csv').query({ limit: 2 });
+      expect(first.status).toBe(200);
+      expect(first.body.entities).toEqual(['Firma A', 'Firma B']);
+      expect(first.body.items.length).toBe(2);
+      expect(first.body.total).toBe(3);
+      expect(first.body.offset).toBe(0);
+
+      const second = await request(app).get('/api/entities/test_entities.csv').query({ offset: 2, limit: 2 });
+      expect(second.body.entities).toEqual(['Firma C']);
+      expect(second.body.total).toBe(3);
+      expect(second.body.offset).toBe(2);
+
+      const count = await request(app).get('/api/entities/test_entities.csv').query({ limit: 0 });
+      expect(count.body.entities).toEqual([]);
+      expect(count.body.total).toBe(3);
+    });
+
+    it('powinien filtrować podmioty prefiksem', async () => {
+      const response = await request(app).get('/api/entities/test_entities.csv').query({ q: 'firma b', limit: 10 });
+      expect(response.body.entities).toEqual(['Firma B']);
+      expect(response.body.total).toBe(1);
+    });
+
+    it('powinien zwrócić błąd 400 dla pliku, którego wykres nie odczyta', async () => {
+      const semicolonFile = path.join(UPLOAD_DIR, 'semicolon.csv');
+      fs.writeFileSync(semicolonFile, 'Nadawca;Odbiorca;Kwota\nFirma A;Firma B;10');
+
+      for (const query of [{}, { limit: 10 }]) {
+        const response = await request(app).get('/api/entities/semicolon.csv').query(query);
+        expect(response.status).toBe(400);
+        expect(response.body.error).toContain('comma-separated');
+      }
+
+      // Cleanup
+      fs.unlinkSync(semicolonFile);
+    });
+
     it('powinien zwrócić błąd 400 dla pustego pliku', async () => {
       // Utwórz pusty plik
       const emptyFile = path.join(UPLOAD_DIR, 'empty.csv');
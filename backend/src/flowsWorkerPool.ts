@@ -0,0 +1,255 @@
+// backend/src/flowsWorkerPool.ts
+
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import readline from 'readline';
+
+export interface FlowsRequest {
+  csv_path: string;
+  entities?: string[];
+  from?: string;
+  to?: string;
+}
+
+// Zapytanie o podmioty pliku (słownik flows_entities)
+export interface FlowsEntitiesRequest {
+  csv_path: string;
+  query?: string;
+  match?: 'prefix' | 'substring';
+  sort?: 'name' | 'volume';
+  offset?: number;
+  limit?: number;
+  // Wszystkie trafienia bez stron (offset i limit są pomijane)
+  all?: boolean;
+}
+
+export interface FlowsEntity {
+  name: string;
+  count: number;
+  total: number;
+}
+
+// Strona podmiotów: łączna liczba trafień, wyniki i profil CSV (kolumny, zakresy)
+export interface FlowsEntitiesPage {
+  total: number;
+  items: FlowsEntity[];
+  profile: any;
+}
+
+// Liczniki cache gotowych wykresów (flows_results.stats) jednego procesu
+export interface FlowsCacheStats {
+  hits: number;
+  disk_hits: number;
+  misses: number;
+  stores: number;
+  evictions: number;
+  entries: number;
+  memory_bytes: number;
+}
+
+interface PendingRequest {
+  resolve: (response: any) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+}
+
+interface FlowsWorker {
+  process: ChildProcessWithoutNullStreams;
+  pending: Map<number, PendingRequest>;
+  dead: boolean;
+}
+
+export interface FlowsWorkerPoolOptions {
+  // Limit czasu jednego żądania (ms); po nim proces jest zabijany i zastępowany
+  requestTimeoutMs?: number;
+  // Opóźnienie pierwszego ponownego uruchomienia (ms), podwajane przy kolejnych awariach
+  restartDelayMs?: number;
+  maxRestartDelayMs?: number;
+  // Liczba awarii z rzędu (bez żadnej odpowiedzi), po której pula przestaje działać
+  maxRestarts?: number;
+}
+
+// Pula długo działających procesów `flows.py --serve`.
+// Każdy proces trzyma sparsowane pliki CSV w pamięci i obsługuje wiele żądań
+// (JSON lines z identyfikatorem), więc nie płacimy za start interpretera przy każdym wykresie.
+// Martwy proces jest zastępowany z rosnącym opóźnieniem; po maxRestarts awariach
+// z rzędu pula jest niedostępna (available() === false) i wywołujący używa osobnych procesów.
+export class FlowsWorkerPool {
+  private workers: FlowsWorker[] = [];
+  private nextId = 1;
+  private closed = false;
+  // Awarie procesów od ostatniej poprawnej odpowiedzi
+  private failures = 0;
+  private restartTimers = new Set<NodeJS.Timeout>();
+  private requestTimeoutMs: number;
+  private restartDelayMs: number;
+  private maxRestartDelayMs: number;
+  private maxRestarts: number;
+
+  constructor(
+    private pythonCmd: string,
+    private scriptPath: string,
+    private size: number,
+    options: FlowsWorkerPoolOptions = {}
+  ) {
+    this.requestTimeoutMs = options.requestTimeoutMs ?? 120_000;
+    this.restartDelayMs = options.restartDelayMs ?? 500;
+    this.maxRestartDelayMs = options.maxRestartDelayMs ?? 30_000;
+    this.maxRestarts = options.maxRestarts ?? 5;
+    for (let i = 0; i < size; i++) {
+      this.workers.push(this.spawnWorker());
+    }
+  }
+
+  // Czy pula może przyjmować żądania (nie jest zamknięta ani wyłączona po awariach)
+  available(): boolean {
+    return !this.closed && this.failures <= this.maxRestarts && this.workers.length > 0;
+  }
+
+  private spawnWorker(): FlowsWorker {
+    const child = spawn(this.pythonCmd, [this.scriptPath, '--serve'], {
+      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
+    });
+    const worker: FlowsWorker = { process: child, pending: new Map(), dead: false };
+
+    const lines = readline.createInterface({ input: child.stdout });
+    lines.on('line', line => {
+      let response: any;
+      try {
+        response = JSON.parse(line);
+      } catch {
+        console.error('Flows worker: invalid response:', line);
+        return;
+      }
+      const request = worker.pending.get(response.id);
+      if (!request) return;
+      worker.pending.delete(response.id);
+      clearTimeout(request.timer);
+      // Proces odpowiada - kolejne awarie liczone od zera
+      this.failures = 0;
+      if (response.metrics) {
+        // Pomiary etapów (FLOWS_METRICS) - jedna linia JSON na wykres
+        console.log(JSON.stringify(response.metrics));
+      }
+      if (response.ok) {
+        request.resolve(response);
+      } else {
+        request.reject(new Error(`Python script error: ${response.error}`));
+      }
+    });
+
+    child.stderr.on('data', data => {
+      console.error('Python stderr:', data.toString());
+    });
+
+    // Błąd uruchomienia (np. brak interpretera - ENOENT/EACCES) i zapis do zamkniętego stdin (EPIPE)
+    child.on('error', error => this.retire(worker, `Flows worker error: ${error.message}`));
+    child.stdin.on('error', error => this.retire(worker, `Flows worker stdin error: ${error.message}`));
+    child.on('exit', code => this.retire(worker, `Flows worker exited with code ${code}`));
+
+    return worker;
+  }
+
+  // Odrzuca żądania martwego procesu i planuje jego zastąpienie (raz na proces)
+  private retire(worker: FlowsWorker, reason: string): void {
+    if (worker.dead) return;
+    worker.dead = true;
+    for (const request of worker.pending.values()) {
+      clearTimeout(request.timer);
+      request.reject(new Error(reason));
+    }
+    worker.pending.clear();
+    worker.process.kill();
+
+    const index = this.workers.indexOf(worker);
+    if (index === -1) return;
+    this.workers.splice(index, 1);
+    if (this.closed) return;
+
+    this.failures++;
+    if (this.failures > this.maxRestarts) {
+      console.error(`${reason}; flows worker pool disabled after ${this.maxRestarts} restarts`);
+      return;
+    }
+    const delay = Math.min(this.restartDelayMs * 2 ** (this.failures - 1), this.maxRestartDelayMs);
+    console.error(`${reason}; restarting in ${delay} ms`);
+    const timer = setTimeout(() => {
+      this.restartTimers.delete(timer);
+      if (!this.closed && this.failures <= this.maxRestarts) {
+        this.workers.push(this.spawnWorker());
+      }
+    }, delay);
+    this.restartTimers.add(timer);
+  }
+
+  // Wysyła wiadomość do procesu i zwraca jego odpowiedź (albo błąd po requestTimeoutMs)
+  private send(worker: FlowsWorker, message: object): Promise<any> {
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        worker.pending.delete(id);
+        reject(new Error(`Flows worker timed out after ${this.requestTimeoutMs} ms`));
+        // Zawieszony proces blokowałby kolejne żądania - zastąp go
+        this.retire(worker, 'Flows worker timed out');
+      }, this.requestTimeoutMs);
+      worker.pending.set(id, { resolve, reject, timer });
+      worker.process.stdin.write(JSON.stringify({ id, ...message }) + '\n');
+    });
+  }
+
+  // Najmniej obciążony proces
+  private leastBusy(): FlowsWorker {
+    if (!this.available()) {
+      throw new Error(this.closed ? 'Flows worker pool is closed' : 'Flows worker pool is unavailable');
+    }
+    return this.workers.reduce((best, current) =>
+      current.pending.size < best.pending.size ? current : best
+    );
+  }
+
+  // Wysyła żądanie do najmniej obciążonego procesu i zwraca treść SVG
+  async render(params: FlowsRequest): Promise<string> {
+    const response = await this.send(this.leastBusy(), params);
+    return response.svg;
+  }
+
+  // Strona podmiotów pliku (prefiks/fragment nazwy, sortowanie, stronicowanie)
+  async entities(params: FlowsEntitiesRequest): Promise<FlowsEntitiesPage> {
+    const { total, items, profile } = await this.send(this.leastBusy(), { command: 'entities', ...params });
+    return { total, items, profile };
+  }
+
+  // Sumuje liczniki cache wyników wszystkich procesów
+  async cacheStats(): Promise<FlowsCacheStats> {
+    const responses = await Promise.all(
+      this.workers.map(worker => this.send(worker, { command: 'stats' }))
+    );
+    const total: FlowsCacheStats = {
+      hits: 0, disk_hits: 0, misses: 0, stores: 0, evictions: 0, entries: 0, memory_bytes: 0
+    };
+    for (const { stats } of responses) {
+      for (const key of Object.keys(total) as (keyof FlowsCacheStats)[]) {
+        total[key] += stats[key] ?? 0;
+      }
+    }
+    return total;
+  }
+
+  // Każdy proces zapomina plik (dane w pamięci, cache na dysku, gotowe wykresy)
+  async invalidate(csvPath: string): Promise<void> {
+    if (this.closed) return;
+    await Promise.all(
+      this.workers.map(worker => this.send(worker, { command: 'invalidate', csv_path: csvPath }))
+    );
+  }
+
+  close(): void {
+    this.closed = true;
+    for (const timer of this.restartTimers) {
+      clearTimeout(timer);
+    }
+    this.restartTimers.clear();
+    for (const worker of this.workers) {
+      worker.process.stdin.end();
+    }
+  }
+}
@@ -5,11 +5,12 @@ import cors from 'cors';
 import multer from 'multer';
 import path from 'path';
 import fs from 'fs';
-import { exec } from 'child_process';
+import { exec, spawn } from 'child_process';
 import { promisify } from 'util';
 import dotenv from 'dotenv';
 import { fileURLToPath } from 'url';
 import os from 'os';
+import { FlowsWorkerPool, FlowsEntitiesRequest, FlowsEntitiesPage } from './flowsWorkerPool.js';
 
 dotenv.config();
 
@@ -20,11 +21,27 @@ const execAsync = promisify(exec);
 const app = express();
 const PORT = process.env.PORT || 3001;
 const UPLOAD_DIR = process.env.UPLOAD_DIR || './uploads';
+// process_file.py czyta plik blokami, więc limit nie wynika z pamięci backendu
+const UPLOAD_MAX_MB = Number(process.env.UPLOAD_MAX_MB ?? 500);
 
 // Wykryj system operacyjny i wybierz odpowiednią komendę Python
 // Na Windows: python, na Mac/Linux: python3
 const PYTHON_CMD = os.platform() === 'win32' ? 'python' : 'python3';
 
+// Liczba stałych procesów flows.py --serve (0 = osobny proces flows.py --stdin na każde żądanie)
+const FLOWS_WORKERS = Number(process.env.FLOWS_WORKERS ?? Math.min(4, os.cpus().length));
+const FLOWS_SCRIPT_PATH = path.join(__dirname, '../../python-scripts/flows.py');
+// Limit czasu jednego wykresu w puli (ms); zawieszony proces jest zastępowany
+const FLOWS_TIMEOUT_MS = Number(process.env.FLOWS_TIMEOUT_MS ?? 120_000);
+const flowsPool = FLOWS_WORKERS > 0
+  ? new FlowsWorkerPool(PYTHON_CMD, FLOWS_SCRIPT_PATH, FLOWS_WORKERS, { requestTimeoutMs: FLOWS_TIMEOUT_MS })
+  : null;
+
+// Pula, jeśli działa; po wyczerpaniu limitu restartów żądania idą do osobnych procesów
+function activePool(): FlowsWorkerPool | null {
+  return flowsPool && flowsPool.available() ? flowsPool : null;
+}
+
 // Upewnij się, że folder uploads istnieje
 if (!fs.existsSync(UPLOAD_DIR)) {
   fs.mkdirSync(UPLOAD_DIR, { recursive: true });
@@ -34,7 +51,10 @@ if (!fs.existsSync(UPLOAD_DIR)) {
 app.use(cors());
 app.use(express.json());
 
-// Endpoint do pobierania listy podmiotów z pliku CSV
+// Endpoint do pobierania podmiotów z pliku CSV (stronicowane, z wyszukiwaniem)
+// Parametry: q (prefiks lub fragment nazwy), match=prefix|substring,
+// sort=name|volume, offset, limit (domyślnie 50, maks. 1000).
+// Bez offset i limit odpowiedź jak dawniej: { entities } - pełna lista nazw
 app.get('/api/entities/:filename', async (req, res) => {
   try {
     const { filename } = req.params;
@@ -42,34 +62,51 @@ app.get('/api/entities/:filename', async (req, res) => {
     if (!fs.existsSync(filePath)) {
       return res.status(404).json({ error: 'File not found' });
     }
-    // Wczytaj plik CSV i zwróć unikalne podmioty
-    const csv = fs.readFileSync(filePath, 'utf-8');
-    const lines = csv ? csv.split(/\r?\n/) : [];
-    if (!lines || lines.length === 0) {
-      return res.status(400).json({ error: 'CSV file is empty' });
-    }
-    const header = lines[0] ? lines[0].split(',') : [];
-    const idxNadawca = header.findIndex(h => h.toLowerCase().includes('nadawca'));
-    const idxOdbiorca = header.findIndex(h => h.toLowerCase().includes('odbiorca'));
-    if (idxNadawca === -1 || idxOdbiorca === -1) {
-      return res.status(400).json({ error: 'CSV must contain Nadawca and Odbiorca columns' });
+    const { q, match, sort, offset, limit } = req.query;
+    const paged = offset !== undefined || limit !== undefined;
+    const params: FlowsEntitiesRequest = {
+      csv_path: filePath,
+      query: typeof q === 'string' ? q : '',
+      match: match === 'substring' ? 'substring' : 'prefix',
+      sort: sort === 'volume' ? 'volume' : 'name',
+      offset: Number(offset) || 0,
+      limit: limit === undefined ? undefined : Number(limit) || 0,
+      all: !paged
+    };
+    // Słownik podmiotów i profil CSV są liczone raz (przy uploadzie)
+    const pool = activePool();
+    const page = pool ? await pool.entities(params) : await runEntitiesScript(params);
+    const error = entitiesError(page.profile);
+    if (error) {
+      return res.status(400).json({ error });
     }
-    const entities = new Set();
-    for (let i = 1; i < lines.length; i++) {
-      const line = lines[i];
-      if (typeof line !== 'string' || !line) continue;
-      const row = line.split(',');
-      if (row.length > Math.max(idxNadawca, idxOdbiorca)) {
-        entities.add(row[idxNadawca]);
-        entities.add(row[idxOdbiorca]);
-      }
+    const entities = page.items.map(item => item.name);
+    if (!paged) {
+      return res.json({ entities, total: page.total });
     }
-    res.json({ entities: Array.from(entities).filter(e => !!e) });
+    res.json({ entities, items: page.items, total: page.total, offset: params.offset });
   } catch (error: any) {
     res.status(500).json({ error: error.message });
   }
 });
 
+// Powód, dla którego z pliku nie da się pokazać podmiotów (null = plik poprawny)
+function entitiesError(profile: any): string | null {
+  if (profile.error) {
+    return profile.error;
+  }
+  if (!profile.header) {
+    return 'CSV file is empty';
+  }
+  if (!profile.columns.sender || !profile.columns.receiver) {
+    return 'CSV must contain Nadawca and Odbiorca columns';
+  }
+  if (profile.flows_compatible === false) {
+    return 'CSV must be comma-separated with exactly named Nadawca, Odbiorca and Kwota columns';
+  }
+  return null;
+}
+
 // Multer configuration dla przechowywania plików
 const storage = multer.diskStorage({
   destination: (req, file, cb) => {
@@ -83,7 +120,7 @@ const storage = multer.diskStorage({
 
 const upload = multer({ 
   storage: storage,
-  limits: { fileSize: 10 * 1024 * 1024 } // 10MB limit
+  limits: { fileSize: UPLOAD_MAX_MB * 1024 * 1024 }
 });
 
 // Funkcja do uruchamiania skryptu Python
@@ -102,6 +139,105 @@ async function runPythonScript(filePath: string): Promise<string> {
   }
 }
 
+// Strona podmiotów bez puli procesów (flows_entities.py, wynik JSON na stdout)
+function runEntitiesScript(params: FlowsEntitiesRequest): Promise<FlowsEntitiesPage> {
+  const scriptPath = path.join(__dirname, '../../python-scripts/flows_entities.py');
+  const args = [
+    scriptPath, params.csv_path,
+    '--query', params.query ?? '',
+    '--match', params.match ?? 'prefix',
+    '--sort', params.sort ?? 'name',
+    '--offset', String(params.offset ?? 0)
+  ];
+  if (params.all) {
+    args.push('--all');
+  } else if (params.limit !== undefined) {
+    args.push('--limit', String(params.limit));
+  }
+  return new Promise((resolve, reject) => {
+    const child = spawn(PYTHON_CMD, args, {
+      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
+    });
+    const stdout: Buffer[] = [];
+    let stderr = '';
+
+    child.stdout.on('data', chunk => stdout.push(chunk));
+    child.stderr.on('data', chunk => { stderr += chunk.toString(); });
+    child.on('error', reject);
+    child.on('close', code => {
+      if (code !== 0) {
+        return reject(new Error(`Python script error: ${stderr || `exit code ${code}`}`));
+      }
+      try {
+        resolve(JSON.parse(Buffer.concat(stdout).toString('utf-8')));
+      } catch (error: any) {
+        reject(new Error(`Python script error: ${error.message}`));
+      }
+    });
+  });
+}
+
+// Uruchamia flows.py jako osobny proces: parametry JSON na stdin, SVG ze stdout.
+// Brak współdzielonych plików pozwala generować wiele wykresów równolegle.
+function runFlowsScript(params: object): Promise<string> {
+  return new Promise((resolve, reject) => {
+    const child = spawn(PYTHON_CMD, [FLOWS_SCRIPT_PATH, '--stdin'], {
+      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
+    });
+    const stdout: Buffer[] = [];
+    let stderr = '';
+
+    child.stdout.on('data', chunk => stdout.push(chunk));
+    child.stderr.on('data', chunk => { stderr += chunk.toString(); });
+    child.on('error', reject);
+    child.on('close', code => {
+      if (code !== 0) {
+        return reject(new Error(`Python script error: ${stderr || `exit code ${code}`}`));
+      }
+      resolve(Buffer.concat(stdout).toString('utf-8'));
+    });
+
+    child.stdin.end(JSON.stringify(params));
+  });
+}
+
+// Buduje w tle binarny cache i kostkę czasu pliku (flows.py --prepare), żeby
+// zmiana zakresu dat w wykresie nie wymagała ponownego przeglądania wierszy.
+function prepareFlowsData(filePath: string): void {
+  const child = spawn(PYTHON_CMD, [FLOWS_SCRIPT_PATH, '--prepare', '--csv-path', filePath], {
+    env: { ...process.env, PYTHONIOENCODING: 'utf-8' },
+    stdio: ['ignore', 'ignore', 'pipe']
+  });
+  let stderr = '';
+  child.stderr.on('data', chunk => { stderr += chunk.toString(); });
+  child.on('error', error => console.error('Flows prepare error:', error));
+  child.on('close', code => {
+    if (code !== 0) {
+      console.error('Flows prepare error:', stderr || `exit code ${code}`);
+    }
+  });
+}
+
+// Usuwa cache, kostkę i gotowe wykresy pliku (w procesach puli i na dysku)
+async function invalidateFlowsData(filePath: string): Promise<void> {
+  const pool = activePool();
+  if (pool) {
+    await pool.invalidate(filePath);
+    return;
+  }
+  await new Promise<void>(resolve => {
+    const child = spawn(PYTHON_CMD, [FLOWS_SCRIPT_PATH, '--invalidate', '--csv-path', filePath], {
+      env: { ...process.env, PYTHONIOENCODING: 'utf-8' },
+      stdio: 'ignore'
+    });
+    child.on('error', error => {
+      console.error('Flows invalidate error:', error);
+      resolve();
+    });
+    child.on('close', () => resolve());
+  });
+}
+
 // Routes
 app.get('/', (req, res) => {
   res.json({ message: 'Backend API is running!' });
@@ -118,6 +254,7 @@ app.post('/api/upload', upload.single('file'), async (req, res) => {
     
     // Uruchom skrypt Python
     const pythonResult = await runPythonScript(filePath);
+    prepareFlowsData(filePath);
     
     res.json({
       success: true,
@@ -140,7 +277,7 @@ app.post('/api/upload', upload.single('file'), async (req, res) => {
 app.get('/api/files', (req, res) => {
   try {
     const files = fs.readdirSync(UPLOAD_DIR)
-      .filter(file => file !== '.gitkeep')
+      .filter(file => !file.startsWith('.')) // pomiń .gitkeep i katalog cache .flows_cache
       .map(filename => {
         const filePath = path.join(UPLOAD_DIR, filename);
         const stats = fs.statSync(filePath);
@@ -158,7 +295,7 @@ app.get('/api/files', (req, res) => {
 });
 
 // Delete file endpoint
-app.delete('/api/files/:filename', (req, res) => {
+app.delete('/api/files/:filename', async (req, res) => {
   try {
     const filePath = path.join(UPLOAD_DIR, req.params.filename);
     
@@ -167,6 +304,11 @@ app.delete('/api/files/:filename', (req, res) => {
     }
     
     fs.unlinkSync(filePath);
+    try {
+      await invalidateFlowsData(filePath);
+    } catch (error: any) {
+      console.error('Flows invalidate error:', error);
+    }
     res.json({ success: true, message: 'File deleted successfully' });
   } catch (error: any) {
     res.status(500).json({ error: error.message });
@@ -177,7 +319,7 @@ app.delete('/api/files/:filename', (req, res) => {
 // Endpoint do generowania wykresu przepływów finansowych
 app.post('/api/flows', async (req, res) => {
   try {
-    const { filename, entities, from, to } = req.body;
+    const { filename, entities, from, to, top, minValue, minPercent } = req.body;
     if (!filename) {
       return res.status(400).json({ error: 'No filename provided' });
     }
@@ -186,31 +328,26 @@ app.post('/api/flows', async (req, res) => {
       return res.status(404).json({ error: 'File not found' });
     }
 
-    // Przygotuj argumenty do flows.py
-    const scriptPath = path.join(__dirname, '../../python-scripts/flows.py');
-    // Zapisz parametry do pliku tymczasowego (np. JSON), bo flows.py nie przyjmuje argumentów
     const params = {
       csv_path: filePath,
       entities,
       from,
-      to
+      to,
+      // Opcjonalnie: tylko N największych przepływów / progi, reszta zwinięta do „Inne”
+      top,
+      min_value: minValue,
+      min_percent: minPercent
     };
-    const paramsPath = path.join(__dirname, '../../python-scripts/flows_params.json');
-    fs.writeFileSync(paramsPath, JSON.stringify(params));
 
-    // Uruchom flows.py
-    const command = `${PYTHON_CMD} "${scriptPath}"`;
-    const { stdout, stderr } = await execAsync(command);
-    if (stderr) {
-      console.error('Python stderr:', stderr);
+    let svgContent: string;
+    const pool = activePool();
+    if (pool) {
+      // Wyślij żądanie do puli procesów flows.py --serve
+      svgContent = await pool.render(params);
+    } else {
+      // Osobny proces na żądanie: parametry przez stdin, SVG na stdout
+      svgContent = await runFlowsScript(params);
     }
-
-    // Odczytaj wygenerowany plik SVG
-    const svgPath = path.join(__dirname, '../../python-scripts/przeplywy_finansowe.svg');
-    if (!fs.existsSync(svgPath)) {
-      return res.status(500).json({ error: 'SVG file not generated' });
-    }
-    const svgContent = fs.readFileSync(svgPath, 'utf-8');
     res.setHeader('Content-Type', 'image/svg+xml');
     res.send(svgContent);
   } catch (error: any) {
@@ -219,6 +356,19 @@ app.post('/api/flows', async (req, res) => {
   }
 });
 
+// Liczniki cache gotowych wykresów (suma po procesach puli)
+app.get('/api/flows/cache', async (req, res) => {
+  try {
+    const pool = activePool();
+    if (!pool) {
+      return res.json({ enabled: false });
+    }
+    res.json({ enabled: true, workers: FLOWS_WORKERS, ...(await pool.cacheStats()) });
+  } catch (error: any) {
+    res.status(500).json({ error: error.message });
+  }
+});
+
 app.listen(PORT, () => {
   console.log(`🚀 Backend server running on http://localhost:${PORT}`);
 });
\ No newline at end of file
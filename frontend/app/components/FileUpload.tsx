@@ -114,15 +114,17 @@ export default function FileUpload() {
 
   const showFileInfo = async (filename: string) => {
     try {
-      // Pobierz entities dla pliku
-      const entitiesResponse = await axios.get(`${API_URL}/api/entities/${filename}`);
+      // Pobierz liczbę podmiotów i największe z nich (po sumie kwot)
+      const entitiesResponse = await axios.get(`${API_URL}/api/entities/${filename}`, {
+        params: { sort: 'volume', limit: 100 }
+      });
       const file = files.find(f => f.filename === filename);
       
       setFileInfo({
         filename: filename,
         uploadedAt: file?.uploadedAt,
         size: file?.size,
-        entities: entitiesResponse.data.entities.length,
+        entities: entitiesResponse.data.total,
         entitiesList: entitiesResponse.data.entities
       });
       setShowInfoModal(true);
@@ -161,7 +163,9 @@ export default function FileUpload() {
       setChartSVG(response.data);
       
       // Pobierz statystyki
-      const entitiesResponse = await axios.get(`${API_URL}/api/entities/${csvFile.filename}`);
+      const entitiesResponse = await axios.get(`${API_URL}/api/entities/${csvFile.filename}`, {
+        params: { limit: 0 }
+      });
       
       // Szacuj liczbę transakcji (przybliżona - można by dodać endpoint do tego)
       const fileSize = files.find(f => f.filename === csvFile.filename)?.size || 0;
@@ -169,7 +173,7 @@ export default function FileUpload() {
       
       setDiagramStats({
         documents: files.filter(f => f.filename.endsWith('.csv')).length,
-        entities: entitiesResponse.data.entities.length,
+        entities: entitiesResponse.data.total,
         transactions: estimatedTransactions
       });
       
@@ -552,7 +556,9 @@ export default function FileUpload() {
                 <p className="text-3xl font-bold text-purple-600 mb-3">{fileInfo.entities} firm</p>
                 <details className="text-sm">
                   <summary className="cursor-pointer text-blue-600 hover:text-blue-800 font-medium">
-                    Zobacz listę firm
+                    {fileInfo.entitiesList?.length < fileInfo.entities
+                      ? `Zobacz ${fileInfo.entitiesList.length} największych firm`
+                      : 'Zobacz listę firm'}
                   </summary>
                   <div className="mt-2 space-y-1">
                     {fileInfo.entitiesList?.map((entity: string, idx: number) => (
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# python-scripts/bench_flows.py
+"""
+Benchmarki wykresu przepływów.
+
+Układ i generowanie SVG dla losowego grafu:
+    python3 bench_flows.py --nodes 10000 --edges 100000
+
+Cały potok (parse_csv, filter_flows, aggregate_flows, generate_sankey_svg) na
+syntetycznym pliku CSV - czas i szczyt pamięci każdego etapu:
+    python3 bench_flows.py --rows 100000 --entities 500 --shape star --malformed 0.02
+    python3 bench_flows.py --rows 100000 --save-baseline baseline.json
+    python3 bench_flows.py --rows 100000 --baseline baseline.json --threshold 0.25
+
+Z --baseline skrypt kończy się kodem 1, gdy któryś etap jest wolniejszy (lub
+zużywa więcej pamięci) o więcej niż --threshold względem zapisanego wyniku.
+--generate PLIK tylko zapisuje syntetyczny plik CSV.
+"""
+
+import argparse
+import csv
+import gc
+import gzip
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import flows
+from flows import generate_sankey_svg
+from flows_layout import Adjacency, compute_layout
+from flows_table import EdgeList
+
+SHAPES = ('chain', 'star', 'dense')
+MODES = ('dicts', 'table', 'stream')
+# Pierwszy dzień syntetycznych danych
+START_DAY = date(2024, 1, 1)
+# Etapy krótsze niż tyle sekund nie są uznawane za regresję (szum pomiaru)
+MIN_SECONDS = 0.005
+# Wzrost szczytu pamięci mniejszy niż tyle bajtów nie jest regresją
+MIN_PEAK_BYTES = 256 * 1024
+
+
+def random_edges(nodes, edges, seed=42):
+    """Deterministyczny losowy graf przepływów o zadanej liczbie węzłów i krawędzi"""
+    rng = random.Random(seed)
+    graph = EdgeList()
+    for i in range(nodes):
+        graph.node(f'Podmiot {i}')
+    while len(graph) < edges:
+        s = rng.randrange(nodes)
+        t = rng.randrange(nodes)
+        if s != t:
+            graph.add(graph.names[s], graph.names[t], round(rng.uniform(1, 100000), 2))
+    return graph
+
+
+def bench_layout(nodes, edges, top=None):
+    """Mierzy budowę sąsiedztwa, układ warstwowy i pełne generowanie SVG; zwraca czasy w sekundach"""
+    graph = random_edges(nodes, edges)
+
+    start = time.perf_counter()
+    Adjacency.from_edges(graph)
+    adjacency_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    layout = compute_layout(graph)
+    layout_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    svg = generate_sankey_svg(graph, top=top)
+    render_time = time.perf_counter() - start
+
+    return {
+        'nodes': nodes,
+        'edges': edges,
+        'adjacency_s': round(adjacency_time, 4),
+        'layout_s': round(layout_time, 4),
+        'layers': len(layout.layers),
+        'render_s': round(render_time, 4),
+        'svg_bytes': len(svg.encode('utf-8')),
+        'svgz_bytes': len(gzip.compress(svg.encode('utf-8'), mtime=0)),
+    }
+
+
+def _pair(rng, shape, entities):
+    """Losowa para (nadawca, odbiorca) dla kształtu grafu"""
+    if shape == 'chain':
+        # Łańcuch dostaw: i -> i+1, czasem przeskok o kilka ogniw
+        s = rng.randrange(entities - 1)
+        return s, min(s + 1 + int(rng.expovariate(1.5)), entities - 1)
+    if shape == 'star':
+        # Centrala rozlicza się ze wszystkimi (w obie strony)
+        other = rng.randrange(1, entities)
+        return (0, other) if rng.random() < 0.5 else (other, 0)
+    s = rng.randrange(entities)
+    t = rng.randrange(entities - 1)
+    return s, t + (t >= s)
+
+
+def _malformed_row(rng, sender, receiver, amount, day):
+    """Wiersz z jednym z typowych błędów danych"""
+    kind = rng.randrange(6)
+    if kind == 0:
+        return [sender, receiver, '', day, 'Brak kwoty']
+    if kind == 1:
+        return [sender, receiver, 'abc', day, 'Kwota nie jest liczbą']
+    if kind == 2:
+        return [sender, receiver, f'-{amount}', day, 'Kwota ujemna']
+    if kind == 3:
+        return [sender, receiver, amount, '2024-13-45', 'Zła data']
+    if kind == 4:
+        return ['', receiver, amount, day, 'Brak nadawcy']
+    return [sender, receiver]
+
+
+def generate_ledger(path, rows, entities=100, shape='dense', days=365, malformed=0.0, seed=42):
+    """
+    Zapisuje deterministyczny syntetyczny plik przepływów (Nadawca, Odbiorca,
+    Kwota, Data, Opis). Wiersze są generowane strumieniowo, więc rozmiar
+    pliku nie jest ograniczony pamięcią. `malformed` to udział błędnych wierszy
+    (brak/niepoprawna kwota, zła data, brak nadawcy, brakujące kolumny).
+    Zwraca liczbę zapisanych wierszy.
+    """
+    if shape not in SHAPES:
+        raise ValueError(f'Unknown shape: {shape}')
+    if entities < 2:
+        raise ValueError('At least two entities are required')
+    rng = random.Random(seed)
+    names = [f'Podmiot {i:05d}' for i in range(entities)]
+    dates = [(START_DAY + timedelta(days=d)).isoformat() for d in range(max(days, 1))]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Nadawca', 'Odbiorca', 'Kwota', 'Data', 'Opis'])
+        for i in range(rows):
+            s, r = _pair(rng, shape, entities)
+            amount = f'{rng.lognormvariate(7, 1.5):.2f}'
+            day = dates[rng.randrange(len(dates))]
+            if malformed and rng.random() < malformed:
+                writer.writerow(_malformed_row(rng, names[s], names[r], amount, day))
+            else:
+                writer.writerow([names[s], names[r], amount, day, f'Przelew {i}'])
+    return rows
+
+
+def _run_stage(name, function, track_memory):
+    """Uruchamia etap; zwraca (wynik, czas w sekundach, szczyt pamięci w bajtach lub None)"""
+    gc.collect()
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        value = function()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    finally:
+        if track_memory:
+            tracemalloc.stop()
+    return value, elapsed, peak
+
+
+def pipeline_stages(csv_path, mode, entities=None, date_from=None, date_to=None, top=None):
+    """
+    Etapy potoku jako lista (nazwa, funkcja poprzedni_wynik -> wynik):
+    dicts - lista słowników (parse_csv, filter_flows, aggregate_flows),
+    table - FlowTable (load_table, filter_table, aggregate_table),
+    stream - jedno przejście po pliku (stream_aggregate).
+    Ostatni etap to zawsze generate_sankey_svg.
+    """
+    render = ('generate_sankey_svg', lambda aggregated: generate_sankey_svg(aggregated, top=top))
+    if mode == 'dicts':
+        return [
+            ('parse_csv', lambda _: flows.parse_csv(csv_path)),
+            ('filter_flows', lambda rows: flows.filter_flows(rows, entities, date_from, date_to)),
+            ('aggregate_flows', flows.aggregate_flows),
+            render,
+        ]
+    if mode == 'table':
+        return [
+            ('load_table', lambda _: flows.FlowTable.from_csv(csv_path)),
+            ('filter_table', lambda table: flows.filter_table(table, entities, date_from, date_to)),
+            ('aggregate_table', flows.aggregate_table),
+            render,
+        ]
+    if mode == 'stream':
+        return [
+            ('stream_aggregate', lambda _: flows.stream_aggregate(csv_path, entities, date_from, date_to)),
+            render,
+        ]
+    raise ValueError(f'Unknown mode: {mode}')
+
+
+def bench_pipeline(csv_path, mode='dicts', entities=None, date_from=None, date_to=None, top=None,
+                   repeat=1, memory=True):
+    """
+    Mierzy etapy potoku na pliku CSV. Czas to minimum z `repeat` przebiegów
+    bez tracemalloc; szczyt pamięci (tracemalloc, osobny przebieg) to
+    najwięcej zaalokowanej pamięci w trakcie etapu. Zwraca słownik
+    {etap: {'seconds': ..., 'peak_bytes': ...}}.
+    """
+    stages = pipeline_stages(csv_path, mode, entities, date_from, date_to, top)
+    results = {name: {'seconds': None, 'peak_bytes': None} for name, _ in stages}
+    for track_memory in [False] * repeat + ([True] if memory else []):
+        value = None
+        for name, function in stages:
+            value, elapsed, peak = _run_stage(name, lambda: function(value), track_memory)
+            if track_memory:
+                results[name]['peak_bytes'] = peak
+            else:
+                best = results[name]['seconds']
+                results[name]['seconds'] = elapsed if best is None else min(best, elapsed)
+        value = None
+    for stage in results.values():
+        if stage['seconds'] is not None:
+            stage['seconds'] = round(stage['seconds'], 6)
+    return results
+
+
+def compare_results(current, baseline, threshold, min_seconds=MIN_SECONDS, min_peak_bytes=MIN_PEAK_BYTES):
+    """
+    Porównuje etapy z wynikiem bazowym; zwraca listę opisów regresji.
+    Regresja: wartość większa o ponad `threshold` (ułamek) i o więcej niż
+    próg bezwzględny (min_seconds / min_peak_bytes).
+    """
+    regressions = []
+    for name, stage in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, floor in (('seconds', min_seconds), ('peak_bytes', min_peak_bytes)):
+            now, before = stage.get(metric), base.get(metric)
+            if now is None or before is None:
+                continue
+            if now - before > max(before * threshold, floor):
+                change = (now / before - 1) * 100 if before else float('inf')
+                regressions.append(f'{name}.{metric}: {before} -> {now} (+{change:.0f}%)')
+    return regressions
+
+
+def _format_bytes(value):
+    return '-' if value is None else f'{value / 1024 / 1024:.1f} MB'
+
+
+def run_pipeline_bench(args):
+    """Generuje plik (lub używa --csv-path), mierzy potok, zapisuje/porównuje wynik"""
+    config = {
+        'rows': args.rows,
+        'entities': args.entities,
+        'shape': args.shape,
+        'days': args.days,
+        'malformed': args.malformed,
+        'seed': args.seed,
+        'mode': args.mode,
+        'filter_entities': args.filter_entities,
+        'from': args.date_from,
+        'to': args.date_to,
+        'top': args.top,
+    }
+    csv_path = args.csv_path
+    temporary = None
+    if not csv_path:
+        fd, temporary = tempfile.mkstemp(suffix='.csv', prefix='bench_flows_')
+        os.close(fd)
+        csv_path = temporary
+        start = time.perf_counter()
+        generate_ledger(csv_path, args.rows, args.entities, args.shape, args.days, args.malformed, args.seed)
+        print(f"Wygenerowano {args.rows} wierszy ({os.path.getsize(csv_path) / 1024 / 1024:.1f} MB) "
+              f"w {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    else:
+        config['csv_path'] = os.path.abspath(csv_path)
+    try:
+        stages = bench_pipeline(csv_path, args.mode, args.filter_entities, args.date_from, args.date_to,
+                                args.top, args.repeat, not args.no_memory)
+    finally:
+        if temporary:
+            os.remove(temporary)
+
+    result = {
+        'config': config,
+        'python': platform.python_version(),
+        'stages': stages,
+    }
+    for name, stage in stages.items():
+        print(f"{name:20s} {stage['seconds']:10.4f} s  {_format_bytes(stage['peak_bytes']):>10s}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Wynik bazowy zapisany: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print('Uwaga: konfiguracja różni się od wyniku bazowego', file=sys.stderr)
+        regressions = compare_results(stages, baseline['stages'], args.threshold)
+        for regression in regressions:
+            print(f"Regresja: {regression}")
+        if regressions:
+            return 1
+        print(f"Brak regresji (próg {args.threshold * 100:.0f}%)")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarki wykresu przepływów')
+    layout = parser.add_argument_group('układ wykresu (bez --rows)')
+    layout.add_argument('--nodes', type=int, default=10000)
+    layout.add_argument('--edges', type=int, default=100000)
+    parser.add_argument('--top', type=int, help='rysuj tylko N największych przepływów')
+
+    pipeline = parser.add_argument_group('potok na syntetycznym pliku CSV')
+    pipeline.add_argument('--rows', type=int, help='liczba wierszy (np. 1000 - 10000000)')
+    pipeline.add_argument('--entities', type=int, default=100, help='liczba podmiotów')
+    pipeline.add_argument('--shape', choices=SHAPES, default='dense', help='kształt grafu')
+    pipeline.add_argument('--days', type=int, default=365, help='zakres dat w dniach od 2024-01-01')
+    pipeline.add_argument('--malformed', type=float, default=0.0, help='udział błędnych wierszy (0-1)')
+    pipeline.add_argument('--seed', type=int, default=42)
+    pipeline.add_argument('--mode', choices=MODES, default='dicts',
+                          help='dicts: parse_csv/filter_flows/aggregate_flows, table: FlowTable, '
+                               'stream: stream_aggregate')
+    pipeline.add_argument('--csv-path', dest='csv_path', help='użyj istniejącego pliku zamiast generować')
+    pipeline.add_argument('--entity', dest='filter_entities', action='append',
+                          help='filtr podmiotów (można podać wielokrotnie)')
+    pipeline.add_argument('--from', dest='date_from', help='filtr: data początkowa (YYYY-MM-DD)')
+    pipeline.add_argument('--to', dest='date_to', help='filtr: data końcowa (YYYY-MM-DD)')
+    pipeline.add_argument('--repeat', type=int, default=1, help='liczba przebiegów (czas = minimum)')
+    pipeline.add_argument('--no-memory', action='store_true', help='bez pomiaru pamięci (tracemalloc)')
+    pipeline.add_argument('--save-baseline', help='zapisz wynik jako JSON')
+    pipeline.add_argument('--baseline', help='porównaj z wynikiem JSON')
+    pipeline.add_argument('--threshold', type=float, default=0.2,
+                          help='dopuszczalny wzrost czasu/pamięci względem bazowego (ułamek, domyślnie 0.2)')
+    pipeline.add_argument('--generate', metavar='PLIK', help='tylko zapisz syntetyczny plik CSV')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.generate:
+        generate_ledger(args.generate, args.rows or 1000, args.entities, args.shape, args.days,
+                        args.malformed, args.seed)
+        print(f"Zapisano: {args.generate}")
+        return 0
+    if args.rows or args.csv_path:
+        args.rows = args.rows or 0
+        return run_pipeline_bench(args)
+
+    result = bench_layout(args.nodes, args.edges, args.top)
+    print(f"Węzły: {result['nodes']}, krawędzie: {result['edges']}")
+    print(f"Sąsiedztwo: {result['adjacency_s']:.3f} s")
+    print(f"Układ warstwowy: {result['layout_s']:.3f} s ({result['layers']} warstw)")
+    print(f"Generowanie SVG: {result['render_s']:.3f} s ({result['svg_bytes'] / 1024 / 1024:.1f} MB, "
+          f"svgz {result['svgz_bytes'] / 1024 / 1024:.1f} MB)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,43 @@
 #!/usr/bin/env python3
 # python-scripts/flows.py
 
+import argparse
+import hashlib
+import io
 import json
 import os
+import sys
 import csv
-from datetime import datetime
-from collections import defaultdict
+import itertools
+from collections import defaultdict, OrderedDict
+from flows_table import (
+    FlowTable, EdgeList, ExactSum, AmountFormat, AMOUNT_SAMPLE_ROWS, NO_DATE,
+    parse_amount, parse_day, record_amount_format, record_date_format
+)
+import flows_cache
+import flows_cube
+import flows_entities
+import flows_results
+import flows_metrics
+import flows_parallel
+import flows_incremental
+import process_file
+import flows_numpy
+from flows_layout import compute_layout, collapse_edges, LAYOUT_ITERATIONS
+import flows_svg
+from flows_svg import DEFAULT_PRECISION
+
+# Maksymalna liczba zbiorów danych trzymanych w pamięci przez proces serwera
+MAX_CACHED_DATASETS = int(os.environ.get('FLOWS_MAX_DATASETS', '8'))
+
+# Cache sparsowanych plików CSV: ścieżka -> ((rozmiar, mtime), FlowTable)
+_datasets = OrderedDict()
+# Kostki czasu: ścieżka -> ((rozmiar, mtime), TimeCube)
+_cubes = OrderedDict()
+# Słowniki podmiotów: ścieżka -> ((rozmiar, mtime), EntityDictionary)
+_entities = OrderedDict()
+# Profile CSV (process_file): ścieżka -> ((rozmiar, mtime), profil)
+_profiles = OrderedDict()
 
 def load_params():
     """Wczytuje parametry z pliku JSON"""
@@ -21,210 +53,322 @@ def load_params():
     with open(params_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def iter_csv(csv_path):
+    """Czyta plik CSV wiersz po wierszu (generator słowników)"""
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
 def parse_csv(csv_path):
     """Parsuje plik CSV i zwraca dane przepływów"""
-    flows = []
-    
     try:
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                flows.append(row)
+        return list(iter_csv(csv_path))
     except Exception as e:
-        print(f"Error reading CSV: {e}")
+        print(f"Error reading CSV: {e}", file=sys.stderr)
         return []
+
+def load_table(csv_path):
+    """Wczytuje plik CSV do kolumnowej tabeli FlowTable (przez binarny cache, jeśli włączony)"""
+    if flows_cache.cache_enabled() and os.path.isfile(csv_path):
+        table = flows_cache.load_cached_table(csv_path)
+        if table is not None:
+            return table
     
-    return flows
+    try:
+        return FlowTable.from_csv(csv_path)
+    except Exception as e:
+        print(f"Error reading CSV: {e}", file=sys.stderr)
+        return FlowTable(csv_path=csv_path)
+
+def iter_filtered(flows, entities=None, date_from=None, date_to=None):
+    """
+    Filtruje przepływy według podmiotów i dat (generator). Daty są porównywane
+    jako numery dni; format dat jest rozpoznawany raz, z pierwszych przepływów.
+    """
+    entity_set = set(entities) if entities else None
+    start = parse_day(date_from) if date_from else NO_DATE
+    end = parse_day(date_to) if date_to else NO_DATE
+    by_date = start != NO_DATE or end != NO_DATE
+    if by_date:
+        flows = iter(flows)
+        sample = list(itertools.islice(flows, AMOUNT_SAMPLE_ROWS))
+        # Daty w pliku powtarzają się - DateFormat parsuje każdy napis tylko raz
+        date_format = record_date_format(sample)
+        known, day_of = date_format.days or {}, date_format.day
+        flows = itertools.chain(sample, flows)
+    
+    for f in flows:
+        # Filtruj według podmiotów
+        if entity_set is not None and f.get('Nadawca') not in entity_set and f.get('Odbiorca') not in entity_set:
+            continue
+        
+        # Filtruj według dat (wiersze bez poprawnej daty zostają)
+        if by_date and 'Data' in f:
+            value = f['Data']
+            day = known.get(value)
+            if day is None:
+                day = day_of(value)
+            if day != NO_DATE and ((start and start > day) or (end and end < day)):
+                continue
+        
+        yield f
+
+def filter_table(table, entities=None, date_from=None, date_to=None):
+    """
+    Filtruje FlowTable przez indeksy tabeli; z NumPy (jeśli dostępny) pozostały
+    warunek to maska na zawężonych wierszach zamiast pętli w Pythonie.
+    """
+    if flows_numpy.enabled():
+        return flows_numpy.filter_table(table, entities, date_from, date_to)
+    return table.filter(entities, date_from, date_to)
+
+def aggregate_table(table, exact=False):
+    """
+    Agreguje FlowTable do EdgeList silnikiem NumPy (jeśli dostępny) lub w Pythonie.
+    Z exact=True sumy są dokładne (FlowTable.aggregate_pairs, bez NumPy).
+    """
+    if flows_numpy.enabled() and not exact:
+        return flows_numpy.aggregate_pairs(table)
+    return table.aggregate_pairs(exact)
 
 def filter_flows(flows, entities=None, date_from=None, date_to=None):
-    """Filtruje przepływy według podmiotów i dat"""
-    filtered = flows
-    
-    # Filtruj według podmiotów
-    if entities and len(entities) > 0:
-        filtered = [
-            f for f in filtered 
-            if f.get('Nadawca') in entities or f.get('Odbiorca') in entities
-        ]
-    
-    # Filtruj według dat (jeśli kolumna 'Data' istnieje)
-    if date_from or date_to:
-        filtered_by_date = []
-        for f in filtered:
-            if 'Data' in f:
-                try:
-                    flow_date = datetime.strptime(f['Data'], '%Y-%m-%d')
-                    if date_from and datetime.strptime(date_from, '%Y-%m-%d') > flow_date:
-                        continue
-                    if date_to and datetime.strptime(date_to, '%Y-%m-%d') < flow_date:
-                        continue
-                    filtered_by_date.append(f)
-                except:
-                    filtered_by_date.append(f)
-            else:
-                filtered_by_date.append(f)
-        filtered = filtered_by_date
-    
-    return filtered
+    """Filtruje przepływy według podmiotów i dat (lista słowników lub FlowTable)"""
+    if isinstance(flows, FlowTable):
+        return filter_table(flows, entities, date_from, date_to)
+    return list(iter_filtered(flows, entities, date_from, date_to))
 
-def aggregate_flows(flows):
-    """Agreguje przepływy między podmiotami"""
-    aggregated = defaultdict(float)
+def detect_amount(flows):
+    """
+    Rozpoznaje kolumnę i format kwot (AmountFormat) z pierwszych przepływów.
+    Zwraca (format, strumień przepływów razem z próbką).
+    """
+    flows = iter(flows)
+    sample = list(itertools.islice(flows, AMOUNT_SAMPLE_ROWS))
+    return record_amount_format(sample), itertools.chain(sample, flows)
+
+def file_amount_format(csv_path):
+    """Kolumna i format kwot pliku CSV (z pierwszych wierszy)"""
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        return detect_amount(csv.DictReader(f))[0]
+
+def fold_pairs(flows, pairs, amount=None):
+    """
+    Dodaje kwoty ze strumienia przepływów do słownika {(nadawca, odbiorca): kwota}.
+    Kolumna i format kwot (amount) są ustalane raz - domyślnie z pierwszych przepływów.
+    """
+    if amount is None:
+        amount, flows = detect_amount(flows)
+    column, convert = amount.column, amount.convert
     
     for flow in flows:
         sender = flow.get('Nadawca', 'Unknown')
         receiver = flow.get('Odbiorca', 'Unknown')
         
-        # Spróbuj znaleźć kolumnę z kwotą
-        amount = 0
-        for key in ['Kwota', 'Amount', 'Value', 'Wartość']:
-            if key in flow:
-                try:
-                    # Usuń spacje i zastąp przecinek kropką
-                    amount_str = str(flow[key]).replace(' ', '').replace(',', '.')
-                    amount = float(amount_str)
-                    break
-                except:
-                    continue
+        value = 0
+        if column in flow:
+            try:
+                value = convert(flow[column])
+            except (AttributeError, TypeError, ValueError):
+                # Wartość w innym formacie niż reszta pliku
+                value = parse_amount(flow[column]) or 0
         
-        if amount > 0 and sender and receiver:
-            key = f"{sender}→{receiver}"
-            aggregated[key] += amount
+        if value > 0 and sender and receiver:
+            pairs[(sender, receiver)] += value
     
-    return aggregated
+    return pairs
 
-def generate_sankey_svg(aggregated_flows):
-    """Generuje prosty wykres Sankey w formacie SVG"""
-    
-    if not aggregated_flows:
-        return generate_empty_svg()
-    
-    # Zbierz wszystkie węzły
-    nodes = set()
-    for key in aggregated_flows.keys():
-        sender, receiver = key.split('→')
-        nodes.add(sender)
-        nodes.add(receiver)
-    
-    nodes_list = sorted(list(nodes))
-    node_index = {node: i for i, node in enumerate(nodes_list)}
-    
-    # Parametry SVG
-    width = 800
-    height = 600
-    margin = 100
-    node_width = 20
-    
-    # Pozycje węzłów
-    left_nodes = []
-    right_nodes = []
+def aggregate_flows(flows):
+    """Agreguje przepływy między podmiotami (dowolny iterowalny strumień lub FlowTable)"""
+    if isinstance(flows, FlowTable):
+        return aggregate_table(flows).to_dict()
+    return EdgeList.from_pairs(fold_pairs(flows, defaultdict(float))).to_dict()
+
+def stream_aggregate(csv_path, entities=None, date_from=None, date_to=None, exact=False):
+    """
+    Jednoprzebiegowy potok: czytanie → filtrowanie → agregacja.
+    Pamięć zależy od liczby par nadawca/odbiorca, a nie od liczby wierszy.
+    Z exact=True sumy są dokładne (ExactSum), jak w parallel_aggregate.
+    Zwraca EdgeList.
+    """
+    try:
+        # Format kwot z początku pliku, a nie z wierszy, które przeszły filtr
+        amount, flows = detect_amount(iter_csv(csv_path))
+        pairs = fold_pairs(iter_filtered(flows, entities, date_from, date_to),
+                           defaultdict(ExactSum if exact else float), amount)
+    except Exception as e:
+        print(f"Error reading CSV: {e}", file=sys.stderr)
+        return EdgeList()
+    if exact:
+        pairs = {pair: float(total) for pair, total in pairs.items()}
+    return EdgeList.from_pairs(pairs)
+
+def _fold_records(records, header, entities, date_from, date_to, pairs, amount):
+    """Filtruje rekordy CSV (tekst) i dodaje kwoty do słownika dokładnych sum par"""
+    rows = csv.DictReader(records, fieldnames=header)
+    return fold_pairs(iter_filtered(rows, entities, date_from, date_to), pairs, amount)
+
+def _aggregate_range(task):
+    """
+    Parsuje, filtruje i wstępnie agreguje jeden zakres pliku (w procesie roboczym).
+    Zwraca (sumy pełnych rekordów, koniec ostatniego z nich, sumy niedokończonego rekordu).
+    """
+    csv_path, start, end, header, entities, date_from, date_to, amount = task
+    reader = flows_parallel.RecordReader(csv_path, start, end)
+    pairs = _fold_records(reader, header, entities, date_from, date_to, defaultdict(ExactSum), amount)
+    tail = defaultdict(ExactSum)
+    if reader.tail:
+        _fold_records([reader.tail], header, entities, date_from, date_to, tail, amount)
+    return dict(pairs), reader.offset, dict(tail)
+
+def _map_pairs(csv_path, entities, date_from, date_to, workers, amount, background=None):
+    """
+    Agreguje cały plik w puli procesów (format kwot ustalony raz, dla wszystkich zakresów).
+    background jest wykonywane w procesie głównym, gdy pula pracuje.
+    Zwraca (nagłówek, sumy pełnych rekordów, znacznik końca, sumy niedokończonego rekordu).
+    """
+    header, ranges = flows_parallel.split_ranges(csv_path, workers * flows_parallel.RANGES_PER_WORKER,
+                                                  workers)
+    tasks = [(csv_path, start, end, header, entities, date_from, date_to, amount) for start, end in ranges]
+    pairs = defaultdict(ExactSum)
+    tail = defaultdict(ExactSum)
+    watermark = None
+    results = flows_parallel.map_ranges(_aggregate_range, tasks, workers, background) if tasks else []
+    for partial, watermark, partial_tail in results:
+        for pair, total in partial.items():
+            pairs[pair].merge(total)
+        for pair, total in partial_tail.items():
+            tail[pair].merge(total)
+    return header, pairs, watermark, tail
+
+def _scan_pairs(csv_path, header, start, entities, date_from, date_to, amount, pairs=None, digest=None):
+    """
+    Szeregowy odpowiednik _map_pairs od przesunięcia start (początku rekordu).
+    Bez nagłówka pierwszy rekord jest nagłówkiem; pairs to sumy do kontynuowania.
+    digest (hashlib) jest uzupełniany o przeczytane bajty.
+    """
+    reader = flows_parallel.RecordReader(csv_path, start, digest=digest)
+    records = iter(reader)
+    if header is None:
+        first = next(records, None)
+        if first is None:
+            return None, {}, None, {}
+        header = next(csv.reader([first]))
+    pairs = _fold_records(records, header, entities, date_from, date_to,
+                          defaultdict(ExactSum, pairs or {}), amount)
+    tail = defaultdict(ExactSum)
+    if reader.tail:
+        _fold_records([reader.tail], header, entities, date_from, date_to, tail, amount)
+    return header, pairs, reader.offset, tail
+
+def _exact_edges(pairs, tail):
+    """EdgeList z dokładnych sum pełnych rekordów i niedokończonego rekordu na końcu"""
+    result = {pair: float(total) for pair, total in pairs.items()}
+    for pair, total in tail.items():
+        if pair in pairs:
+            total = ExactSum().merge(pairs[pair]).merge(total)
+        result[pair] = float(total)
+    return EdgeList.from_pairs(result)
+
+def parallel_aggregate(csv_path, entities=None, date_from=None, date_to=None, workers=None):
+    """
+    Map-reduce dla dużych plików: zakresy rekordów są agregowane w puli procesów,
+    a wyniki częściowe scalane w kolejności zakresów (kolejność krawędzi jak w
+    wersji szeregowej). Sumy są dokładne, więc wynik jest identyczny co do bitu
+    ze stream_aggregate(..., exact=True). Małe pliki są przetwarzane szeregowo.
+    """
+    workers = flows_parallel.workers_for(csv_path, workers)
+    if workers <= 1:
+        return stream_aggregate(csv_path, entities, date_from, date_to, exact=True)
     
-    for node in nodes_list:
-        # Określ czy węzeł jest po lewej czy prawej stronie
-        is_sender = any(key.startswith(f"{node}→") for key in aggregated_flows.keys())
-        is_receiver = any(key.endswith(f"→{node}") for key in aggregated_flows.keys())
-        
-        if is_sender and not is_receiver:
-            left_nodes.append(node)
-        elif is_receiver and not is_sender:
-            right_nodes.append(node)
+    try:
+        amount = file_amount_format(csv_path)
+        _, pairs, _, tail = _map_pairs(csv_path, entities, date_from, date_to, workers, amount)
+    except Exception as e:
+        print(f"Parallel aggregation failed ({e}), falling back to serial", file=sys.stderr)
+        return stream_aggregate(csv_path, entities, date_from, date_to, exact=True)
+    return _exact_edges(pairs, tail)
+
+def incremental_aggregate(csv_path, entities=None, date_from=None, date_to=None, workers=None):
+    """
+    Agregacja przyrostowa pliku, do którego dopisuje się wiersze: zapisany stan
+    (flows_incremental) jest uzupełniany tylko o rekordy za znacznikiem.
+    Bez stanu lub po zmianie wcześniejszej części pliku liczy wszystko od nowa
+    (duże pliki - równolegle). Wynik jak stream_aggregate(..., exact=True).
+    Format kwot jest zapisywany w stanie, więc dopisane wiersze są czytane tak samo.
+    """
+    filters = flows_incremental.filters_key(entities, date_from, date_to)
+    state = flows_incremental.load_state(csv_path, filters)
+    try:
+        stats = os.stat(csv_path)
+        if state is not None:
+            amount = AmountFormat.from_dict(state['amount'])
+            header, pairs, watermark, tail = _scan_pairs(
+                csv_path, state['header'], state['watermark'], entities, date_from, date_to, amount,
+                state['pairs'])
         else:
-            # Węzeł jest zarówno nadawcą jak i odbiorcą - dodaj do obu stron
-            left_nodes.append(node)
-            right_nodes.append(node)
-    
-    # Usuń duplikaty zachowując kolejność
-    left_nodes = list(dict.fromkeys(left_nodes))
-    right_nodes = list(dict.fromkeys(right_nodes))
-    
-    # Jeśli nie ma podziału, umieść połowę po lewej, połowę po prawej
-    if not left_nodes or not right_nodes:
-        mid = len(nodes_list) // 2
-        left_nodes = nodes_list[:mid] if mid > 0 else nodes_list
-        right_nodes = nodes_list[mid:] if mid > 0 else nodes_list
-    
-    # Oblicz pozycje Y dla węzłów
-    left_y = {node: margin + i * (height - 2*margin) / max(len(left_nodes)-1, 1) 
-              for i, node in enumerate(left_nodes)}
-    right_y = {node: margin + i * (height - 2*margin) / max(len(right_nodes)-1, 1) 
-               for i, node in enumerate(right_nodes)}
-    
-    # Połącz pozycje
-    node_positions = {}
-    for node in left_nodes:
-        node_positions[node] = (margin, left_y[node])
-    for node in right_nodes:
-        node_positions[node] = (width - margin, right_y[node])
-    
-    # Znajdź maksymalną wartość dla normalizacji
-    max_value = max(aggregated_flows.values()) if aggregated_flows else 1
-    
-    # Generuj SVG
-    svg_parts = [
-        f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">',
-        '<defs>',
-        '<linearGradient id="flowGradient" x1="0%" y1="0%" x2="100%" y2="0%">',
-        '<stop offset="0%" style="stop-color:rgb(99,102,241);stop-opacity:0.6" />',
-        '<stop offset="100%" style="stop-color:rgb(139,92,246);stop-opacity:0.6" />',
-        '</linearGradient>',
-        '</defs>',
-        '<rect width="100%" height="100%" fill="#f9fafb"/>',
-        '<text x="400" y="30" text-anchor="middle" font-size="20" font-weight="bold" fill="#1f2937">',
-        'Diagram przepływów finansowych',
-        '</text>'
-    ]
-    
-    # Rysuj połączenia (przepływy)
-    for key, value in sorted(aggregated_flows.items(), key=lambda x: x[1], reverse=True):
-        sender, receiver = key.split('→')
-        
-        if sender not in node_positions or receiver not in node_positions:
-            continue
-        
-        x1, y1 = node_positions[sender]
-        x2, y2 = node_positions[receiver]
-        
-        # Szerokość przepływu proporcjonalna do wartości
-        stroke_width = max(2, (value / max_value) * 30)
-        
-        # Oblicz punkty kontrolne dla krzywej Beziera
-        cx1 = x1 + (x2 - x1) * 0.5
-        cx2 = x1 + (x2 - x1) * 0.5
-        
-        # Ścieżka przepływu
-        path = f'M {x1+node_width} {y1} C {cx1} {y1}, {cx2} {y2}, {x2-node_width} {y2}'
-        
-        svg_parts.append(
-            f'<path d="{path}" stroke="url(#flowGradient)" '
-            f'stroke-width="{stroke_width}" fill="none" opacity="0.7">'
-            f'<title>{sender} → {receiver}: {value:,.2f}</title>'
-            f'</path>'
-        )
-    
-    # Rysuj węzły
-    for node, (x, y) in node_positions.items():
-        svg_parts.extend([
-            f'<rect x="{x-node_width/2}" y="{y-30}" width="{node_width}" height="60" '
-            f'fill="#6366f1" rx="5"/>',
-            f'<text x="{x + (node_width if x < width/2 else -node_width) + (10 if x < width/2 else -10)}" '
-            f'y="{y+5}" font-size="14" font-weight="500" fill="#1f2937" '
-            f'text-anchor="{"start" if x < width/2 else "end"}">{node}</text>'
-        ])
-    
-    # Dodaj legendę
-    legend_y = height - 50
-    svg_parts.extend([
-        f'<text x="20" y="{legend_y}" font-size="12" fill="#6b7280">',
-        f'Maksymalna wartość: {max_value:,.2f}',
-        '</text>',
-        f'<text x="20" y="{legend_y + 20}" font-size="12" fill="#6b7280">',
-        f'Liczba przepływów: {len(aggregated_flows)}',
-        '</text>'
-    ])
-    
-    svg_parts.append('</svg>')
-    
-    return '\n'.join(svg_parts)
+            # Pełny przebieg liczy też SHA-256 pliku (klucz cache wyników): szeregowo przy
+            # czytaniu, równolegle w procesie głównym, gdy zakresy parsuje pula
+            amount = file_amount_format(csv_path)
+            workers = flows_parallel.workers_for(csv_path, workers)
+            if workers > 1:
+                header, pairs, watermark, tail = _map_pairs(csv_path, entities, date_from, date_to, workers,
+                                                            amount, lambda: flows_results.hash_file(csv_path))
+            else:
+                digest = hashlib.sha256()
+                header, pairs, watermark, tail = _scan_pairs(csv_path, None, 0, entities, date_from, date_to,
+                                                             amount, digest=digest)
+                flows_results.remember_digest(csv_path, stats, digest.hexdigest())
+    except Exception as e:
+        print(f"Error reading CSV: {e}", file=sys.stderr)
+        return EdgeList()
+    
+    # Stan jest zapisywany też po samej zmianie mtime - wtedy bez SHA-256 (nie czytano całego pliku)
+    if watermark is not None and (state is None or watermark != state['watermark']
+                                  or not flows_incremental.is_current(state, csv_path)):
+        sha256 = flows_results.known_digest(csv_path, stats)
+        try:
+            flows_incremental.save_state(csv_path, filters, header, watermark, pairs, amount,
+                                         sha256=sha256, stats=stats if sha256 else None)
+        except OSError as e:
+            print(f"Flows state unavailable: {e}", file=sys.stderr)
+    return _exact_edges(pairs, tail)
+
+def to_edges(aggregated_flows):
+    """Zamienia FlowTable, EdgeList lub słownik 'Nadawca→Odbiorca' na EdgeList"""
+    if isinstance(aggregated_flows, EdgeList):
+        return aggregated_flows
+    if isinstance(aggregated_flows, FlowTable):
+        return aggregate_table(aggregated_flows)
+    return EdgeList.from_dict(aggregated_flows or {})
+
+def write_sankey_svg(aggregated_flows, stream, iterations=LAYOUT_ITERATIONS, top=None, min_value=None,
+                     min_percent=None, precision=DEFAULT_PRECISION):
+    """
+    Zapisuje wielowarstwowy wykres Sankey (z EdgeList, FlowTable lub słownika)
+    bezpośrednio do strumienia tekstowego.
+    top / min_value / min_percent ograniczają liczbę rysowanych przepływów - resztę
+    zwija do węzłów „Inne” (patrz collapse_edges).
+    """
+    edges = to_edges(aggregated_flows)
+    if not len(edges):
+        stream.write(generate_empty_svg())
+        return
+    with flows_metrics.stage('layout', rows_in=len(edges)) as stage:
+        edges, collapsed = collapse_edges(edges, top, min_value, min_percent)
+        # Płótno 800x600 rośnie dla grafów z wieloma warstwami lub węzłami
+        node_width = 20
+        layout = compute_layout(edges, width=800, height=600, margin=100,
+                                node_width=node_width, iterations=iterations)
+        stage.rows_out = len(edges)
+    with flows_metrics.stage('serialize', rows_in=len(edges)):
+        flows_svg.write_sankey(stream, edges, layout, collapsed, node_width, precision)
+
+def generate_sankey_svg(aggregated_flows, iterations=LAYOUT_ITERATIONS, top=None, min_value=None,
+                        min_percent=None, precision=DEFAULT_PRECISION):
+    """Generuje wykres Sankey jako tekst SVG (patrz write_sankey_svg)"""
+    buffer = io.StringIO()
+    write_sankey_svg(aggregated_flows, buffer, iterations, top, min_value, min_percent, precision)
+    return buffer.getvalue()
 
 def generate_empty_svg():
     """Generuje SVG z komunikatem o braku danych"""
@@ -238,35 +382,368 @@ def generate_empty_svg():
         </text>
     </svg>'''
 
-def main():
-    """Główna funkcja generująca wykres"""
-    # Wczytaj parametry
-    params = load_params()
-    
+def _remember(store, csv_path, load):
+    """Zwraca obiekt dla pliku z cache procesu `store` (LRU, ważny dla rozmiaru i mtime)"""
+    try:
+        stats = os.stat(csv_path)
+    except OSError:
+        store.pop(csv_path, None)
+        return load(csv_path)
+    
+    signature = (stats.st_size, stats.st_mtime_ns)
+    cached = store.get(csv_path)
+    if cached is not None and cached[0] == signature:
+        store.move_to_end(csv_path)
+        return cached[1]
+    
+    value = load(csv_path)
+    store[csv_path] = (signature, value)
+    store.move_to_end(csv_path)
+    while len(store) > MAX_CACHED_DATASETS:
+        store.popitem(last=False)
+    return value
+
+def load_dataset(csv_path):
+    """Zwraca FlowTable dla pliku, korzystając z cache procesu"""
+    return _remember(_datasets, csv_path, load_table)
+
+def load_cube(csv_path):
+    """Zwraca kostkę czasu (flows_cube) dla pliku, korzystając z cache procesu"""
+    return _remember(_cubes, csv_path, lambda path: flows_cube.load_cube(path, load_dataset(path)))
+
+def load_profile(csv_path):
+    """Zwraca profil pliku (process_file.get_profile), korzystając z cache procesu"""
+    return _remember(_profiles, csv_path, process_file.get_profile)
+
+def load_entities(csv_path):
+    """
+    Zwraca słownik podmiotów (flows_entities) dla pliku, korzystając z cache procesu.
+    Gdy profil wyklucza wykres (process_file.flows_ready), słownik jest pusty -
+    bez budowania tabeli i zapisu .flt / .ent.
+    """
+    def load(path):
+        if not process_file.flows_ready(load_profile(path)):
+            return flows_entities.EntityDictionary.from_stats({})
+        return flows_entities.load_dictionary(path, load_dataset)
+    return _remember(_entities, csv_path, load)
+
+def find_entities(params):
+    """
+    Strona podmiotów pliku dla parametrów csv_path, query, match ('prefix' /
+    'substring'), sort ('name' / 'volume'), offset i limit (albo all - wszystkie
+    trafienia): {'total', 'items', 'profile'} - profil (bez podmiotów) pozwala
+    zgłosić brak kolumn lub pusty plik.
+    """
+    csv_path = params['csv_path']
+    profile = load_profile(csv_path)
+    if not process_file.flows_ready(profile):
+        return {'total': 0, 'items': [], 'profile': profile}
+    limit = params.get('limit')
+    result = load_entities(csv_path).search(
+        params.get('query') or '',
+        match=params.get('match') or 'prefix',
+        sort=params.get('sort') or 'name',
+        offset=params.get('offset') or 0,
+        limit=None if params.get('all') else flows_entities.DEFAULT_LIMIT if limit is None else limit,
+    )
+    result['profile'] = profile
+    return result
+
+def prepare(csv_path):
+    """
+    Buduje binarny cache, kostkę czasu i (jeśli go brak) słownik podmiotów
+    pliku (raz, np. po uploadzie); zwraca liczbę par
+    """
+    table = load_table(csv_path)
+    flows_entities.load_dictionary(csv_path, lambda path: table)
+    return len(flows_cube.load_cube(csv_path, table))
+
+def aggregate_params(params, use_cache=False):
+    """
+    Wczytuje, filtruje i agreguje dane dla słownika parametrów (zwraca EdgeList).
+    Z use_cache=True dane są brane z pamięci procesu (tryb serwera), a zapytania
+    obsługuje kostka czasu (flows_cube). Poza nim używana jest gotowa kostka
+    lub aktualny binarny cache pliku; duży plik bez cache jest
+    agregowany przyrostowo (incremental_aggregate, pierwszy raz - równolegle),
+    a bez katalogu cache (FLOWS_CACHE=0) - równolegle. Pozostałe pliki idą
+    przez cache lub, gdy jest wyłączony, strumieniowo.
+    'exact' wymusza dokładne sumy (bez kostki i NumPy; ścieżki przyrostowa
+    i równoległa są dokładne zawsze).
+    """
     csv_path = params.get('csv_path', '')
-    entities = params.get('entities', [])
-    date_from = params.get('from', '')
-    date_to = params.get('to', '')
-    
-    # Parsuj CSV
-    flows = parse_csv(csv_path)
-    
-    # Filtruj przepływy
-    filtered_flows = filter_flows(flows, entities, date_from, date_to)
-    
-    # Agreguj przepływy
-    aggregated = aggregate_flows(filtered_flows)
-    
-    # Generuj SVG
-    svg_content = generate_sankey_svg(aggregated)
-    
-    # Zapisz SVG
-    output_path = os.path.join(os.path.dirname(__file__), 'przeplywy_finansowe.svg')
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(svg_content)
-    
-    print(f"Wykres zapisany: {output_path}")
-    print(f"Liczba przepływów: {len(aggregated)}")
+    entities = params.get('entities') or []
+    date_from = params.get('from') or ''
+    date_to = params.get('to') or ''
+    exact = bool(params.get('exact'))
+    
+    if use_cache:
+        if flows_cube.enabled() and not exact:
+            return _query_cube(load_cube, csv_path, entities, date_from, date_to)
+        return _aggregate_loaded(load_dataset, csv_path, entities, date_from, date_to, exact)
+    cached = flows_cache.cache_enabled()
+    if cached and flows_cube.enabled() and not exact:
+        cube = flows_cube.open_cube(csv_path)
+        if cube is not None:
+            return _query_cube(lambda path: cube, csv_path, entities, date_from, date_to)
+    if cached and flows_cache.is_fresh(csv_path):
+        return _aggregate_loaded(load_table, csv_path, entities, date_from, date_to, exact)
+    if flows_parallel.is_large(csv_path):
+        if cached:
+            return _aggregate_pass('incremental', incremental_aggregate, csv_path, entities, date_from, date_to,
+                                   params.get('jobs'))
+        return _aggregate_pass('parallel', parallel_aggregate, csv_path, entities, date_from, date_to,
+                               params.get('jobs'))
+    if cached:
+        return _aggregate_loaded(load_table, csv_path, entities, date_from, date_to, exact)
+    return _aggregate_pass('stream', stream_aggregate, csv_path, entities, date_from, date_to, exact)
+
+def _query_cube(load, csv_path, entities, date_from, date_to):
+    """Wynik z kostki czasu (etapy parse - kostka, aggregate - zapytanie)"""
+    flows_metrics.note(path='cube')
+    with flows_metrics.stage('parse') as stage:
+        cube = load(csv_path)
+        stage.rows_out = len(cube)
+    with flows_metrics.stage('aggregate', rows_in=len(cube)) as stage:
+        edges = cube.query(entities, date_from, date_to)
+        stage.rows_out = len(edges)
+    return edges
+
+def _aggregate_loaded(load, csv_path, entities, date_from, date_to, exact=False):
+    """Wynik z tabeli FlowTable: osobne etapy parse, filter i aggregate"""
+    flows_metrics.note(path='table')
+    with flows_metrics.stage('parse') as stage:
+        table = load(csv_path)
+        stage.rows_out = len(table)
+    with flows_metrics.stage('filter', rows_in=len(table)) as stage:
+        table = filter_table(table, entities, date_from, date_to)
+        stage.rows_out = len(table)
+    with flows_metrics.stage('aggregate', rows_in=len(table)) as stage:
+        edges = aggregate_table(table, exact)
+        stage.rows_out = len(edges)
+    return edges
+
+def _aggregate_pass(path, aggregate, csv_path, *args):
+    """Wynik z jednego przejścia po pliku - parse, filter i aggregate to jeden etap"""
+    flows_metrics.note(path=path)
+    with flows_metrics.stage('aggregate', includes=['parse', 'filter']) as stage:
+        edges = aggregate(csv_path, *args)
+        stage.rows_out = len(edges)
+    return edges
+
+def chart_options(params):
+    """Opcje rysowania z parametrów: ograniczenie liczby przepływów i precyzja współrzędnych"""
+    options = {key: params.get(key) for key in ('top', 'min_value', 'min_percent')}
+    if params.get('precision') is not None:
+        options['precision'] = params['precision']
+    return options
+
+def render_chart(params, use_cache=False):
+    """
+    Generuje wykres dla słownika parametrów, zwraca (svg, liczba przepływów).
+    Gotowe wykresy są brane z cache wyników (flows_results), jeśli tam są.
+    """
+    result = flows_results.result_key(params)
+    cached = flows_results.get(params.get('csv_path', ''), result)
+    flows_metrics.note(result_cache='hit' if cached is not None else 'miss' if result else None)
+    if cached is not None:
+        return cached
+    aggregated = aggregate_params(params, use_cache)
+    svg_content = generate_sankey_svg(aggregated, **chart_options(params))
+    if result is None:
+        # SHA-256 pliku mógł powstać dopiero przy agregacji (.flt / pełny przebieg przyrostowy)
+        result = flows_results.result_key(params)
+    flows_results.put(params.get('csv_path', ''), result, svg_content, len(aggregated))
+    return svg_content, len(aggregated)
+
+def write_chart(params, output_path, compress=None):
+    """
+    Zapisuje wykres strumieniowo do pliku lub na stdout (output_path == '-'),
+    opcjonalnie jako gzip (.svgz). Zwraca liczbę przepływów.
+    """
+    csv_path = params.get('csv_path', '')
+    # Jednorazowy proces korzysta tylko z wyników zapisanych na dysku
+    result = flows_results.result_key(params) if flows_cache.cache_enabled() else None
+    cached = flows_results.get(csv_path, result)
+    flows_metrics.note(result_cache='hit' if cached is not None else 'miss' if result else None)
+    if cached is not None:
+        with flows_metrics.stage('serialize'), flows_svg.open_output(output_path, compress) as stream:
+            stream.write(cached[0])
+        return cached[1]
+    
+    aggregated = aggregate_params(params)
+    with flows_svg.open_output(output_path, compress) as stream:
+        capture = flows_results.Capture(stream)
+        write_sankey_svg(aggregated, capture, **chart_options(params))
+    svg_content = capture.getvalue()
+    if svg_content is not None:
+        if result is None and flows_cache.cache_enabled():
+            result = flows_results.result_key(params)
+        flows_results.put(csv_path, result, svg_content, len(aggregated))
+    return len(aggregated)
+
+def invalidate(csv_path):
+    """Zapomina wszystko o pliku (np. po jego usunięciu): pamięć procesu i katalog cache"""
+    _datasets.pop(csv_path, None)
+    _cubes.pop(csv_path, None)
+    _entities.pop(csv_path, None)
+    _profiles.pop(csv_path, None)
+    flows_results.invalidate(csv_path)
+    return flows_cache.invalidate(csv_path)
+
+def handle_command(request):
+    """Polecenia serwera inne niż wykres: statystyki cache wyników, podmioty i unieważnienie pliku"""
+    command = request['command']
+    if command == 'stats':
+        return {'stats': flows_results.stats()}
+    if command == 'entities':
+        return find_entities(request)
+    if command == 'invalidate':
+        return {'removed': invalidate(request['csv_path'])}
+    raise ValueError(f'Unknown command: {command}')
+
+def serve(input_stream=None, output_stream=None):
+    """
+    Tryb serwera: czyta żądania JSON (jedno na linię) i odpowiada jedną linią JSON.
+    
+    Żądanie: {"id": ..., "csv_path": ..., "entities": [...], "from": ..., "to": ...,
+              opcjonalnie "top", "min_value", "min_percent", "precision"}
+    Odpowiedź: {"id": ..., "ok": true, "svg": ..., "flows": n}
+           lub {"id": ..., "ok": false, "error": ...}
+    Przy włączonych pomiarach (FLOWS_METRICS) odpowiedź zawiera też "metrics".
+    Polecenia: {"id": ..., "command": "stats"} -> {"id": ..., "ok": true, "stats": {...}},
+               {"id": ..., "command": "entities", "csv_path": ..., "query": ..., "match": "prefix"|"substring",
+                "sort": "name"|"volume", "offset": ..., "limit": ...} -> {"id": ..., "ok": true, "total": n, "items": [...], "profile": {...}},
+               {"id": ..., "command": "invalidate", "csv_path": ...} -> {"id": ..., "ok": true, "removed": ...}
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    
+    for line in input_stream:
+        line = line.strip()
+        if not line:
+            continue
+        
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            if 'command' in request:
+                response = {'id': request_id, 'ok': True, **handle_command(request)}
+            else:
+                # Rekord pomiarów trafia do odpowiedzi; na stderr tylko gdy nie jest to jedyny cel
+                target = False if flows_metrics.destination() == '-' else None
+                with flows_metrics.run('serve', request, target) as measured:
+                    svg_content, flow_count = render_chart(request, use_cache=True)
+                response = {'id': request_id, 'ok': True, 'svg': svg_content, 'flows': flow_count}
+                if measured is not None:
+                    response['metrics'] = measured.record
+        except Exception as e:
+            response = {'id': request_id, 'ok': False, 'error': str(e)}
+        
+        output_stream.write(json.dumps(response, ensure_ascii=False) + '\n')
+        output_stream.flush()
+
+def parse_args(argv=None):
+    """Parsuje argumenty wiersza poleceń"""
+    parser = argparse.ArgumentParser(description='Generuje wykres Sankey przepływów finansowych')
+    parser.add_argument('--serve', action='store_true',
+                        help='tryb serwera: żądania JSON na stdin, odpowiedzi na stdout')
+    parser.add_argument('--prepare', action='store_true',
+                        help='zbuduj cache i kostkę czasu dla --csv-path (bez wykresu)')
+    parser.add_argument('--batch', metavar='ZAPYTANIA',
+                        help='tryb wsadowy: wykresy dla zapytań z pliku JSON do katalogu --output (flows_batch)')
+    parser.add_argument('--invalidate', action='store_true',
+                        help='usuń cache, kostkę i gotowe wykresy dla --csv-path')
+    parser.add_argument('--stdin', action='store_true',
+                        help='wczytaj parametry (JSON) ze standardowego wejścia')
+    parser.add_argument('--csv-path', dest='csv_path',
+                        help='ścieżka do pliku CSV z przepływami')
+    parser.add_argument('--entity', dest='entities', action='append', default=[],
+                        help='podmiot do uwzględnienia (można podać wielokrotnie)')
+    parser.add_argument('--from', dest='date_from', default='',
+                        help='data początkowa (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='date_to', default='',
+                        help='data końcowa (YYYY-MM-DD)')
+    parser.add_argument('--top', type=int,
+                        help='rysuj tylko N największych przepływów (reszta w węzłach „Inne”)')
+    parser.add_argument('--min-value', dest='min_value', type=float,
+                        help='pomiń przepływy mniejsze niż podana kwota')
+    parser.add_argument('--min-percent', dest='min_percent', type=float,
+                        help='pomiń przepływy mniejsze niż podany procent sumy')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='liczba procesów dla dużych plików (domyślnie FLOWS_PARALLEL lub liczba rdzeni)')
+    parser.add_argument('--exact', action='store_const', const=True,
+                        help='dokładne sumy kwot (bez błędów zaokrągleń przy bardzo wielu wierszach)')
+    parser.add_argument('--precision', type=int,
+                        help=f'liczba miejsc po przecinku we współrzędnych (domyślnie {DEFAULT_PRECISION})')
+    parser.add_argument('--gzip', action='store_const', const=True,
+                        help='kompresuj wynik gzipem (domyślnie dla plików .svgz)')
+    parser.add_argument('--metrics', metavar='PLIK',
+                        help='dopisz pomiary etapów (JSON) do pliku ("-" = stderr; domyślnie FLOWS_METRICS)')
+    parser.add_argument('--output', '-o',
+                        help='plik wyjściowy SVG ("-" = stdout, domyślnie przy --csv-path/--stdin)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Główna funkcja generująca wykres"""
+    args = parse_args(argv)
+    if args.serve:
+        serve()
+        return
+    if args.prepare:
+        if not args.csv_path:
+            sys.exit('--prepare wymaga --csv-path')
+        print(f"Liczba par: {prepare(args.csv_path)}")
+        return
+    if args.invalidate:
+        if not args.csv_path:
+            sys.exit('--invalidate wymaga --csv-path')
+        invalidate(args.csv_path)
+        return
+    if args.batch:
+        import flows_batch
+        if not args.output:
+            sys.exit('--batch wymaga --output (katalog wyników)')
+        batch_args = [args.batch, '--output', args.output]
+        if args.csv_path:
+            batch_args += ['--csv-path', args.csv_path]
+        if args.jobs is not None:
+            batch_args += ['--jobs', str(args.jobs)]
+        sys.exit(flows_batch.main(batch_args))
+    
+    with flows_metrics.run('cli', target=args.metrics):
+        # Wczytaj parametry: stdin, argumenty lub (dla zgodności) flows_params.json
+        with flows_metrics.stage('load_params'):
+            if args.stdin:
+                params = json.load(sys.stdin)
+                output_path = args.output or '-'
+            elif args.csv_path:
+                params = {
+                    'csv_path': args.csv_path,
+                    'entities': args.entities,
+                    'from': args.date_from,
+                    'to': args.date_to,
+                    'top': args.top,
+                    'min_value': args.min_value,
+                    'min_percent': args.min_percent,
+                    'precision': args.precision,
+                    'jobs': args.jobs,
+                    'exact': args.exact
+                }
+                output_path = args.output or '-'
+            else:
+                params = load_params()
+                output_path = args.output or os.path.join(os.path.dirname(__file__), 'przeplywy_finansowe.svg')
+        flows_metrics.describe(params)
+        
+        # Generuj SVG prosto do pliku / na stdout
+        flow_count = write_chart(params, output_path, args.gzip)
+    
+    # Komunikaty na stderr, gdy stdout zawiera SVG
+    log = sys.stderr if output_path == '-' else sys.stdout
+    if output_path != '-':
+        print(f"Wykres zapisany: {output_path}", file=log)
+    print(f"Liczba przepływów: {flow_count}", file=log)
 
 if __name__ == "__main__":
     main()
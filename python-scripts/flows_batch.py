@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# python-scripts/flows_batch.py
+"""
+Tryb wsadowy: wiele wykresów Sankey z jednego wczytanego pliku.
+
+Zapytanie to słownik parametrów jak w flows.py / trybie serwera (csv_path,
+entities, from, to, top, min_value, min_percent, precision, exact) oraz
+opcjonalnie name (nazwa pliku wyniku) i gzip. Wsad:
+- wczytuje każdy plik CSV raz (tabela i kostka czasu w pamięci procesu),
+- liczy każdą różną agregację raz; zapytania o ten sam zakres dat biorą
+  krawędzie swoich podmiotów z jednej agregacji całego zakresu (te same sumy
+  i kolejność co osobne zapytanie),
+- rysuje każdy różny wykres raz (kopie dla powtórzonych zapytań), a gotowe
+  wykresy z cache wyników (flows_results) tylko zapisuje,
+- układa i zapisuje SVG w puli procesów (jobs, domyślnie FLOWS_PARALLEL
+  lub liczba rdzeni).
+
+Pliki trafiają do katalogu wyjściowego razem z manifest.json (MANIFEST):
+dla każdego zapytania plik, liczba przepływów, rozmiar i źródło wyniku
+(render / copy / cache) albo błąd.
+
+    python3 flows_batch.py zapytania.json -o raporty/
+    python3 flows_batch.py --csv-path ksiega.csv --per-entity --per-month -o raporty/
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from calendar import monthrange
+from collections import Counter
+from datetime import date, datetime, timezone
+
+import flows
+import flows_cache
+import flows_parallel
+import flows_results
+import flows_svg
+from flows_table import EdgeList, MISSING_NAME
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+# Znaki niedozwolone w nazwach plików wyników
+_UNSAFE = re.compile(r'[^\w.-]+')
+
+
+def load_queries(path):
+    """
+    Wczytuje zapytania z pliku JSON: lista zapytań albo obiekt
+    {"queries": [...], ...}, którego pozostałe pola są domyślne dla każdego zapytania.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return data
+    defaults = {key: value for key, value in data.items() if key != 'queries'}
+    return [{**defaults, **query} for query in data.get('queries', [])]
+
+
+def plan_queries(csv_path, per_entity=False, per_month=False, max_entities=None, **options):
+    """
+    Zapytania raportu dla pliku: wykres dla każdego podmiotu (od największej
+    sumy kwot, najwyżej max_entities), dla każdego miesiąca z danymi albo dla
+    każdej pary podmiot × miesiąc. options (np. top, precision) trafiają do każdego zapytania.
+    """
+    entities = [None]
+    if per_entity:
+        dictionary = flows.load_entities(csv_path)
+        entities = [dictionary.name(i) for i in dictionary.by_volume if dictionary.counts[i]]
+        if max_entities is not None:
+            entities = entities[:max_entities]
+    months = [None]
+    if per_month:
+        days = flows.load_dataset(csv_path).date_index()[0]
+        months = _months(days[0], days[-1]) if len(days) else []
+
+    queries = []
+    for entity in entities:
+        for month in months:
+            query = {'csv_path': csv_path, **options}
+            parts = []
+            if entity is not None:
+                query['entities'] = [entity]
+                parts.append(entity)
+            if month is not None:
+                query['from'], query['to'] = month
+                parts.append(month[0][:7])
+            query['name'] = '_'.join(parts) or 'wszystkie'
+            queries.append(query)
+    return queries
+
+
+def _months(first, last):
+    """Miesiące między numerami dni first i last jako pary dat (pierwszy, ostatni dzień)"""
+    start = date.fromordinal(first)
+    end = date.fromordinal(last)
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append((date(year, month, 1).isoformat(), date(year, month, monthrange(year, month)[1]).isoformat()))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def file_names(queries):
+    """Unikalne, bezpieczne nazwy plików wyników (z 'name' albo numeru zapytania)"""
+    names = []
+    used = Counter()
+    for i, query in enumerate(queries, 1):
+        base = _UNSAFE.sub('_', str(query.get('name') or f'wykres-{i:04d}')).strip('._') or f'wykres-{i:04d}'
+        used[base] += 1
+        name = base if used[base] == 1 else f'{base}-{used[base]}'
+        suffix = '.svgz' if query.get('gzip') else '.svg'
+        names.append(name + suffix)
+    return names
+
+
+class SharedAggregates:
+    """
+    Agregacje zapytań wsadu, każda liczona raz. Gdy kilka zapytań dotyczy tego
+    samego pliku i zakresu dat (albo jedno z nich - wszystkich podmiotów),
+    wynik dla podmiotów to podzbiór krawędzi agregacji całego zakresu: para
+    wchodzi, gdy nadawca lub odbiorca jest na liście, jak w filter_flows.
+    """
+
+    def __init__(self, queries):
+        self._edges = {}
+        self._ranges = {}
+        # Różne zestawy podmiotów (None = wszystkie) w każdym zakresie dat
+        variants = {}
+        for query in queries:
+            key = self.key(query)
+            variants.setdefault(key[:-1], set()).add(key[-1])
+        self._shared = {key for key, sets in variants.items() if len(sets) > 1 or None in sets}
+        self.computed = 0
+
+    @staticmethod
+    def key(query):
+        entities = query.get('entities')
+        return (os.path.abspath(query.get('csv_path', '')), query.get('from') or '', query.get('to') or '',
+                bool(query.get('exact')), frozenset(entities) if entities else None)
+
+    def get(self, query):
+        """EdgeList dla zapytania"""
+        key = self.key(query)
+        edges = self._edges.get(key)
+        if edges is None:
+            entities = key[-1]
+            if entities is not None and key[:-1] in self._shared and MISSING_NAME not in entities:
+                edges = self._select(self._range(query), entities)
+            else:
+                edges = self._aggregate(query, entities)
+            self._edges[key] = edges
+        return edges
+
+    def _aggregate(self, query, entities):
+        self.computed += 1
+        return flows.aggregate_params({
+            'csv_path': query.get('csv_path', ''),
+            'entities': sorted(entities) if entities else [],
+            'from': query.get('from') or '',
+            'to': query.get('to') or '',
+            'exact': query.get('exact'),
+        }, use_cache=True)
+
+    def _range(self, query):
+        """Agregacja całego zakresu dat i listy krawędzi każdego węzła"""
+        key = self.key(query)[:-1]
+        shared = self._ranges.get(key)
+        if shared is None:
+            edges = self.get({**query, 'entities': None})
+            postings = [[] for _ in edges.names]
+            for i, (s, t) in enumerate(zip(edges.sources, edges.targets)):
+                postings[s].append(i)
+                if t != s:
+                    postings[t].append(i)
+            shared = self._ranges[key] = (edges, postings)
+        return shared
+
+    @staticmethod
+    def _select(shared, entities):
+        edges, postings = shared
+        positions = set()
+        for name in entities:
+            node = edges.node_ids.get(name)
+            if node is not None:
+                positions.update(postings[node])
+        names = edges.names
+        subset = EdgeList()
+        for i in sorted(positions):
+            subset.add(names[edges.sources[i]], names[edges.targets[i]], edges.values[i])
+        return subset
+
+
+def _render(task):
+    """Rysuje jeden wykres do pliku (w procesie roboczym); zwraca opis wyniku"""
+    edges, options, path, csv_path, result = task
+    started = time.perf_counter()
+    try:
+        with flows_svg.open_output(path, path.endswith('.svgz')) as stream:
+            capture = flows_results.Capture(stream)
+            flows.write_sankey_svg(edges, capture, **options)
+        svg = capture.getvalue()
+        if svg is not None:
+            flows_results.put(csv_path, result, svg, len(edges))
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}
+    return {'ok': True, 'flows': len(edges), 'seconds': round(time.perf_counter() - started, 6)}
+
+
+def run_batch(queries, output_dir, jobs=None):
+    """
+    Rysuje wykresy dla listy zapytań do output_dir i zapisuje manifest.json.
+    Zwraca manifest (słownik); błąd jednego zapytania nie przerywa pozostałych.
+    """
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    names = file_names(queries)
+    aggregates = SharedAggregates(queries)
+    charts = [{'file': name, 'query': query} for name, query in zip(names, queries)]
+
+    # Ten sam plik, zapytanie i format wyniku - wykres rysowany raz
+    tasks = []
+    first = {}
+    copies = []
+    for chart, query in zip(charts, queries):
+        path = os.path.join(output_dir, chart['file'])
+        csv_path = query.get('csv_path', '')
+        try:
+            if not csv_path or not os.path.isfile(csv_path):
+                raise FileNotFoundError(f'CSV file not found: {csv_path}')
+            drawing = (os.path.abspath(csv_path), json.dumps(flows_results.normalize_query(query), sort_keys=True),
+                       bool(query.get('gzip')))
+            if drawing in first:
+                copies.append((chart, first[drawing]))
+                continue
+            first[drawing] = chart
+            result = flows_results.result_key(query) if flows_cache.cache_enabled() else None
+            cached = flows_results.get(csv_path, result)
+            if cached is not None:
+                with flows_svg.open_output(path, bool(query.get('gzip'))) as stream:
+                    stream.write(cached[0])
+                chart.update(ok=True, source='cache', flows=cached[1])
+                continue
+            edges = aggregates.get(query)
+            if result is None and flows_cache.cache_enabled():
+                # Skrót treści pliku powstaje przy pierwszej agregacji (.flt / stan przyrostowy)
+                result = flows_results.result_key(query)
+            tasks.append((chart, (edges, flows.chart_options(query), path, csv_path, result)))
+        except Exception as e:
+            chart.update(ok=False, error=str(e))
+
+    workers = flows_parallel.worker_count() if jobs is None else max(int(jobs), 1)
+    if workers > 1 and len(tasks) > 1:
+        results = flows_parallel.map_ranges(_render, [task for _, task in tasks], workers)
+    else:
+        results = [_render(task) for _, task in tasks]
+    for (chart, _), outcome in zip(tasks, results):
+        chart.update(source='render', **outcome)
+
+    for chart, original in copies:
+        if original.get('ok'):
+            shutil.copyfile(os.path.join(output_dir, original['file']), os.path.join(output_dir, chart['file']))
+            chart.update(ok=True, source='copy', flows=original['flows'])
+        else:
+            chart.update(ok=False, error=original.get('error'))
+
+    for chart in charts:
+        if chart['ok']:
+            chart['bytes'] = os.path.getsize(os.path.join(output_dir, chart['file']))
+        else:
+            chart.pop('file')
+
+    manifest = {
+        'version': VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'charts': charts,
+        'summary': {
+            'charts': len(charts),
+            'failed': sum(not chart['ok'] for chart in charts),
+            'aggregations': aggregates.computed,
+            'rendered': len(tasks),
+            'workers': min(workers, len(tasks)) if len(tasks) > 1 else 1,
+            'seconds': round(time.perf_counter() - started, 3),
+        },
+    }
+    with open(os.path.join(output_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Wiele wykresów Sankey z jednego pliku CSV')
+    parser.add_argument('queries', nargs='?',
+                        help='plik JSON z zapytaniami (lista albo {"queries": [...], domyślne pola})')
+    parser.add_argument('--output', '-o', required=True, help='katalog wyników')
+    parser.add_argument('--csv-path', dest='csv_path',
+                        help='plik CSV (domyślny dla zapytań; wymagany przy --per-entity/--per-month)')
+    parser.add_argument('--per-entity', action='store_true', help='wykres dla każdego podmiotu')
+    parser.add_argument('--per-month', action='store_true', help='wykres dla każdego miesiąca')
+    parser.add_argument('--max-entities', type=int,
+                        help='przy --per-entity tylko N podmiotów o największej sumie kwot')
+    parser.add_argument('--top', type=int, help='rysuj tylko N największych przepływów')
+    parser.add_argument('--precision', type=int, help='liczba miejsc po przecinku we współrzędnych')
+    parser.add_argument('--gzip', action='store_true', help='zapisuj wykresy jako .svgz')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='liczba procesów rysujących (domyślnie FLOWS_PARALLEL lub liczba rdzeni)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Uruchamia wsad; kod wyjścia 1, gdy któryś wykres się nie udał"""
+    args = parse_args(argv)
+    options = {key: value for key, value in
+               (('top', args.top), ('precision', args.precision), ('gzip', args.gzip or None))
+               if value is not None}
+    if args.queries:
+        queries = [{'csv_path': args.csv_path, **options, **query} if args.csv_path else {**options, **query}
+                   for query in load_queries(args.queries)]
+    elif args.csv_path and (args.per_entity or args.per_month):
+        queries = plan_queries(args.csv_path, args.per_entity, args.per_month, args.max_entities, **options)
+    else:
+        sys.exit('Podaj plik zapytań albo --csv-path z --per-entity/--per-month')
+
+    summary = run_batch(queries, args.output, args.jobs)['summary']
+    print(f"Wykresy: {summary['charts'] - summary['failed']}/{summary['charts']}, "
+          f"agregacje: {summary['aggregations']}, czas: {summary['seconds']} s")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# python-scripts/flows_cache.py
+"""
+Binarny cache sparsowanych plików CSV (plik obok uploadu, mapowany przez mmap).
+
+Plik .flt zawiera kolumny FlowTable w postaci gotowej do zmapowania:
+
+    8 B   magic 'FLOWTBL1'
+    4 B   długość nagłówka (little endian)
+    N B   nagłówek JSON (źródło: ścieżka, rozmiar, mtime, sha256; sekcje)
+    ...   sekcje wyrównane do 8 B: names (JSON), senders/receivers/dates (int32),
+          amounts (float64)
+
+Cache jest ważny, gdy zgadza się rozmiar i mtime pliku źródłowego, a przy
+zmienionym mtime - skrót SHA-256 zawartości. Łączny rozmiar katalogu cache
+jest ograniczony (FLOWS_CACHE_MAX_BYTES, razem ze stanami agregacji
+przyrostowej, kostkami czasu, gotowymi wykresami, profilami CSV i słownikami podmiotów), najdawniej używane pliki są usuwane.
+"""
+
+import csv
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+from flows_table import AMOUNT_SAMPLE_ROWS, FlowTable, amount_format, date_format
+
+MAGIC = b'FLOWTBL1'
+# 2: kwoty parsowane według formatu pliku (AmountFormat), 3: formaty dat (DateFormat)
+VERSION = 3
+CACHE_SUFFIX = '.flt'
+# Stan agregacji przyrostowej (flows_incremental) - w tym samym katalogu i limicie
+STATE_SUFFIX = '.agg'
+# Kostka czasu (flows_cube) - sumy narastające par wzdłuż osi czasu
+CUBE_SUFFIX = '.cube'
+# Gotowe wykresy (flows_results)
+RESULT_SUFFIX = '.res'
+# Profil pliku CSV z uploadu (process_file) - kolumny, podmioty, zakresy
+PROFILE_SUFFIX = '.profile'
+# Słownik podmiotów (flows_entities) - wyszukiwanie po prefiksie i fragmencie
+ENTITIES_SUFFIX = '.ent'
+CACHE_SUFFIXES = (CACHE_SUFFIX, STATE_SUFFIX, CUBE_SUFFIX, RESULT_SUFFIX, PROFILE_SUFFIX,
+                  ENTITIES_SUFFIX)
+# Zapas w nagłówku na aktualizację mtime w miejscu
+HEADER_PADDING = 64
+# Liczba wierszy zapisywanych na raz podczas budowania cache
+CHUNK_ROWS = 65536
+
+COLUMNS = [('senders', 'i'), ('receivers', 'i'), ('amounts', 'd'), ('dates', 'i')]
+
+
+def cache_enabled():
+    """Cache można wyłączyć zmienną FLOWS_CACHE=0"""
+    return os.environ.get('FLOWS_CACHE', '1') != '0'
+
+
+def cache_max_bytes():
+    """Maksymalny łączny rozmiar katalogu cache"""
+    return int(os.environ.get('FLOWS_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+
+def cache_dir_for(csv_path):
+    """Katalog cache: FLOWS_CACHE_DIR lub ukryty katalog .flows_cache obok pliku"""
+    directory = os.environ.get('FLOWS_CACHE_DIR')
+    if directory:
+        return directory
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), '.flows_cache')
+
+
+def cache_key(csv_path):
+    """Klucz pliku źródłowego w katalogu cache (skrót pełnej ścieżki)"""
+    return hashlib.sha1(os.path.abspath(csv_path).encode('utf-8')).hexdigest()[:24]
+
+
+def cache_path_for(csv_path):
+    """Ścieżka pliku .flt dla danego CSV"""
+    return os.path.join(cache_dir_for(csv_path), cache_key(csv_path) + CACHE_SUFFIX)
+
+
+def file_sha256(path):
+    """Skrót SHA-256 zawartości pliku (czytanego blokami)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _read_header(f):
+    """Czyta nagłówek pliku cache; zwraca (słownik, długość nagłówka) lub None"""
+    prefix = f.read(12)
+    if len(prefix) < 12 or prefix[:8] != MAGIC:
+        return None
+    header_len = struct.unpack('<I', prefix[8:])[0]
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    if header.get('version') != VERSION or header.get('byteorder') != sys.byteorder:
+        return None
+    return header, header_len
+
+
+def _write_header(f, header, header_len):
+    """Zapisuje nagłówek dopełniony spacjami do header_len bajtów"""
+    raw = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    f.write(MAGIC + struct.pack('<I', header_len) + raw.ljust(header_len, b' '))
+
+
+def _source_info(csv_path, stats):
+    return {
+        'path': os.path.abspath(csv_path),
+        'size': stats.st_size,
+        'mtime_ns': stats.st_mtime_ns,
+        'sha256': file_sha256(csv_path),
+    }
+
+
+def build_cache(csv_path, cache_path=None):
+    """
+    Parsuje CSV i zapisuje plik cache. Kolumny są zrzucane do plików
+    tymczasowych co CHUNK_ROWS wierszy, więc w pamięci jest tylko słownik nazw.
+    """
+    cache_path = cache_path or cache_path_for(csv_path)
+    directory = os.path.dirname(cache_path)
+    os.makedirs(directory, exist_ok=True)
+    stats = os.stat(csv_path)
+
+    table = FlowTable(csv_path=csv_path)
+    amount = dates = None
+    rows = 0
+    spools = {name: tempfile.TemporaryFile(dir=directory) for name, _ in COLUMNS}
+    try:
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            csv_header = next(reader, None)
+            while csv_header:
+                batch = list(itertools.islice(reader, CHUNK_ROWS))
+                if not batch:
+                    break
+                # Formaty kwot i dat z pierwszej partii obowiązują dla całego pliku
+                if amount is None:
+                    sample = batch[:AMOUNT_SAMPLE_ROWS]
+                    amount = amount_format(csv_header, sample)
+                    dates = date_format(csv_header, sample)
+                table.load_rows(batch, csv_header, amount, dates)
+                rows += len(table)
+                for name, typecode in COLUMNS:
+                    getattr(table, name).tofile(spools[name])
+                    setattr(table, name, array(typecode))
+
+        names_raw = json.dumps(table.names, ensure_ascii=False).encode('utf-8')
+        header = {
+            'version': VERSION,
+            'byteorder': sys.byteorder,
+            'source': _source_info(csv_path, stats),
+            'rows': rows,
+            'sections': {},
+        }
+
+        # Wylicz położenie sekcji (nagłówek ma stały, dopełniony rozmiar)
+        probe = dict(header, sections={name: [10 ** 15, 10 ** 15] for name in ['names'] + [c for c, _ in COLUMNS]})
+        header_len = len(json.dumps(probe, ensure_ascii=False).encode('utf-8')) + HEADER_PADDING
+        offset = _align(12 + header_len)
+        header['sections']['names'] = [offset, len(names_raw)]
+        offset = _align(offset + len(names_raw))
+        for name, typecode in COLUMNS:
+            length = rows * array(typecode).itemsize
+            header['sections'][name] = [offset, length]
+            offset = _align(offset + length)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as out:
+            _write_header(out, header, header_len)
+            for name in ['names'] + [c for c, _ in COLUMNS]:
+                out.write(b'\0' * (header['sections'][name][0] - out.tell()))
+                if name == 'names':
+                    out.write(names_raw)
+                else:
+                    spools[name].seek(0)
+                    shutil.copyfileobj(spools[name], out)
+        os.replace(tmp_path, cache_path)
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+    enforce_limit(directory, cache_max_bytes(), keep=cache_path)
+    return cache_path
+
+
+def _validate(cache_path, csv_path):
+    """Sprawdza, czy cache odpowiada plikowi źródłowemu (w razie potrzeby po SHA-256)"""
+    stats = os.stat(csv_path)
+    with open(cache_path, 'r+b') as f:
+        parsed = _read_header(f)
+        if parsed is None:
+            return False
+        header, header_len = parsed
+        source = header['source']
+        if source['path'] != os.path.abspath(csv_path) or source['size'] != stats.st_size:
+            return False
+        if source['mtime_ns'] == stats.st_mtime_ns:
+            return True
+        # mtime się zmienił (np. touch) - porównaj zawartość
+        if source['sha256'] != file_sha256(csv_path):
+            return False
+        source['mtime_ns'] = stats.st_mtime_ns
+        raw = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        if len(raw) <= header_len:
+            f.seek(0)
+            _write_header(f, header, header_len)
+        return True
+
+
+def _fresh_source(csv_path):
+    """Opis źródła z nagłówka cache, jeśli cache jest zgodny z plikiem (rozmiar i mtime)"""
+    try:
+        stats = os.stat(csv_path)
+        with open(cache_path_for(csv_path), 'rb') as f:
+            parsed = _read_header(f)
+    except (OSError, ValueError):
+        return None
+    if parsed is None:
+        return None
+    source = parsed[0]['source']
+    if (source['path'] == os.path.abspath(csv_path) and source['size'] == stats.st_size
+            and source['mtime_ns'] == stats.st_mtime_ns):
+        return source
+    return None
+
+
+def is_fresh(csv_path):
+    """Czy istnieje cache zgodny z plikiem (rozmiar i mtime, bez liczenia skrótu)"""
+    return _fresh_source(csv_path) is not None
+
+
+def source_digest(csv_path):
+    """Skrót SHA-256 pliku zapisany w aktualnym cache lub None (bez czytania pliku)"""
+    source = _fresh_source(csv_path)
+    return source['sha256'] if source is not None else None
+
+
+def open_cache(cache_path, csv_path=None):
+    """Mapuje plik cache i zwraca FlowTable z kolumnami bez kopiowania"""
+    with open(cache_path, 'rb') as f:
+        parsed = _read_header(f)
+        if parsed is None:
+            return None
+        header = parsed[0]
+        if header['rows'] == 0:
+            buffer = None
+            view = None
+        else:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(buffer)
+
+    sections = header['sections']
+    offset, length = sections['names']
+    if view is None:
+        with open(cache_path, 'rb') as f:
+            f.seek(offset)
+            names = json.loads(f.read(length).decode('utf-8'))
+    else:
+        names = json.loads(bytes(view[offset:offset + length]).decode('utf-8'))
+
+    columns = {}
+    for name, typecode in COLUMNS:
+        offset, length = sections[name]
+        if view is None:
+            columns[name] = array(typecode)
+        else:
+            columns[name] = view[offset:offset + length].cast(typecode)
+
+    return FlowTable.from_columns(
+        names, columns['senders'], columns['receivers'], columns['amounts'], columns['dates'],
+        csv_path=csv_path or header['source']['path'], buffer=buffer
+    )
+
+
+def load_cached_table(csv_path):
+    """
+    Zwraca FlowTable dla pliku CSV z cache (budując go w razie potrzeby).
+    Gdy cache nie da się użyć, zwraca None.
+    """
+    cache_path = cache_path_for(csv_path)
+    try:
+        if not (os.path.exists(cache_path) and _validate(cache_path, csv_path)):
+            build_cache(csv_path, cache_path)
+        table = open_cache(cache_path, csv_path)
+        # Oznacz jako ostatnio używany (LRU)
+        os.utime(cache_path)
+        return table
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Flows cache unavailable: {e}", file=sys.stderr)
+        return None
+
+
+def invalidate(csv_path):
+    """Usuwa cache, stany agregacji, kostkę, wykresy, profil i słownik podmiotów pliku CSV (np. po jego usunięciu)"""
+    directory = cache_dir_for(csv_path)
+    key = cache_key(csv_path)
+    removed = False
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return False
+    for entry in entries:
+        if entry.name.startswith(key) and entry.name.endswith(CACHE_SUFFIXES):
+            try:
+                os.remove(entry.path)
+                removed = True
+            except OSError:
+                continue
+    return removed
+
+
+def enforce_limit(directory, max_bytes, keep=None):
+    """Usuwa najdawniej używane pliki cache, aż łączny rozmiar zmieści się w limicie"""
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(CACHE_SUFFIXES):
+            stats = entry.stat()
+            entries.append((stats.st_mtime_ns, stats.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            # Np. plik zmapowany przez inny proces na Windows
+            continue
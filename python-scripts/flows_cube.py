@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# python-scripts/flows_cube.py
+"""
+Kostka czasu: sumy przepływów dla (dzień, nadawca, odbiorca) z sumami
+narastającymi wzdłuż osi czasu, osobno dla każdej pary.
+
+Komórki są ułożone parami (jak CSR): komórki pary p to zakres
+[offsets[p], offsets[p + 1]) posortowany po dniu; komórka bez daty (NO_DATE)
+jest pierwsza. Dla każdej komórki zapisana jest suma narastająca pary do tego
+dnia włącznie jako para liczb (hi, lo) - double-double, więc różnica dwóch
+sum nie traci cyfr mniejszych kwot - oraz numer pierwszego wiersza w komórce.
+Minima numerów pierwszych wierszy dla przedziałów komórek długości 2^k
+(tablica rzadka, first_min) dają pierwszy wiersz pary w dowolnym zakresie
+dat w czasie stałym.
+
+Zapytanie o zakres dat to dwa wyszukiwania binarne, różnica sum
+narastających i dwa odczyty first_min na parę; surowe wiersze ani komórki
+wewnątrz zakresu nie są czytane. Filtr podmiotów wybiera pary przez indeks
+podmiot -> pary. Wynik jest jak aggregate_table(filter_table(...)): ta sama
+kolejność krawędzi, sumy z dokładnością double-double - zwykle co do bitu jak
+suma float, ale bez gwarancji dokładności (zapytania 'exact' omijają kostkę).
+
+Kostka jest budowana raz na plik (flows.py --prepare po uploadzie lub przy
+pierwszym zapytaniu serwera) i zapisywana w katalogu cache (.cube):
+
+    8 B   magic 'FLOWCUB1'
+    4 B   długość nagłówka (little endian)
+    N B   nagłówek JSON (źródło: ścieżka, rozmiar, mtime; liczby par i komórek; sekcje)
+    ...   sekcje wyrównane do 8 B: names (JSON), senders/receivers/offsets/days/
+          first_rows (int32), prefix_hi/prefix_lo (float64), first_min (int32:
+          poziomy 1, 2, ... tablicy rzadkiej, poziom k ma n - 2^k + 1 pozycji)
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+import flows_cache
+from flows_table import EdgeList, MISSING, MISSING_NAME, NO_DATE, parse_day
+
+MAGIC = b'FLOWCUB1'
+# 4: tablica rzadka first_min
+VERSION = 4
+
+SECTIONS = [('senders', 'i'), ('receivers', 'i'), ('offsets', 'i'), ('days', 'i'),
+            ('first_rows', 'i'), ('prefix_hi', 'd'), ('prefix_lo', 'd'), ('first_min', 'i')]
+
+
+def enabled():
+    """Kostkę można wyłączyć zmienną FLOWS_CUBE=0"""
+    return os.environ.get('FLOWS_CUBE', '1') != '0'
+
+
+def cube_path_for(csv_path):
+    """Ścieżka pliku .cube dla danego CSV (obok .flt w katalogu cache)"""
+    return os.path.join(flows_cache.cache_dir_for(csv_path),
+                        flows_cache.cache_key(csv_path) + flows_cache.CUBE_SUFFIX)
+
+
+def _two_sum(a, b):
+    """Suma a + b i jej dokładny błąd zaokrąglenia"""
+    s = a + b
+    bp = s - a
+    return s, (a - (s - bp)) + (b - bp)
+
+
+def sparse_minima(first_rows, offsets):
+    """
+    Poziomy 1, 2, ... tablicy rzadkiej minimów first_rows (połączone w jedną
+    tablicę): poziom k na pozycji i to minimum komórek [i, i + 2^k). Poziomów
+    jest tyle, ile potrzeba dla najdłuższej pary.
+    """
+    longest = max((offsets[p + 1] - offsets[p] for p in range(len(offsets) - 1)), default=0)
+    levels = array('i')
+    level = first_rows
+    step = 1
+    while step * 2 <= longest:
+        level = array('i', map(min, level[:-step], level[step:]))
+        levels.extend(level)
+        step *= 2
+    return levels
+
+
+class TimeCube:
+    """Sumy narastające par (nadawca, odbiorca) wzdłuż osi czasu"""
+
+    __slots__ = ('names', 'name_ids', 'senders', 'receivers', 'offsets', 'days',
+                 'first_rows', 'prefix_hi', 'prefix_lo', 'first_min', '_buffer', '_entity_index', '_levels')
+
+    def __init__(self, names, columns, buffer=None):
+        self.names = names
+        self.name_ids = {name: i for i, name in enumerate(names)}
+        for name, _ in SECTIONS:
+            setattr(self, name, columns[name])
+        # Obiekt trzymający pamięć kolumn (mmap pliku .cube)
+        self._buffer = buffer
+        self._entity_index = None
+        self._levels = None
+
+    def __len__(self):
+        """Liczba par"""
+        return len(self.senders)
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Buduje kostkę z FlowTable w jednym przejściu po wierszach (te same
+        reguły co aggregate_pairs: kwota > 0, niepusta nazwa). Pary w kolejności
+        pierwszego wystąpienia.
+        """
+        # klucz pary -> {dzień: [hi, lo, pierwszy wiersz]}
+        pairs = {}
+        names = table.names
+        senders, receivers, amounts, dates = table.senders, table.receivers, table.amounts, table.dates
+        for i in range(len(amounts)):
+            amount = amounts[i]
+            if amount > 0:
+                s = senders[i]
+                r = receivers[i]
+                if (s == MISSING or names[s]) and (r == MISSING or names[r]):
+                    key = ((s + 1) << 32) | (r + 1)
+                    cells = pairs.get(key)
+                    if cells is None:
+                        cells = pairs[key] = {}
+                    cell = cells.get(dates[i])
+                    if cell is None:
+                        cells[dates[i]] = [amount, 0.0, i]
+                    else:
+                        hi, err = _two_sum(cell[0], amount)
+                        cell[0] = hi
+                        cell[1] += err
+
+        columns = {name: array(typecode) for name, typecode in SECTIONS}
+        offsets, days, first_rows = columns['offsets'], columns['days'], columns['first_rows']
+        prefix_hi, prefix_lo = columns['prefix_hi'], columns['prefix_lo']
+        offsets.append(0)
+        for key, cells in pairs.items():
+            columns['senders'].append((key >> 32) - 1)
+            columns['receivers'].append((key & 0xFFFFFFFF) - 1)
+            hi = lo = 0.0
+            for day in sorted(cells):
+                cell_hi, cell_lo, first_row = cells[day]
+                hi, err = _two_sum(hi, cell_hi)
+                lo += err + cell_lo
+                days.append(day)
+                first_rows.append(first_row)
+                prefix_hi.append(hi)
+                prefix_lo.append(lo)
+            offsets.append(len(days))
+        columns['first_min'] = sparse_minima(first_rows, offsets)
+        return cls(list(names), columns)
+
+    def name(self, entity_id):
+        return MISSING_NAME if entity_id == MISSING else self.names[entity_id]
+
+    def entity_index(self):
+        """Indeks: id podmiotu -> array('i') numerów par z jego udziałem (rosnąco)"""
+        if self._entity_index is None:
+            postings = [array('i') for _ in self.names]
+            for p in range(len(self.senders)):
+                s = self.senders[p]
+                r = self.receivers[p]
+                if s != MISSING:
+                    postings[s].append(p)
+                if r != MISSING and r != s:
+                    postings[r].append(p)
+            self._entity_index = postings
+        return self._entity_index
+
+    def pairs_for(self, entities=None):
+        """Numery par (rosnąco) z udziałem któregokolwiek z podmiotów; wszystkie bez filtra"""
+        if not entities:
+            return range(len(self.senders))
+        postings = self.entity_index()
+        pairs = set()
+        for entity in entities:
+            entity_id = self.name_ids.get(entity)
+            if entity_id is not None:
+                pairs.update(postings[entity_id])
+        return sorted(pairs)
+
+    def levels(self):
+        """Poziomy tablicy rzadkiej: [first_rows, poziom 1, poziom 2, ...]"""
+        if self._levels is None:
+            levels = [self.first_rows]
+            n = len(self.first_rows)
+            start = 0
+            step = 2
+            while start < len(self.first_min):
+                length = n - step + 1
+                levels.append(self.first_min[start:start + length])
+                start += length
+                step *= 2
+            self._levels = levels
+        return self._levels
+
+    def first_row(self, lo, hi):
+        """Najmniejszy numer pierwszego wiersza w komórkach [lo, hi) jednej pary"""
+        k = (hi - lo).bit_length() - 1
+        level = self.levels()[k]
+        return min(level[lo], level[hi - (1 << k)])
+
+    def _prefix(self, k, first):
+        """Suma narastająca pary do komórki k włącznie jako (hi, lo); zero przed pierwszą"""
+        if k < first:
+            return 0.0, 0.0
+        return self.prefix_hi[k], self.prefix_lo[k]
+
+    def query(self, entities=None, date_from=None, date_to=None):
+        """
+        Sumy par dla podmiotów i zakresu dat (wiersze bez daty zawsze wchodzą),
+        jak filter_flows + aggregate_flows. Zwraca EdgeList.
+        """
+        start = parse_day(date_from) if date_from else NO_DATE
+        end = parse_day(date_to) if date_to else NO_DATE
+        by_date = start != NO_DATE or end != NO_DATE
+        offsets, days, first_rows = self.offsets, self.days, self.first_rows
+        prefix_hi, prefix_lo = self.prefix_hi, self.prefix_lo
+        first_row = self.first_row
+
+        selected = []
+        for p in self.pairs_for(entities):
+            first = offsets[p]
+            stop = offsets[p + 1]
+            if not by_date:
+                selected.append((p, p, math.fsum((prefix_hi[stop - 1], prefix_lo[stop - 1]))))
+                continue
+
+            # Komórka bez daty jest pierwsza w zakresie pary
+            undated = days[first] == NO_DATE
+            lo = first + 1 if undated else first
+            if start != NO_DATE:
+                lo = bisect_left(days, start, lo, stop)
+            hi = bisect_right(days, end, lo, stop) if end != NO_DATE else stop
+            if hi > lo:
+                upper_hi, upper_lo = prefix_hi[hi - 1], prefix_lo[hi - 1]
+                lower_hi, lower_lo = self._prefix(lo - 1, first)
+                parts = [upper_hi, upper_lo, -lower_hi, -lower_lo]
+                order = first_row(lo, hi)
+                if undated:
+                    parts += [prefix_hi[first], prefix_lo[first]]
+                    order = min(order, first_rows[first])
+            elif undated:
+                parts = [prefix_hi[first], prefix_lo[first]]
+                order = first_rows[first]
+            else:
+                continue
+            selected.append((order, p, math.fsum(parts)))
+
+        # Kolejność pierwszego wystąpienia pary wśród wybranych wierszy
+        if by_date:
+            selected.sort()
+        edges = EdgeList()
+        senders, receivers = self.senders, self.receivers
+        for _, p, value in selected:
+            edges.add(self.name(senders[p]), self.name(receivers[p]), value)
+        return edges
+
+
+def _read_header(f):
+    """Czyta nagłówek pliku kostki; zwraca słownik lub None"""
+    prefix = f.read(12)
+    if len(prefix) < 12 or prefix[:8] != MAGIC:
+        return None
+    header_len = struct.unpack('<I', prefix[8:])[0]
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    if header.get('version') != VERSION or header.get('byteorder') != sys.byteorder:
+        return None
+    return header
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def save_cube(cube, csv_path, stats=None):
+    """Zapisuje kostkę (atomowo) do katalogu cache i pilnuje limitu jego rozmiaru"""
+    path = cube_path_for(csv_path)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    stats = stats or os.stat(csv_path)
+
+    names_raw = json.dumps(cube.names, ensure_ascii=False).encode('utf-8')
+    header = {
+        'version': VERSION,
+        'byteorder': sys.byteorder,
+        'source': {
+            'path': os.path.abspath(csv_path),
+            'size': stats.st_size,
+            'mtime_ns': stats.st_mtime_ns,
+        },
+        'pairs': len(cube),
+        'cells': len(cube.days),
+        'sections': {},
+    }
+    blobs = [('names', names_raw)] + [(name, getattr(cube, name)) for name, _ in SECTIONS]
+    # Długość nagłówka nie zależy od położenia sekcji
+    probe = dict(header, sections={name: [10 ** 15, 10 ** 15] for name, _ in blobs})
+    header_len = len(json.dumps(probe, ensure_ascii=False).encode('utf-8'))
+    offset = _align(12 + header_len)
+    for name, blob in blobs:
+        length = len(memoryview(blob).cast('B'))
+        header['sections'][name] = [offset, length]
+        offset = _align(offset + length)
+    raw = json.dumps(header, ensure_ascii=False).encode('utf-8').ljust(header_len, b' ')
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', header_len) + raw)
+        for name, blob in blobs:
+            f.write(b'\0' * (header['sections'][name][0] - f.tell()))
+            f.write(memoryview(blob).cast('B'))
+    os.replace(tmp_path, path)
+    flows_cache.enforce_limit(directory, flows_cache.cache_max_bytes(), keep=path)
+    return path
+
+
+def open_cube(csv_path):
+    """
+    Mapuje zapisaną kostkę, jeśli odpowiada plikowi (rozmiar i mtime);
+    w przeciwnym razie zwraca None.
+    """
+    path = cube_path_for(csv_path)
+    try:
+        stats = os.stat(csv_path)
+        with open(path, 'rb') as f:
+            header = _read_header(f)
+            if header is None:
+                return None
+            source = header['source']
+            if (source['path'] != os.path.abspath(csv_path) or source['size'] != stats.st_size
+                    or source['mtime_ns'] != stats.st_mtime_ns):
+                return None
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        sections = header['sections']
+        offset, length = sections['names']
+        names = json.loads(bytes(view[offset:offset + length]).decode('utf-8'))
+        columns = {}
+        for name, typecode in SECTIONS:
+            offset, length = sections[name]
+            columns[name] = view[offset:offset + length].cast(typecode)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Flows cube unavailable: {e}", file=sys.stderr)
+        return None
+
+    # Oznacz jako ostatnio używany (LRU w flows_cache.enforce_limit)
+    os.utime(path)
+    return TimeCube(names, columns, buffer=buffer)
+
+
+def load_cube(csv_path, table):
+    """
+    Kostka dla pliku: zapisana w katalogu cache albo zbudowana z tabeli
+    (i zapisana, gdy cache jest włączony).
+    """
+    try:
+        stats = os.stat(csv_path) if flows_cache.cache_enabled() else None
+    except OSError:
+        stats = None
+    if stats is not None:
+        cube = open_cube(csv_path)
+        if cube is not None:
+            return cube
+        cube = TimeCube.from_table(table)
+        try:
+            save_cube(cube, csv_path, stats)
+        except OSError as e:
+            print(f"Flows cube unavailable: {e}", file=sys.stderr)
+        return cube
+    return TimeCube.from_table(table)
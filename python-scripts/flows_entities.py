@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# python-scripts/flows_entities.py
+"""
+Słownik podmiotów pliku CSV do wyszukiwania w dużych zbiorach (podpowiedzi).
+
+Nazwy są posortowane po kluczu (nazwa po casefold, bajty UTF-8 - ta sama
+kolejność co dla napisów), bez powtórzeń, z liczbą przepływów i sumą kwot
+podmiotu (jako nadawcy lub odbiorcy; tylko przepływy rysowane na wykresie:
+kwota > 0 i obie nazwy niepuste). Wyszukiwanie:
+- po prefiksie: dwa wyszukiwania binarne w posortowanych kluczach,
+- po fragmencie: bytes.find na sklejonych kluczach (oddzielonych bajtem 0),
+- największe podmioty: gotowa kolejność po sumie kwot (by_volume),
+z wynikami stronicowanymi (offset, limit) i łączną liczbą trafień.
+
+Słownik jest budowany raz na plik (process_file.py przy uploadzie, razem
+z profilem CSV, albo z FlowTable przy pierwszym zapytaniu) i zapisywany
+w katalogu cache (.ent, mapowany przez mmap):
+
+    8 B   magic 'FLOWENT1'
+    4 B   długość nagłówka (little endian)
+    N B   nagłówek JSON (źródło: ścieżka, rozmiar, mtime; liczba podmiotów; sekcje)
+    ...   sekcje wyrównane do 8 B: keys/names (UTF-8), key_offsets/name_offsets
+          (int64), counts/by_volume (int32), totals (float64)
+"""
+
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+import flows_cache
+from flows_table import MISSING
+
+MAGIC = b'FLOWENT1'
+VERSION = 2
+# Domyślna i maksymalna liczba wyników na stronę
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+
+ARRAYS = [('key_offsets', 'q'), ('name_offsets', 'q'), ('counts', 'i'),
+          ('by_volume', 'i'), ('totals', 'd')]
+SECTIONS = [('keys', 'B'), ('names', 'B')] + ARRAYS
+
+
+def dictionary_path_for(csv_path):
+    """Ścieżka pliku .ent dla danego CSV (obok .flt w katalogu cache)"""
+    return os.path.join(flows_cache.cache_dir_for(csv_path),
+                        flows_cache.cache_key(csv_path) + flows_cache.ENTITIES_SUFFIX)
+
+
+def fold(text):
+    """Klucz wyszukiwania: wielkość liter nie ma znaczenia"""
+    return text.casefold().encode('utf-8')
+
+
+class _Keys:
+    """Klucze jako sekwencja bajtów dla bisect (bez kopiowania bloku kluczy)"""
+
+    __slots__ = ('blob', 'offsets')
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        # Każdy klucz kończy się separatorem (bajt 0)
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1] - 1])
+
+
+class EntityDictionary:
+    """Posortowane nazwy podmiotów z liczbą przepływów i sumą kwot"""
+
+    def __init__(self, columns, buffer=None):
+        for name, _ in SECTIONS:
+            setattr(self, name, columns[name])
+        # mmap z pliku cache (musi żyć tak długo jak kolumny)
+        self._buffer = buffer
+        self._keys = _Keys(self.keys, self.key_offsets)
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def from_stats(cls, stats):
+        """Buduje słownik ze słownika {nazwa: (liczba przepływów, suma kwot)}"""
+        entries = sorted((fold(name), name) for name in stats if name)
+        keys, names = bytearray(), bytearray()
+        columns = {name: array(typecode) for name, typecode in ARRAYS}
+        columns['key_offsets'].append(0)
+        columns['name_offsets'].append(0)
+        for key, name in entries:
+            keys += key
+            keys.append(0)
+            names += name.encode('utf-8')
+            columns['key_offsets'].append(len(keys))
+            columns['name_offsets'].append(len(names))
+            count, total = stats[name]
+            columns['counts'].append(count)
+            columns['totals'].append(total)
+        totals = columns['totals']
+        # Od największej sumy; przy równych - kolejność nazw
+        columns['by_volume'] = array('i', sorted(range(len(entries)), key=lambda i: -totals[i]))
+        columns['keys'] = bytes(keys)
+        columns['names'] = bytes(names)
+        return cls(columns)
+
+    @classmethod
+    def from_table(cls, table):
+        """Buduje słownik z FlowTable (te same przepływy co na wykresie)"""
+        counts = [0] * len(table.names)
+        totals = [0.0] * len(table.names)
+        empty = table.name_ids.get('')
+        for sender, receiver, amount in zip(table.senders, table.receivers, table.amounts):
+            if amount > 0 and sender != MISSING and receiver != MISSING \
+                    and sender != empty and receiver != empty:
+                counts[sender] += 1
+                totals[sender] += amount
+                counts[receiver] += 1
+                totals[receiver] += amount
+        return cls.from_stats({name: (counts[i], totals[i]) for i, name in enumerate(table.names)})
+
+    def name(self, i):
+        return bytes(self.names[self.name_offsets[i]:self.name_offsets[i + 1]]).decode('utf-8')
+
+    def entry(self, i):
+        """Opis podmiotu: nazwa, liczba przepływów, suma kwot"""
+        return {'name': self.name(i), 'count': self.counts[i], 'total': self.totals[i]}
+
+    def prefix_range(self, prefix):
+        """Zakres [lo, hi) kluczy zaczynających się od prefix"""
+        key = fold(prefix)
+        lo = bisect_left(self._keys, key)
+        # 0xff nie występuje w UTF-8, więc jest większy od każdej kontynuacji
+        hi = bisect_right(self._keys, key + b'\xff', lo)
+        return lo, hi
+
+    def substring_matches(self, text):
+        """Numery podmiotów, których klucz zawiera text (rosnąco)"""
+        key = fold(text)
+        keys, offsets = self.keys, self.key_offsets
+        end = offsets[len(self)]
+        matches = []
+        position = keys.find(key, 0, end)
+        while position >= 0:
+            i = bisect_right(offsets, position) - 1
+            matches.append(i)
+            # Następne trafienie dopiero w kolejnym kluczu
+            position = keys.find(key, offsets[i + 1], end)
+        return matches
+
+    def search(self, query='', match='prefix', sort='name', offset=0, limit=DEFAULT_LIMIT):
+        """
+        Strona wyników: {'total': liczba trafień, 'items': [opisy podmiotów]}.
+        match: 'prefix' lub 'substring'; sort: 'name' lub 'volume' (suma kwot).
+        limit=None - wszystkie trafienia od offset (bez limitu MAX_LIMIT).
+        """
+        if match not in ('prefix', 'substring'):
+            raise ValueError(f'Unknown match: {match}')
+        if sort not in ('name', 'volume'):
+            raise ValueError(f'Unknown sort: {sort}')
+        offset = max(int(offset), 0)
+        if limit is None:
+            end = len(self)
+        else:
+            end = offset + min(max(int(limit), 0), MAX_LIMIT)
+
+        if not query:
+            matches = range(len(self))
+        elif match == 'prefix':
+            matches = range(*self.prefix_range(query))
+        else:
+            matches = self.substring_matches(query)
+
+        if sort == 'name':
+            page = matches[offset:end]
+        elif len(matches) == len(self):
+            page = self.by_volume[offset:end]
+        else:
+            totals = self.totals
+            page = heapq.nsmallest(end, matches, key=lambda i: (-totals[i], i))[offset:]
+        return {'total': len(matches), 'items': [self.entry(i) for i in page]}
+
+
+def _read_header(f):
+    prefix = f.read(12)
+    if len(prefix) < 12 or prefix[:8] != MAGIC:
+        return None
+    header_len = struct.unpack('<I', prefix[8:])[0]
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    if header.get('version') != VERSION or header.get('byteorder') != sys.byteorder:
+        return None
+    return header
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def save_dictionary(dictionary, csv_path, stats=None):
+    """Zapisuje słownik (atomowo) do katalogu cache i pilnuje limitu jego rozmiaru"""
+    path = dictionary_path_for(csv_path)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    stats = stats or os.stat(csv_path)
+
+    header = {
+        'version': VERSION,
+        'byteorder': sys.byteorder,
+        'source': {
+            'path': os.path.abspath(csv_path),
+            'size': stats.st_size,
+            'mtime_ns': stats.st_mtime_ns,
+        },
+        'entities': len(dictionary),
+        'sections': {},
+    }
+    blobs = [(name, getattr(dictionary, name)) for name, _ in SECTIONS]
+    # Długość nagłówka nie zależy od położenia sekcji
+    probe = dict(header, sections={name: [10 ** 15, 10 ** 15] for name, _ in blobs})
+    header_len = len(json.dumps(probe, ensure_ascii=False).encode('utf-8'))
+    offset = _align(12 + header_len)
+    for name, blob in blobs:
+        length = len(memoryview(blob).cast('B'))
+        header['sections'][name] = [offset, length]
+        offset = _align(offset + length)
+    raw = json.dumps(header, ensure_ascii=False).encode('utf-8').ljust(header_len, b' ')
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', header_len) + raw)
+        for name, blob in blobs:
+            f.write(b'\0' * (header['sections'][name][0] - f.tell()))
+            f.write(memoryview(blob).cast('B'))
+    os.replace(tmp_path, path)
+    flows_cache.enforce_limit(directory, flows_cache.cache_max_bytes(), keep=path)
+    return path
+
+
+class _Section:
+    """Fragment mmap udostępniający wycinki i find względem początku sekcji"""
+
+    __slots__ = ('buffer', 'start', 'length')
+
+    def __init__(self, buffer, start, length):
+        self.buffer = buffer
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.buffer[self.start + index.start:self.start + index.stop]
+
+    def find(self, sub, start, end):
+        position = self.buffer.find(sub, self.start + start, self.start + end)
+        return position - self.start if position >= 0 else -1
+
+
+def open_dictionary(csv_path):
+    """
+    Mapuje zapisany słownik, jeśli odpowiada plikowi (rozmiar i mtime);
+    w przeciwnym razie zwraca None.
+    """
+    path = dictionary_path_for(csv_path)
+    try:
+        stats = os.stat(csv_path)
+        with open(path, 'rb') as f:
+            header = _read_header(f)
+            if header is None:
+                return None
+            source = header['source']
+            if (source['path'] != os.path.abspath(csv_path) or source['size'] != stats.st_size
+                    or source['mtime_ns'] != stats.st_mtime_ns):
+                return None
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        sections = header['sections']
+        columns = {}
+        for name, typecode in SECTIONS:
+            offset, length = sections[name]
+            if typecode == 'B':
+                # mmap.find działa bez kopiowania; kolumny bajtów jako wycinki mmap
+                columns[name] = _Section(buffer, offset, length)
+            else:
+                columns[name] = memoryview(buffer)[offset:offset + length].cast(typecode)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Flows entities unavailable: {e}", file=sys.stderr)
+        return None
+
+    # Oznacz jako ostatnio używany (LRU w flows_cache.enforce_limit)
+    os.utime(path)
+    return EntityDictionary(columns, buffer=buffer)
+
+
+def load_dictionary(csv_path, load_table):
+    """
+    Słownik dla pliku: zapisany w katalogu cache albo zbudowany z tabeli
+    load_table(csv_path) (i zapisany, gdy cache jest włączony).
+    """
+    try:
+        stats = os.stat(csv_path) if flows_cache.cache_enabled() else None
+    except OSError:
+        stats = None
+    if stats is None:
+        return EntityDictionary.from_table(load_table(csv_path))
+    dictionary = open_dictionary(csv_path)
+    if dictionary is None:
+        dictionary = EntityDictionary.from_table(load_table(csv_path))
+        try:
+            save_dictionary(dictionary, csv_path, stats)
+        except OSError as e:
+            print(f"Flows entities unavailable: {e}", file=sys.stderr)
+    return dictionary
+
+
+def main(argv=None):
+    """flows_entities.py plik.csv [--query ...] - strona podmiotów (jak polecenie serwera) jako JSON"""
+    parser = argparse.ArgumentParser(description='Wyszukiwanie podmiotów pliku CSV')
+    parser.add_argument('csv_path')
+    parser.add_argument('--query', default='', help='prefiks lub fragment nazwy')
+    parser.add_argument('--match', choices=['prefix', 'substring'], default='prefix')
+    parser.add_argument('--sort', choices=['name', 'volume'], default='name')
+    parser.add_argument('--offset', type=int, default=0)
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    parser.add_argument('--all', action='store_true', help='wszystkie trafienia (bez stron)')
+    args = parser.parse_args(argv)
+
+    from flows import find_entities
+    result = find_entities(vars(args))
+    sys.stdout.write(json.dumps(result, ensure_ascii=False) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
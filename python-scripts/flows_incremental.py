@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# python-scripts/flows_incremental.py
+"""
+Stan agregacji przyrostowej dla plików CSV, do których tylko dopisuje się wiersze.
+
+Dla każdego pliku i zestawu filtrów zapisywany jest (w katalogu cache, plik .agg:
+magic 'FLOWAGG1', nagłówek JSON i tablice liczb, jak w flows_cache):
+- nagłówek CSV,
+- znacznik (watermark): przesunięcie końca ostatniego przetworzonego pełnego rekordu,
+- odcisk przetworzonego fragmentu: SHA-256 z początku, końca i próbek co
+  1/PREFIX_SAMPLES fragmentu - stały koszt niezależnie od rozmiaru pliku,
+- format kwot (AmountFormat.to_dict), z którym czytane są też dopisane wiersze,
+- sumy par (nadawca, odbiorca) jako dokładne sumy częściowe (ExactSum),
+- SHA-256 wszystkich bajtów pliku, jeśli przebieg czytał cały plik (inaczej None).
+
+Kolejne uruchomienie czyta tylko bajty za znacznikiem. SHA-256 aktualnego stanu
+(rozmiar i mtime jak w pliku) jest skrótem treści dla cache wyników
+(source_digest); odcisk nim nie jest. Gdy plik się skrócił albo
+odcisk się nie zgadza (zmieniono wcześniejsze wiersze), stan jest budowany od nowa.
+Zmiana w miejscu, która zachowuje rozmiar i omija próbki, nie zostanie wykryta.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+import flows_cache
+from flows_table import ExactSum
+
+MAGIC = b'FLOWAGG1'
+# 2: format kwot pliku zapisany w stanie (amount), 3: daty DD.MM.YYYY, DD/MM/YYYY i znaczniki czasu,
+# 4: SHA-256 pliku (sha256)
+VERSION = 4
+# Rozmiar bloków początku/końca i pojedynczej próbki odcisku
+EDGE_BYTES = 64 * 1024
+SAMPLE_BYTES = 4 * 1024
+PREFIX_SAMPLES = 16
+
+
+def filters_key(entities=None, date_from=None, date_to=None):
+    """Znormalizowany opis filtrów (kolejność podmiotów nie ma znaczenia)"""
+    return {
+        'entities': sorted(set(entities)) if entities else [],
+        'from': date_from or '',
+        'to': date_to or '',
+    }
+
+
+def state_path(csv_path, filters):
+    """Ścieżka stanu: klucz pliku (jak w flows_cache) + skrót filtrów"""
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+    name = f'{flows_cache.cache_key(csv_path)}-{digest}{flows_cache.STATE_SUFFIX}'
+    return os.path.join(flows_cache.cache_dir_for(csv_path), name)
+
+
+def fingerprint(path, end):
+    """Odcisk fragmentu pliku [0, end): początek, koniec i równomierne próbki"""
+    digest = hashlib.sha256(str(end).encode('ascii'))
+    with open(path, 'rb') as f:
+        offsets = [0, max(end - EDGE_BYTES, 0)]
+        offsets += [end * i // (PREFIX_SAMPLES + 1) for i in range(1, PREFIX_SAMPLES + 1)]
+        for i, offset in enumerate(offsets):
+            f.seek(offset)
+            digest.update(f.read(min(EDGE_BYTES if i < 2 else SAMPLE_BYTES, end - offset)))
+    return digest.hexdigest()
+
+
+def source_digest(csv_path, filters):
+    """
+    SHA-256 pliku z aktualnego stanu dla filtrów albo None, gdy stanu brak,
+    plik się zmienił lub ostatni przebieg nie czytał całego pliku.
+    """
+    try:
+        stats = os.stat(csv_path)
+        with open(state_path(csv_path, filters), 'rb') as f:
+            state = _read_header(f)
+    except (OSError, ValueError):
+        return None
+    if state is None:
+        return None
+    source = state['source']
+    if (source['path'] != os.path.abspath(csv_path) or source['size'] != stats.st_size
+            or source['mtime_ns'] != stats.st_mtime_ns):
+        return None
+    return state.get('sha256')
+
+
+def is_current(state, csv_path):
+    """Czy stan opisuje plik w obecnym rozmiarze i z obecnym mtime"""
+    stats = os.stat(csv_path)
+    return state['source']['size'] == stats.st_size and state['source']['mtime_ns'] == stats.st_mtime_ns
+
+
+def _read_header(f):
+    """Czyta nagłówek pliku stanu; zwraca słownik lub None"""
+    prefix = f.read(12)
+    if len(prefix) < 12 or prefix[:8] != MAGIC:
+        return None
+    header_len = struct.unpack('<I', prefix[8:])[0]
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    if header.get('version') != VERSION or header.get('byteorder') != sys.byteorder:
+        return None
+    return header
+
+
+def _read_array(f, typecode, count):
+    values = array(typecode)
+    values.frombytes(f.read(count * values.itemsize))
+    if len(values) != count:
+        raise ValueError('truncated flows state')
+    return values
+
+
+def load_state(csv_path, filters):
+    """
+    Wczytuje stan, jeśli da się od niego kontynuować (plik nie skrócił się,
+    odcisk przetworzonej części się zgadza); w przeciwnym razie zwraca None.
+    Sumy par są zwracane jako słownik {(nadawca, odbiorca): ExactSum}.
+    """
+    path = state_path(csv_path, filters)
+    try:
+        stats = os.stat(csv_path)
+        with open(path, 'rb') as f:
+            state = _read_header(f)
+            if state is None:
+                return None
+            source = state['source']
+            if state['filters'] != filters or source['path'] != os.path.abspath(csv_path):
+                return None
+            watermark = state['watermark']
+            if stats.st_size < watermark:
+                return None
+            unchanged = source['size'] == stats.st_size and source['mtime_ns'] == stats.st_mtime_ns
+            if not unchanged and fingerprint(csv_path, watermark) != state['fingerprint']:
+                return None
+
+            count = state['pairs']
+            senders = _read_array(f, 'i', count)
+            receivers = _read_array(f, 'i', count)
+            lengths = _read_array(f, 'i', count)
+            specials = _read_array(f, 'd', count)
+            partials = _read_array(f, 'd', sum(lengths)).tolist()
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Flows state unavailable: {e}", file=sys.stderr)
+        return None
+
+    # Oznacz jako ostatnio używany (LRU w flows_cache.enforce_limit)
+    os.utime(path)
+    names = state.pop('names')
+    pairs = {}
+    position = 0
+    for s, r, length, special in zip(senders, receivers, lengths, specials):
+        total = pairs[(names[s], names[r])] = ExactSum()
+        total.partials = partials[position:position + length]
+        total.special = special
+        position += length
+    state['pairs'] = pairs
+    return state
+
+
+def save_state(csv_path, filters, header, watermark, pairs, amount, sha256=None, stats=None):
+    """
+    Zapisuje stan (atomowo) i pilnuje limitu rozmiaru katalogu cache.
+    sha256 to skrót wszystkich bajtów pliku opisanego przez stats (os.stat).
+    """
+    path = state_path(csv_path, filters)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    if stats is None:
+        stats = os.stat(csv_path)
+
+    # Nazwy podmiotów raz, pary jako numery nazw
+    name_ids = {}
+    senders, receivers, lengths = array('i'), array('i'), array('i')
+    specials, partials = array('d'), array('d')
+    for (sender, receiver), total in pairs.items():
+        senders.append(name_ids.setdefault(sender, len(name_ids)))
+        receivers.append(name_ids.setdefault(receiver, len(name_ids)))
+        lengths.append(len(total.partials))
+        specials.append(total.special)
+        partials.extend(total.partials)
+
+    state = {
+        'version': VERSION,
+        'byteorder': sys.byteorder,
+        'source': {
+            'path': os.path.abspath(csv_path),
+            'size': stats.st_size,
+            'mtime_ns': stats.st_mtime_ns,
+        },
+        'filters': filters,
+        'header': header,
+        'amount': amount.to_dict(),
+        'watermark': watermark,
+        'fingerprint': fingerprint(csv_path, watermark),
+        'sha256': sha256,
+        'pairs': len(senders),
+        'names': list(name_ids),
+    }
+    raw = json.dumps(state, ensure_ascii=False).encode('utf-8')
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(raw)) + raw)
+        for values in (senders, receivers, lengths, specials, partials):
+            values.tofile(f)
+    os.replace(tmp_path, path)
+    flows_cache.enforce_limit(directory, flows_cache.cache_max_bytes(), keep=path)
+    return path
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# python-scripts/flows_layout.py
+"""
+Struktury pomocnicze układu wykresu Sankey.
+
+Adjacency opisuje graf przepływów (EdgeList) w postaci list sąsiedztwa,
+zbudowanych jednym przejściem po krawędziach - dzięki temu klasyfikacja
+węzłów i rozmieszczenie działa w czasie O(węzły + krawędzie).
+
+compute_layout układa graf w warstwach (jak łańcuch dostaw: producent →
+fabryka → montownia → klient): przydział warstw w porządku topologicznym
+z przerywaniem cykli, wysokość węzłów proporcjonalna do przepływu i
+ograniczona liczba iteracji barycentrów zmniejszających liczbę przecięć.
+"""
+
+import heapq
+from collections import deque
+from operator import mul
+
+from flows_table import EdgeList
+
+
+class Adjacency:
+    """Listy sąsiedztwa, stopnie i sumy przepływów dla każdego węzła"""
+
+    __slots__ = ('node_count', 'out_edges', 'in_edges', 'out_degree', 'in_degree',
+                 'out_total', 'in_total')
+
+    def __init__(self, node_count):
+        self.node_count = node_count
+        # Numery krawędzi wychodzących / wchodzących dla każdego węzła
+        self.out_edges = [[] for _ in range(node_count)]
+        self.in_edges = [[] for _ in range(node_count)]
+        self.out_degree = [0] * node_count
+        self.in_degree = [0] * node_count
+        self.out_total = [0.0] * node_count
+        self.in_total = [0.0] * node_count
+
+    @classmethod
+    def from_edges(cls, edges):
+        """Buduje sąsiedztwo z EdgeList jednym przejściem po krawędziach"""
+        adjacency = cls(len(edges.names))
+        out_edges, in_edges = adjacency.out_edges, adjacency.in_edges
+        out_total, in_total = adjacency.out_total, adjacency.in_total
+
+        for i, (s, t, value) in enumerate(zip(edges.sources, edges.targets, edges.values)):
+            out_edges[s].append(i)
+            in_edges[t].append(i)
+            out_total[s] += value
+            in_total[t] += value
+
+        adjacency.out_degree = [len(e) for e in out_edges]
+        adjacency.in_degree = [len(e) for e in in_edges]
+        return adjacency
+
+    def throughput(self, node):
+        """Przepływ przez węzeł: większa z sum wejścia i wyjścia"""
+        return max(self.in_total[node], self.out_total[node])
+
+
+# Domyślne parametry układu warstwowego
+LAYOUT_ITERATIONS = 6
+# Iteracje barycentrów kończą się, gdy przejście przesuwa prawie tyle samo
+# węzłów co poprzednie (mniej niż o ten ułamek) - kolejność oscyluje zamiast się poprawiać
+MIN_ORDER_PROGRESS = 0.05
+NODE_PADDING = 12
+MIN_NODE_HEIGHT = 1.0
+# Minimalny odstęp między warstwami i minimalne miejsce na węzeł - przy
+# dużych grafach płótno rośnie zamiast ściskać węzły do zera
+LAYER_GAP = 160
+MIN_NODE_SLOT = 4
+# Poniżej tej wysokości miejsca na węzeł etykiety warstwy nie są rysowane
+LABEL_MIN_SLOT = 14
+
+
+class Layout:
+    """Wynik układu warstwowego: warstwy, kolejność i geometria węzłów i krawędzi"""
+
+    __slots__ = ('adjacency', 'layer', 'layers', 'width', 'height', 'scale',
+                 'node_x', 'node_y', 'node_height', 'edge_width', 'edge_y0', 'edge_y1',
+                 'labels')
+
+    def __init__(self, adjacency, layer, layers):
+        self.adjacency = adjacency
+        # Numer warstwy każdego węzła i kolejność węzłów w warstwach (z góry na dół)
+        self.layer = layer
+        self.layers = layers
+        self.width = 0
+        self.height = 0
+        self.scale = 0.0
+        self.node_x = []
+        self.node_y = []
+        self.node_height = []
+        self.edge_width = []
+        self.edge_y0 = []
+        self.edge_y1 = []
+        # Czy w warstwie jest miejsce na etykiety
+        self.labels = []
+
+    def is_back_edge(self, edges, i):
+        """Czy krawędź wraca do tej samej lub wcześniejszej warstwy (cykl)"""
+        return self.layer[edges.targets[i]] <= self.layer[edges.sources[i]]
+
+
+def assign_layers(edges, adjacency, rank):
+    """
+    Przydział węzłów do warstw: najdłuższa ścieżka w porządku topologicznym
+    (algorytm Kahna). Gdy zostają same cykle, wybierany jest węzeł o największej
+    nadwyżce wypływu nad wpływem, a jego pozostałe krawędzie wejściowe stają się
+    krawędziami zwrotnymi. Węzły bez wypływów trafiają do ostatniej warstwy.
+    """
+    n = adjacency.node_count
+    targets = edges.targets
+    out_edges = adjacency.out_edges
+    remaining = list(adjacency.in_degree)
+    layer = [0] * n
+    placed = [False] * n
+
+    queue = deque(sorted((v for v in range(n) if remaining[v] == 0), key=rank.__getitem__))
+    # Kandydaci do przerwania cyklu (z leniwym usuwaniem już umieszczonych)
+    candidates = [(adjacency.in_total[v] - adjacency.out_total[v], rank[v], v) for v in range(n)]
+    heapq.heapify(candidates)
+
+    done = 0
+    while done < n:
+        if not queue:
+            while placed[candidates[0][2]]:
+                heapq.heappop(candidates)
+            queue.append(heapq.heappop(candidates)[2])
+        v = queue.popleft()
+        if placed[v]:
+            continue
+        placed[v] = True
+        done += 1
+        next_layer = layer[v] + 1
+        for i in out_edges[v]:
+            t = targets[i]
+            if placed[t]:
+                continue
+            if layer[t] < next_layer:
+                layer[t] = next_layer
+            remaining[t] -= 1
+            if remaining[t] == 0:
+                queue.append(t)
+
+    last = max(layer) if n else 0
+    for v in range(n):
+        if not adjacency.out_degree[v]:
+            layer[v] = last
+    return layer
+
+
+def _neighbours(edges, adjacency, layer):
+    """
+    Sąsiedzi każdego węzła w warstwach po lewej i po prawej stronie:
+    (numery węzłów, wagi, suma wag) - wagi liczone raz, nie w każdej iteracji.
+    """
+    n = adjacency.node_count
+    left = [([], []) for _ in range(n)]
+    right = [([], []) for _ in range(n)]
+    for s, t, value in zip(edges.sources, edges.targets, edges.values):
+        if layer[s] > layer[t]:
+            s, t = t, s
+        elif layer[s] == layer[t]:
+            continue
+        ids, weights = right[s]
+        ids.append(t)
+        weights.append(value)
+        ids, weights = left[t]
+        ids.append(s)
+        weights.append(value)
+    left = [(ids, weights, sum(weights)) for ids, weights in left]
+    right = [(ids, weights, sum(weights)) for ids, weights in right]
+    return left, right
+
+
+def _reorder(order, neighbours, position):
+    """Sortuje warstwę według ważonego barycentrum sąsiadów; zwraca liczbę przesuniętych węzłów"""
+    keyed = []
+    for v in order:
+        ids, weights, total = neighbours[v]
+        if total:
+            barycenter = sum(map(mul, weights, map(position.__getitem__, ids))) / total
+        else:
+            barycenter = position[v]
+        keyed.append((barycenter, position[v], v))
+    keyed.sort()
+    moved = 0
+    for index, (_, old, v) in enumerate(keyed):
+        if old != index:
+            moved += 1
+        order[index] = v
+        position[v] = index
+    return moved
+
+
+def order_layers(layers, left, right, iterations=LAYOUT_ITERATIONS):
+    """
+    Zmniejsza liczbę przecięć metodą barycentrów: naprzemienne przejścia
+    w dół i w górę, najwyżej `iterations` razy. Kończy wcześniej, gdy nic się
+    nie zmienia albo gdy przejście przesuwa prawie tyle samo węzłów co
+    poprzednie (MIN_ORDER_PROGRESS) - np. w gęstym losowym grafie kolejność
+    oscyluje i kolejne iteracje tylko kosztują.
+    """
+    position = [0] * sum(len(order) for order in layers)
+    for order in layers:
+        for index, v in enumerate(order):
+            position[v] = index
+
+    previous = None
+    for _ in range(iterations):
+        moved = 0
+        for order in layers[1:]:
+            moved += _reorder(order, left, position)
+        for order in reversed(layers[:-1]):
+            moved += _reorder(order, right, position)
+        if not moved or (previous is not None and moved > previous * (1 - MIN_ORDER_PROGRESS)):
+            break
+        previous = moved
+    return layers
+
+
+def compute_layout(edges, width=800, height=600, margin=100, node_width=20,
+                   iterations=LAYOUT_ITERATIONS, node_padding=NODE_PADDING):
+    """
+    Układ warstwowy wykresu Sankey dla EdgeList. Koszt jednej iteracji jest
+    liniowy względem krawędzi (plus sortowanie warstw), liczba iteracji jest ograniczona.
+    """
+    adjacency = Adjacency.from_edges(edges)
+    names = edges.names
+    n = adjacency.node_count
+
+    # Ranga nazwy - deterministyczny porządek niezależny od numeracji węzłów
+    rank = [0] * n
+    # Węzły „Inne” (OtherNode) według etykiety
+    for index, v in enumerate(sorted(range(n), key=lambda v: str(names[v]))):
+        rank[v] = index
+
+    layer = assign_layers(edges, adjacency, rank)
+    layers = [[] for _ in range(max(layer) + 1 if n else 0)]
+    for v in sorted(range(n), key=rank.__getitem__):
+        layers[layer[v]].append(v)
+
+    left, right = _neighbours(edges, adjacency, layer)
+    order_layers(layers, left, right, iterations)
+
+    layout = Layout(adjacency, layer, layers)
+    widest = max((len(order) for order in layers), default=1)
+    layout.width = width = max(width, 2 * margin + (len(layers) - 1) * LAYER_GAP)
+    layout.height = height = max(height, 2 * margin + widest * MIN_NODE_SLOT)
+    available = height - 2 * margin
+
+    # Odstępy w warstwie maleją, gdy węzłów jest dużo; skala wspólna dla wszystkich warstw
+    throughput = [adjacency.throughput(v) for v in range(n)]
+    padding = []
+    scale = None
+    for order in layers:
+        gap = min(node_padding, available * 0.5 / max(len(order) - 1, 1))
+        padding.append(gap)
+        total = sum(throughput[v] for v in order)
+        if total > 0:
+            layer_scale = (available - gap * (len(order) - 1)) / total
+            scale = layer_scale if scale is None else min(scale, layer_scale)
+    layout.scale = scale = scale or 0.0
+
+    # Geometria węzłów: warstwy równomiernie w poziomie, wyśrodkowane w pionie
+    step = (width - 2 * margin) / max(len(layers) - 1, 1)
+    node_x = [0.0] * n
+    node_y = [0.0] * n
+    node_height = [0.0] * n
+    for index, order in enumerate(layers):
+        x = margin + index * step if len(layers) > 1 else width / 2
+        heights = [max(throughput[v] * scale, MIN_NODE_HEIGHT) for v in order]
+        used = sum(heights) + padding[index] * (len(order) - 1)
+        y = margin + max(available - used, 0) / 2
+        for v, h in zip(order, heights):
+            node_x[v] = x
+            node_y[v] = y
+            node_height[v] = h
+            y += h + padding[index]
+        layout.labels.append(available / max(len(order), 1) >= LABEL_MIN_SLOT)
+    layout.node_x, layout.node_y, layout.node_height = node_x, node_y, node_height
+
+    # Krawędzie układane jedna pod drugą na obu końcach, w kolejności położenia drugiego końca
+    sources, targets, values = edges.sources, edges.targets, edges.values
+    edge_count = len(values)
+    edge_width = [max(value * scale, MIN_NODE_HEIGHT) for value in values]
+    edge_y0 = [0.0] * edge_count
+    edge_y1 = [0.0] * edge_count
+    for v in range(n):
+        offset = node_y[v]
+        for i in sorted(adjacency.out_edges[v], key=lambda i: node_y[targets[i]]):
+            edge_y0[i] = offset + edge_width[i] / 2
+            offset += edge_width[i]
+        offset = node_y[v]
+        for i in sorted(adjacency.in_edges[v], key=lambda i: node_y[sources[i]]):
+            edge_y1[i] = offset + edge_width[i] / 2
+            offset += edge_width[i]
+    layout.edge_width, layout.edge_y0, layout.edge_y1 = edge_width, edge_y0, edge_y1
+    return layout
+
+
+class OtherNode:
+    """
+    Węzeł syntetyczny „Inne” dla przepływów pominiętych na wykresie. Jako klucz
+    w EdgeList nie jest równy żadnej nazwie z pliku CSV (jak MISSING zamiast
+    nazwy), więc podmiot o nazwie „Inne (nadawcy)” nie trafi do tego węzła;
+    etykieta (str) jest używana dopiero przy rysowaniu.
+    """
+
+    __slots__ = ('key', 'label')
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+
+    def __str__(self):
+        return self.label
+
+    def __repr__(self):
+        return self.key
+
+    def __reduce__(self):
+        # Po serializacji (pula procesów) ten sam obiekt modułu
+        return self.key
+
+
+OTHER_SENDER = OtherNode('OTHER_SENDER', 'Inne (nadawcy)')
+OTHER_RECEIVER = OtherNode('OTHER_RECEIVER', 'Inne (odbiorcy)')
+
+
+def collapse_edges(edges, top=None, min_value=None, min_percent=None):
+    """
+    Zostawia `top` największych krawędzi (wybór kopcem, O(e log top)) o wartości
+    co najmniej `min_value` i co najmniej `min_percent` % sumy wszystkich przepływów.
+    Wybrane krawędzie wyznaczają widoczne węzły. Przepływ między dwoma widocznymi
+    węzłami jest rysowany między nimi (także poniżej progów), żeby wpływ i wypływ
+    każdego widocznego węzła się zgadzały - krawędzi może więc być więcej niż `top`.
+    Pozostałe przepływy są sumowane w krawędzie do węzłów „Inne”: pominięty wypływ
+    widocznego nadawcy trafia do OTHER_RECEIVER, wpływ widocznego odbiorcy - od
+    OTHER_SENDER, a przepływy między niewidocznymi węzłami - do krawędzi
+    OTHER_SENDER → OTHER_RECEIVER. Suma wartości na wykresie się nie zmienia.
+
+    Zwraca (EdgeList, {'edges': liczba zwiniętych krawędzi, 'value': ich suma}).
+    """
+    values = edges.values
+    kept = range(len(values))
+    if min_value is not None:
+        kept = [i for i in kept if values[i] >= min_value]
+    if min_percent is not None:
+        threshold = sum(values) * min_percent / 100
+        kept = [i for i in kept if values[i] >= threshold]
+    if top is not None and top < len(kept):
+        kept = heapq.nlargest(max(top, 0), kept, key=values.__getitem__)
+
+    if len(kept) == len(values):
+        return edges, {'edges': 0, 'value': 0.0}
+
+    keep = bytearray(len(values))
+    visible = bytearray(len(edges.names))
+    for i in kept:
+        keep[i] = 1
+        visible[edges.sources[i]] = visible[edges.targets[i]] = 1
+    sources, targets = edges.sources, edges.targets
+    for i in range(len(values)):
+        if visible[sources[i]] and visible[targets[i]]:
+            keep[i] = 1
+
+    collapsed = {'edges': len(values) - sum(keep), 'value': 0.0}
+    if not collapsed['edges']:
+        return edges, collapsed
+
+    # Krawędzie w kolejności pierwszego wystąpienia, jak w wejściowej liście
+    result = EdgeList()
+    names = edges.names
+    for i in range(len(values)):
+        if keep[i]:
+            result.add(names[sources[i]], names[targets[i]], values[i])
+
+    # Pominięte przepływy sumowane w kolejności krawędzi (EdgeList.add dodaje do istniejącej)
+    for i, (s, t, value) in enumerate(zip(sources, targets, values)):
+        if keep[i]:
+            continue
+        collapsed['value'] += value
+        if visible[s]:
+            result.add(names[s], OTHER_RECEIVER, value)
+        elif visible[t]:
+            result.add(OTHER_SENDER, names[t], value)
+        else:
+            result.add(OTHER_SENDER, OTHER_RECEIVER, value)
+    return result, collapsed
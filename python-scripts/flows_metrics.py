@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# python-scripts/flows_metrics.py
+"""
+Opcjonalne pomiary etapów wykresu: czas rzeczywisty, czas CPU, liczba wierszy
+na wejściu i wyjściu oraz szczyt pamięci (tracemalloc) dla etapów load_params,
+parse, filter, aggregate, layout i serialize.
+
+Każde wywołanie (run) daje jeden rekord JSON:
+
+    {"event": "flows_run", "mode": "cli", "ok": true, "wall_s": ..., "cpu_s": ...,
+     "peak_bytes": ..., "stages": [{"name": "parse", "wall_s": ..., "cpu_s": ...,
+     "rows_in": ..., "rows_out": ..., "peak_bytes": ...}, ...], ...}
+
+Włączanie: FLOWS_METRICS (lub flows.py --metrics) - ścieżka pliku, do którego
+dopisywane są rekordy (JSON lines), albo '-' / '1' = stderr. W trybie serwera
+rekord jest też dołączany do odpowiedzi ("metrics"). FLOWS_METRICS_MEMORY=0
+wyłącza tracemalloc (znacznie spowalnia przetwarzanie).
+
+FLOWS_PROFILE_DIR włącza cProfile; profil (.prof, do pstats/snakeviz) jest
+zapisywany tylko dla wywołań dłuższych niż FLOWS_PROFILE_MIN_SECONDS (domyślnie 1 s).
+
+Bez włączenia stage() nic nie mierzy. Etapy zagnieżdżone w innym etapie
+nie są liczone osobno.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+VERSION = 1
+
+# Aktywny pomiar (tryb serwera obsługuje żądania po kolei)
+_current = None
+
+
+def destination():
+    """Cel rekordów z FLOWS_METRICS: ścieżka, '-' (stderr) lub None (wyłączone)"""
+    value = os.environ.get('FLOWS_METRICS', '')
+    if value in ('', '0'):
+        return None
+    return '-' if value == '1' else value
+
+
+def memory_enabled():
+    return os.environ.get('FLOWS_METRICS_MEMORY', '1') != '0'
+
+
+def profile_dir():
+    return os.environ.get('FLOWS_PROFILE_DIR') or None
+
+
+def profile_min_seconds():
+    return float(os.environ.get('FLOWS_PROFILE_MIN_SECONDS', '1'))
+
+
+class Stage:
+    """Pomiar jednego etapu; rows_out (i ewentualnie rows_in) ustawia kod etapu"""
+
+    __slots__ = ('run', 'name', 'rows_in', 'rows_out', 'extra', '_wall', '_cpu', '_memory')
+
+    def __init__(self, run, name, rows_in=None, **extra):
+        self.run = run
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.extra = extra
+
+    def __enter__(self):
+        self.run._active = self
+        self._memory = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self._memory = tracemalloc.get_traced_memory()[0]
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        record = {'name': self.name, 'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6),
+                  'rows_in': self.rows_in, 'rows_out': self.rows_out}
+        if self._memory is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            record['peak_bytes'] = peak - self._memory
+            self.run._peak = max(self.run._peak, peak)
+        record.update(self.extra)
+        self.run.stages.append(record)
+        self.run._active = None
+        return False
+
+
+class _NullStage:
+    """Etap bez pomiaru (pomiary wyłączone lub etap zagnieżdżony)"""
+
+    def __init__(self):
+        self.rows_in = None
+        self.rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Jeden obiekt na wszystkie wywołania bez pomiaru (przypisania rows_out są ignorowane)
+_NULL_STAGE = _NullStage()
+
+
+class Run:
+    """Pomiar jednego wywołania: etapy, łączny czas, pamięć i opcjonalny profil"""
+
+    def __init__(self, mode, params=None, target=None):
+        self.mode = mode
+        self.target = target
+        self.stages = []
+        self.info = {}
+        self.query = {}
+        self.record = None
+        self._active = None
+        self._profiler = None
+        self._tracing = False
+        self._peak = 0
+        if params is not None:
+            self.describe(params)
+
+    def describe(self, params):
+        """Opis zapytania w rekordzie (bez listy podmiotów - tylko ich liczba)"""
+        self.query = {
+            'csv_path': params.get('csv_path') or None,
+            'entities': len(params.get('entities') or []),
+            'from': params.get('from') or None,
+            'to': params.get('to') or None,
+        }
+
+    def stage(self, name, rows_in=None, **extra):
+        if self._active is not None:
+            return _NULL_STAGE
+        return Stage(self, name, rows_in, **extra)
+
+    def __enter__(self):
+        global _current
+        self._previous = _current
+        _current = self
+        self._started = datetime.now(timezone.utc)
+        if memory_enabled() and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if profile_dir():
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _current
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        if self._profiler is not None:
+            self._profiler.disable()
+        peak = None
+        if tracemalloc.is_tracing():
+            peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            if self._tracing:
+                tracemalloc.stop()
+        _current = self._previous
+
+        self.record = {
+            'event': 'flows_run',
+            'version': VERSION,
+            'started': self._started.isoformat(timespec='milliseconds'),
+            'pid': os.getpid(),
+            'mode': self.mode,
+            'ok': exc_type is None,
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'peak_bytes': peak,
+            **self.query,
+            **self.info,
+            'stages': self.stages,
+        }
+        if exc is not None:
+            self.record['error'] = str(exc)
+        if self._profiler is not None and wall >= profile_min_seconds():
+            self.record['profile'] = self._dump_profile()
+        if self.target:
+            emit(self.record, self.target)
+        return False
+
+    def _dump_profile(self):
+        """Zapisuje profil wywołania do FLOWS_PROFILE_DIR; zwraca ścieżkę"""
+        directory = profile_dir()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            stamp = self._started.strftime('%Y%m%dT%H%M%S%f')
+            path = os.path.join(directory, f'flows-{stamp}-{os.getpid()}.prof')
+            self._profiler.dump_stats(path)
+            return path
+        except OSError as e:
+            print(f"Flows profile unavailable: {e}", file=sys.stderr)
+            return None
+
+
+def emit(record, target=None):
+    """Zapisuje rekord jako jedną linię JSON do pliku lub na stderr"""
+    target = target or destination()
+    if target is None:
+        return
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    if target == '-':
+        sys.stderr.write(line)
+        sys.stderr.flush()
+        return
+    try:
+        with open(target, 'a', encoding='utf-8') as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Flows metrics unavailable: {e}", file=sys.stderr)
+
+
+def run(mode, params=None, target=None):
+    """
+    Pomiar wywołania (context manager zwracający Run, rekord w Run.record) albo
+    nullcontext (zwraca None), gdy pomiary są wyłączone. target nadpisuje
+    FLOWS_METRICS; False - rekord tylko w Run.record, bez zapisu.
+    """
+    if target is None:
+        target = destination()
+        if target is None:
+            return contextlib.nullcontext()
+    return Run(mode, params, target)
+
+
+def stage(name, rows_in=None, **extra):
+    """Pomiar etapu w aktywnym wywołaniu (bez aktywnego - bez pomiaru)"""
+    if _current is None:
+        return _NULL_STAGE
+    return _current.stage(name, rows_in, **extra)
+
+
+def describe(params):
+    """Ustawia opis zapytania aktywnego wywołania (gdy parametry są znane później)"""
+    if _current is not None:
+        _current.describe(params)
+
+
+def note(**info):
+    """Dodaje pola do rekordu aktywnego wywołania (np. użytą ścieżkę obliczeń)"""
+    if _current is not None:
+        _current.info.update(info)
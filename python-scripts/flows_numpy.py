@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# python-scripts/flows_numpy.py
+"""
+Opcjonalny silnik NumPy dla filtrowania i agregacji FlowTable.
+
+Kolumny tabeli (array / memoryview z cache) są widziane jako ndarray bez
+kopiowania. Filtrowanie najpierw zawęża wiersze indeksami tabeli (podmiotów
+i dat), a pozostały warunek to maska logiczna na kandydatach; agregacja - np.unique po
+spakowanych parach (id nadawcy << 32 | id odbiorcy) i np.bincount z wagami.
+np.bincount dodaje kwoty po kolei w kolejności wierszy, więc sumy są
+identyczne co do bitu z silnikiem w czystym Pythonie.
+
+Silnik jest wybierany automatycznie, gdy NumPy jest zainstalowany.
+Zmienna FLOWS_ENGINE=python wymusza wersję bez NumPy.
+"""
+
+import os
+import sys
+from array import array
+
+from flows_table import FlowTable, EdgeList, NO_DATE, parse_day
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - zależy od środowiska
+    np = None
+
+# Ostrzeżenie o brakującym NumPy jest wypisywane raz na proces
+_warned = False
+
+
+def available():
+    """Czy NumPy jest zainstalowany"""
+    return np is not None
+
+
+def enabled():
+    """Czy używać silnika NumPy (FLOWS_ENGINE: auto / numpy / python)"""
+    engine = os.environ.get('FLOWS_ENGINE', 'auto')
+    if engine == 'python':
+        return False
+    if engine == 'numpy' and np is None:
+        global _warned
+        if not _warned:
+            _warned = True
+            print("FLOWS_ENGINE=numpy, but NumPy is not installed - using python engine", file=sys.stderr)
+    return np is not None
+
+
+def columns(table):
+    """Widoki ndarray na kolumny tabeli (bez kopiowania)"""
+    if not len(table):
+        return (np.zeros(0, dtype=np.intc), np.zeros(0, dtype=np.intc),
+                np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.intc))
+    return (
+        np.frombuffer(table.senders, dtype=np.intc),
+        np.frombuffer(table.receivers, dtype=np.intc),
+        np.frombuffer(table.amounts, dtype=np.float64),
+        np.frombuffer(table.dates, dtype=np.intc),
+    )
+
+
+def _view(values):
+    """Widok ndarray na array('i') (pusty też)"""
+    return np.frombuffer(values, dtype=np.intc) if len(values) else np.zeros(0, dtype=np.intc)
+
+
+def _entity_rows(table, ids):
+    """Wiersze (rosnąco) z udziałem podmiotów - z indeksu podmiotów tabeli"""
+    postings = table.entity_index()
+    lists = [_view(postings[e]) for e in ids if 0 <= e < len(postings)]
+    if not lists:
+        return np.zeros(0, dtype=np.intc)
+    if len(lists) == 1:
+        return lists[0]
+    return np.unique(np.concatenate(lists))
+
+
+def _in_range(days, start, end):
+    """Maska dni w [start, end]; wiersze bez poprawnej daty zawsze zostają"""
+    mask = days == NO_DATE
+    in_range = np.ones(len(days), dtype=bool)
+    if start != NO_DATE:
+        in_range &= days >= start
+    if end != NO_DATE:
+        in_range &= days <= end
+    return mask | in_range
+
+
+def select_rows(table, entities=None, date_from=None, date_to=None):
+    """
+    Numery wierszy (rosnąco) spełniających filtry; None = wszystkie.
+    Jak FlowTable.filter: kandydaci pochodzą z indeksu podmiotów lub indeksu
+    dat (mniejszy zbiór), a pozostały warunek to maska NumPy tylko na nich -
+    koszt zależy od liczby pasujących wierszy, a nie od rozmiaru tabeli.
+    """
+    start = parse_day(date_from) if date_from else NO_DATE
+    end = parse_day(date_to) if date_to else NO_DATE
+    by_date = start != NO_DATE or end != NO_DATE
+    if not entities and not by_date:
+        return None
+
+    ids = None
+    if entities:
+        ids = np.array([table.name_ids[e] for e in entities if e in table.name_ids], dtype=np.intc)
+        entity_rows = _entity_rows(table, ids)
+        if not by_date:
+            return entity_rows
+
+    _, order, undated = table.date_index()
+    lo, hi = table._range_bounds(start, end)
+    if ids is not None and len(entity_rows) <= hi - lo + len(undated):
+        dates = columns(table)[3]
+        return entity_rows[_in_range(dates[entity_rows], start, end)]
+
+    rows = np.sort(np.concatenate([_view(order[lo:hi]), _view(undated)]))
+    if ids is None:
+        return rows
+    senders, receivers, _, _ = columns(table)
+    return rows[np.isin(senders[rows], ids) | np.isin(receivers[rows], ids)]
+
+
+def take(table, rows):
+    """Odpowiednik FlowTable.take dla indeksów w ndarray"""
+    senders, receivers, amounts, dates = columns(table)
+    subset = FlowTable.from_columns(
+        table.names,
+        array('i', senders[rows].tobytes()),
+        array('i', receivers[rows].tobytes()),
+        array('d', amounts[rows].tobytes()),
+        array('i', dates[rows].tobytes()),
+        csv_path=table.csv_path,
+        name_ids=table.name_ids
+    )
+    if table.row_ids is None:
+        row_ids = rows.astype(np.intc)
+    else:
+        row_ids = np.frombuffer(table.row_ids, dtype=np.intc)[rows]
+    subset.row_ids = array('i', row_ids.tobytes())
+    subset._columns = table._columns
+    return subset
+
+
+def filter_table(table, entities=None, date_from=None, date_to=None):
+    """Filtruje tabelę maskami NumPy; zwraca nową tabelę (jak FlowTable.filter)"""
+    rows = select_rows(table, entities, date_from, date_to)
+    if rows is None:
+        return table
+    return take(table, rows)
+
+
+def aggregate_pairs(table, rows=None):
+    """Sumuje kwoty dla par (nadawca, odbiorca); zwraca EdgeList jak FlowTable.aggregate_pairs"""
+    senders, receivers, amounts, _ = columns(table)
+    if rows is not None:
+        senders, receivers, amounts = senders[rows], receivers[rows], amounts[rows]
+
+    # Puste nazwy są pomijane; id -1 (brak kolumny) trafia na ostatni element = True
+    named = np.fromiter((bool(n) for n in table.names), dtype=bool, count=len(table.names))
+    named = np.append(named, True)
+    valid = (amounts > 0) & named[senders] & named[receivers]
+
+    keys = ((senders[valid].astype(np.int64) + 1) << 32) | (receivers[valid].astype(np.int64) + 1)
+    edges = EdgeList()
+    if not len(keys):
+        return edges
+
+    unique_keys, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=amounts[valid], minlength=len(unique_keys))
+
+    # Kolejność krawędzi jak w wersji Python - według pierwszego wystąpienia pary
+    for k in np.argsort(first_index, kind='stable'):
+        key = int(unique_keys[k])
+        edges.add(table.name((key >> 32) - 1), table.name((key & 0xFFFFFFFF) - 1), float(sums[k]))
+    return edges
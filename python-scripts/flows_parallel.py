@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# python-scripts/flows_parallel.py
+"""
+Podział dużych plików CSV na zakresy bajtów do równoległego przetwarzania.
+
+Każdy zakres zaczyna się na początku rekordu: granica to pierwszy znak nowej
+linii za punktem podziału, przed którym liczba cudzysłowów od początku pliku
+jest parzysta - nowe linie wewnątrz pól w cudzysłowie są pomijane.
+Cudzysłowy liczą procesy robocze, każdy w swoim fragmencie między punktami
+podziału; parzystość przed każdym punktem to suma liczników poprzednich
+fragmentów, a proces główny czyta tylko nagłówek i kilka bajtów za każdym
+punktem (do najbliższej granicy rekordu) - nigdy całego pliku.
+Zakresy są przetwarzane w puli procesów (map_ranges), a wyniki wracają
+w kolejności zakresów.
+
+FLOWS_PARALLEL - liczba procesów (domyślnie liczba rdzeni, 0 lub 1 = wyłączone),
+FLOWS_PARALLEL_MIN_BYTES - mniejsze pliki są przetwarzane szeregowo.
+"""
+
+import csv
+import io
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Blok czytany podczas szukania granic rekordów
+BLOCK_SIZE = 1024 * 1024
+# Zakresów jest kilka razy więcej niż procesów - wyrównuje obciążenie
+RANGES_PER_WORKER = 4
+
+
+def worker_count():
+    """Liczba procesów z FLOWS_PARALLEL (domyślnie liczba rdzeni)"""
+    value = os.environ.get('FLOWS_PARALLEL')
+    if value is None:
+        return os.cpu_count() or 1
+    return max(int(value), 1)
+
+
+def min_bytes():
+    """Najmniejszy plik przetwarzany równolegle"""
+    return int(os.environ.get('FLOWS_PARALLEL_MIN_BYTES', str(32 * 1024 * 1024)))
+
+
+def is_large(csv_path):
+    """Czy plik jest na tyle duży, żeby przetwarzać go równolegle / przyrostowo"""
+    try:
+        return os.path.getsize(csv_path) >= min_bytes()
+    except OSError:
+        return False
+
+
+def workers_for(csv_path, workers=None):
+    """Liczba procesów dla danego pliku; 1 = przetwarzanie szeregowe (mały plik)"""
+    workers = worker_count() if workers is None else max(int(workers), 1)
+    if workers <= 1 or not is_large(csv_path):
+        return 1
+    return workers
+
+
+def record_starts(path, offsets, block_size=BLOCK_SIZE):
+    """
+    Dla każdego przesunięcia (rosnąco) zwraca początek pierwszego rekordu za nim,
+    a rozmiar pliku, gdy za przesunięciem nie ma już kolejnego rekordu.
+    Cudzysłowy są liczone od początku pliku, więc plik jest czytany szeregowo
+    do ostatniej granicy - split_ranges używa tego tylko dla nagłówka.
+    """
+    pending = sorted(offsets)
+    starts = []
+    # Liczba cudzysłowów przed bieżącym blokiem
+    quotes = 0
+    position = 0
+    with open(path, 'rb') as f:
+        while len(starts) < len(pending):
+            block = f.read(block_size)
+            if not block:
+                break
+            end = position + len(block)
+            while len(starts) < len(pending) and pending[len(starts)] < end:
+                search = max(pending[len(starts)] - position, 0)
+                seen = quotes + block.count(b'"', 0, search)
+                found = None
+                while True:
+                    newline = block.find(b'\n', search)
+                    if newline < 0:
+                        break
+                    seen += block.count(b'"', search, newline)
+                    if seen % 2 == 0:
+                        found = position + newline + 1
+                        break
+                    search = newline + 1
+                if found is None:
+                    # Granica jest w jednym z kolejnych bloków
+                    break
+                starts.append(found)
+            quotes += block.count(b'"')
+            position = end
+        size = os.fstat(f.fileno()).st_size
+    return starts + [size] * (len(pending) - len(starts))
+
+
+def count_quotes(task):
+    """Liczba cudzysłowów w zakresie bajtów (path, początek, koniec) - w procesie roboczym"""
+    path, start, end = task
+    count = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            count += block.count(b'"')
+            remaining -= len(block)
+    return count
+
+
+def next_records(path, offsets, quotes, block_size=BLOCK_SIZE):
+    """
+    Jak record_starts, ale z podaną liczbą cudzysłowów przed każdym przesunięciem:
+    plik jest czytany tylko od przesunięcia do najbliższej granicy rekordu.
+    """
+    starts = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        for offset, seen in zip(offsets, quotes):
+            f.seek(offset)
+            position = offset
+            found = None
+            while found is None:
+                block = f.read(block_size)
+                if not block:
+                    break
+                search = 0
+                newline = block.find(b'\n')
+                while newline >= 0:
+                    seen += block.count(b'"', search, newline)
+                    if seen % 2 == 0:
+                        found = position + newline + 1
+                        break
+                    search = newline + 1
+                    newline = block.find(b'\n', search)
+                seen += block.count(b'"', search)
+                position += len(block)
+            starts.append(size if found is None else found)
+    return starts
+
+
+def split_ranges(path, parts, workers=1):
+    """
+    Dzieli plik na co najwyżej `parts` zakresów rekordów danych (ostatni kończy się
+    na końcu pliku). Cudzysłowy we fragmentach między punktami podziału liczy
+    `workers` procesów.
+    Zwraca (nagłówek CSV, [(początek, koniec), ...]); nagłówek None dla pustego pliku.
+    """
+    size = os.path.getsize(path)
+    data_start = record_starts(path, [0])[0] if size else 0
+    with open(path, 'rb') as f:
+        raw = f.read(data_start)
+    header = next(csv.reader(io.StringIO(raw.decode('utf-8'), newline='')), None)
+    if header is None:
+        return None, []
+
+    step = (size - data_start) / max(parts, 1)
+    targets = [int(data_start + step * i) for i in range(1, max(parts, 1))]
+    # Cudzysłowy w fragmentach [punkt, następny punkt); przed data_start jest ich parzyście
+    tasks = [(path, start, end) for start, end in zip([data_start] + targets, targets)]
+    if workers > 1 and len(tasks) > 1:
+        counts = map_ranges(count_quotes, tasks, workers)
+    else:
+        counts = [count_quotes(task) for task in tasks]
+    quotes = list(itertools.accumulate(counts))
+    bounds = [data_start] + next_records(path, targets, quotes) + [size]
+    ranges = [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+    return header, ranges
+
+
+class RecordReader:
+    """
+    Pełne rekordy CSV z zakresu bajtów [start, end) jako tekst (dla csv.reader).
+
+    Rekord jest pełny, gdy kończy się znakiem nowej linii przy parzystej liczbie
+    cudzysłowów. `offset` to koniec ostatniego zwróconego rekordu, a niedokończony
+    rekord na końcu pliku (np. dopisywany właśnie wiersz bez nowej linii) nie jest
+    zwracany, tylko zapisywany w `tail`. Podany `digest` (np. hashlib.sha256())
+    jest uzupełniany o wszystkie przeczytane bajty.
+    """
+
+    def __init__(self, path, start, end=None, digest=None):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.offset = start
+        self.tail = ''
+        self.digest = digest
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            remaining = None if self.end is None else self.end - self.start
+            lines = []
+            quotes = 0
+            size = 0
+            while remaining is None or remaining > 0:
+                line = f.readline()
+                if not line:
+                    break
+                if remaining is not None:
+                    remaining -= len(line)
+                if self.digest is not None:
+                    self.digest.update(line)
+                lines.append(line)
+                size += len(line)
+                quotes += line.count(b'"')
+                if quotes % 2 == 0 and line.endswith(b'\n'):
+                    record = line if len(lines) == 1 else b''.join(lines)
+                    self.offset += size
+                    lines = []
+                    quotes = 0
+                    size = 0
+                    yield record.decode('utf-8')
+            if lines:
+                self.tail = b''.join(lines).decode('utf-8')
+
+
+def map_ranges(func, tasks, workers, background=None):
+    """
+    Wykonuje func dla każdego zadania w puli procesów; wyniki w kolejności zadań.
+    background (bez argumentów) jest wykonywane w procesie głównym, gdy pula pracuje.
+    """
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)) or 1) as pool:
+        results = pool.map(func, tasks)
+        if background is not None:
+            background()
+        return list(results)
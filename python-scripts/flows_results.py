@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# python-scripts/flows_results.py
+"""
+Cache gotowych wykresów (SVG) adresowany treścią.
+
+Klucz to SHA-256 z: skrótu SHA-256 zawartości pliku CSV oraz znormalizowanego
+zapytania (posortowane podmioty, zakres dat, opcje rysowania). Skrót pliku jest
+zawsze liczony z wszystkich jego bajtów, raz dla danej ścieżki, rozmiaru i mtime,
+przy czytaniu, które i tak się odbywa: budowie cache .flt (skrót w nagłówku)
+albo pełnym przebiegu agregacji przyrostowej (skrót w stanie .agg). Odcisk
+z próbek, którym stan przyrostowy sprawdza wcześniejszą część pliku, nigdy nie
+jest kluczem - po dopisaniu wierszy (przebieg czyta tylko koniec pliku) wyniki
+nie są zapamiętywane aż do kolejnego pełnego przebiegu. Tylko bez katalogu
+cache (FLOWS_CACHE=0) skrót jest liczony osobno, z pliku. Zmiana pliku zmienia
+klucz, więc stare wyniki nigdy nie są zwracane.
+
+Dwa poziomy:
+- pamięć procesu: LRU ograniczone łącznym rozmiarem (FLOWS_RESULTS_MEMORY_BYTES),
+- katalog cache (jeśli włączony): pliki .res `<klucz pliku>-<skrót treści>-<klucz>`
+  we wspólnym limicie FLOWS_CACHE_MAX_BYTES; przy zapisie wyniku dla nowej
+  treści pliku usuwane są wyniki dla poprzedniej. Usunięcie pliku
+  (flows_cache.invalidate) usuwa też jego wyniki.
+
+FLOWS_RESULTS=0 wyłącza cache. Liczniki trafień i chybień - stats().
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+import flows_cache
+import flows_incremental
+from flows_svg import DEFAULT_PRECISION
+
+# Zmiana sposobu rysowania lub parsowania kwot i dat wymaga nowej wersji (inne klucze)
+VERSION = 3
+# Większe wykresy nie są zapamiętywane
+MAX_ENTRY_BYTES = 8 * 1024 * 1024
+# Liczba zapamiętanych skrótów plików (ścieżka, rozmiar, mtime) -> sha256
+MAX_DIGESTS = 64
+
+# klucz -> (ścieżka pliku, liczba przepływów, svg)
+_entries = OrderedDict()
+_memory_bytes = 0
+_digests = OrderedDict()
+_counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+def enabled():
+    """Cache wyników można wyłączyć zmienną FLOWS_RESULTS=0"""
+    return os.environ.get('FLOWS_RESULTS', '1') != '0'
+
+
+def memory_max_bytes():
+    """Maksymalny łączny rozmiar wyników w pamięci procesu (w znakach SVG)"""
+    return int(os.environ.get('FLOWS_RESULTS_MEMORY_BYTES', str(64 * 1024 * 1024)))
+
+
+def _signature(csv_path, stats):
+    return os.path.abspath(csv_path), stats.st_size, stats.st_mtime_ns
+
+
+def _store_digest(signature, digest):
+    _digests[signature] = digest
+    _digests.move_to_end(signature)
+    while len(_digests) > MAX_DIGESTS:
+        _digests.popitem(last=False)
+
+
+def remember_digest(csv_path, stats, digest):
+    """
+    Zapamiętuje SHA-256 (hexdigest) wszystkich bajtów pliku policzony przy jego
+    czytaniu; stats to os.stat sprzed czytania. Zwraca False (i nic nie zapamiętuje),
+    gdy plik zmienił się w trakcie.
+    """
+    if _signature(csv_path, os.stat(csv_path)) != _signature(csv_path, stats):
+        return False
+    _store_digest(_signature(csv_path, stats), digest)
+    return True
+
+
+def known_digest(csv_path, stats=None):
+    """Zapamiętany skrót pliku w rozmiarze i z mtime ze stats (domyślnie obecnych) lub None"""
+    return _digests.get(_signature(csv_path, os.stat(csv_path) if stats is None else stats))
+
+
+def hash_file(csv_path):
+    """Liczy i zapamiętuje SHA-256 pliku (np. w tle, gdy pliki parsuje pula procesów)"""
+    stats = os.stat(csv_path)
+    digest = flows_cache.file_sha256(csv_path)
+    return digest if remember_digest(csv_path, stats, digest) else None
+
+
+def content_digest(csv_path, filters=None):
+    """
+    SHA-256 zawartości pliku: zapamiętany w procesie, z nagłówka aktualnego cache
+    .flt albo z aktualnego stanu przyrostowego dla filtrów zapytania; None, gdy
+    żadnego nie ma. Bez katalogu cache liczony z pliku.
+    """
+    stats = os.stat(csv_path)
+    signature = _signature(csv_path, stats)
+    digest = _digests.get(signature)
+    if digest is not None:
+        _digests.move_to_end(signature)
+        return digest
+    if flows_cache.cache_enabled():
+        digest = flows_cache.source_digest(csv_path)
+        if digest is None and filters is not None:
+            digest = flows_incremental.source_digest(csv_path, filters)
+        if digest is None:
+            return None
+    else:
+        digest = flows_cache.file_sha256(csv_path)
+    _store_digest(signature, digest)
+    return digest
+
+
+def normalize_query(params):
+    """Znormalizowane zapytanie: te same wykresy mają ten sam opis"""
+    def number(value, kind):
+        return None if value is None else kind(value)
+
+    precision = params.get('precision')
+    return {
+        'entities': sorted(set(params.get('entities') or [])),
+        'from': params.get('from') or '',
+        'to': params.get('to') or '',
+        'top': number(params.get('top'), int),
+        'min_value': number(params.get('min_value'), float),
+        'min_percent': number(params.get('min_percent'), float),
+        'precision': DEFAULT_PRECISION if precision is None else int(precision),
+        'exact': bool(params.get('exact')),
+    }
+
+
+def result_key(params):
+    """
+    Klucz wyniku dla parametrów wykresu: (skrót treści pliku, klucz) albo None,
+    gdy cache jest wyłączony, pliku nie da się odczytać lub nie ma jeszcze jego skrótu.
+    """
+    if not enabled():
+        return None
+    filters = flows_incremental.filters_key(params.get('entities'), params.get('from'), params.get('to'))
+    try:
+        digest = content_digest(params.get('csv_path', ''), filters)
+    except OSError:
+        return None
+    if digest is None:
+        return None
+    description = {'version': VERSION, 'source': digest, 'query': normalize_query(params)}
+    key = hashlib.sha256(json.dumps(description, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest, key.hexdigest()
+
+
+def _result_path(csv_path, digest, key):
+    name = f'{flows_cache.cache_key(csv_path)}-{digest[:12]}-{key[:32]}{flows_cache.RESULT_SUFFIX}'
+    return os.path.join(flows_cache.cache_dir_for(csv_path), name)
+
+
+def _remember(csv_path, key, flows, svg):
+    """Dodaje wynik do pamięci procesu i usuwa najdawniej używane ponad limit"""
+    global _memory_bytes
+    limit = memory_max_bytes()
+    if len(svg) > limit:
+        return
+    previous = _entries.pop(key, None)
+    if previous is not None:
+        _memory_bytes -= len(previous[2])
+    _entries[key] = (os.path.abspath(csv_path), flows, svg)
+    _memory_bytes += len(svg)
+    while _memory_bytes > limit:
+        _, (_, _, evicted) = _entries.popitem(last=False)
+        _memory_bytes -= len(evicted)
+        _counters['evictions'] += 1
+
+
+def get(csv_path, result):
+    """
+    Zwraca (svg, liczba przepływów) dla klucza z result_key lub None. Brak klucza
+    (jeszcze nie ma skrótu pliku) to chybienie, jeśli cache jest włączony.
+    """
+    if result is None:
+        if enabled():
+            _counters['misses'] += 1
+        return None
+    digest, key = result
+    cached = _entries.get(key)
+    if cached is not None:
+        _entries.move_to_end(key)
+        _counters['hits'] += 1
+        return cached[2], cached[1]
+
+    if flows_cache.cache_enabled():
+        path = _result_path(csv_path, digest, key)
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                flows = int(f.readline())
+                svg = f.read()
+            # Oznacz jako ostatnio używany (LRU w flows_cache.enforce_limit)
+            os.utime(path)
+        except (OSError, ValueError):
+            pass
+        else:
+            _counters['disk_hits'] += 1
+            _remember(csv_path, key, flows, svg)
+            return svg, flows
+
+    _counters['misses'] += 1
+    return None
+
+
+def put(csv_path, result, svg, flows):
+    """Zapamiętuje wykres w pamięci i (jeśli cache jest włączony) na dysku"""
+    if result is None or len(svg) > MAX_ENTRY_BYTES:
+        return
+    digest, key = result
+    _remember(csv_path, key, flows, svg)
+    _counters['stores'] += 1
+    if not flows_cache.cache_enabled():
+        return
+
+    path = _result_path(csv_path, digest, key)
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        _remove_stale(directory, flows_cache.cache_key(csv_path), digest)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(f'{flows}\n')
+            f.write(svg)
+        os.replace(tmp_path, path)
+        flows_cache.enforce_limit(directory, flows_cache.cache_max_bytes(), keep=path)
+    except OSError as e:
+        print(f"Flows results cache unavailable: {e}", file=sys.stderr)
+
+
+def _remove_stale(directory, file_key, digest):
+    """Usuwa wyniki pliku policzone dla innej (poprzedniej) treści"""
+    current = f'{file_key}-{digest[:12]}-'
+    for entry in os.scandir(directory):
+        name = entry.name
+        if name.startswith(file_key + '-') and name.endswith(flows_cache.RESULT_SUFFIX) \
+                and not name.startswith(current):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+
+
+class Capture:
+    """Strumień zapisujący dalej i zapamiętujący tekst (do MAX_ENTRY_BYTES)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.stream.write(text)
+        if self.parts is not None:
+            self.size += len(text)
+            if self.size > MAX_ENTRY_BYTES:
+                self.parts = None
+            else:
+                self.parts.append(text)
+        return len(text)
+
+    def getvalue(self):
+        """Zapisany tekst lub None, gdy przekroczył limit"""
+        return None if self.parts is None else ''.join(self.parts)
+
+
+def invalidate(csv_path):
+    """Usuwa wyniki pliku z pamięci procesu (pliki na dysku - flows_cache.invalidate)"""
+    global _memory_bytes
+    path = os.path.abspath(csv_path)
+    for key in [key for key, entry in _entries.items() if entry[0] == path]:
+        _memory_bytes -= len(_entries.pop(key)[2])
+    for signature in [s for s in _digests if s[0] == path]:
+        del _digests[signature]
+
+
+def clear():
+    """Czyści pamięć procesu i liczniki"""
+    global _memory_bytes
+    _entries.clear()
+    _digests.clear()
+    _memory_bytes = 0
+    for name in _counters:
+        _counters[name] = 0
+
+
+def stats():
+    """Liczniki trafień/chybień i zajętość pamięci procesu"""
+    return dict(_counters, entries=len(_entries), memory_bytes=_memory_bytes)
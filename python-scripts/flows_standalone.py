@@ -27,9 +27,15 @@ JAK UŻYWAĆ:
 """
 
 import csv
+import gzip
+import io
+import json
 import os
+import time
+import tracemalloc
 from datetime import datetime
 from collections import defaultdict
+from xml.sax.saxutils import escape
 
 # =============================================================================
 # PARAMETRY UŻYTKOWNIKA - EDYTUJ TĘ SEKCJĘ
@@ -38,7 +44,7 @@ from collections import defaultdict
 # Ścieżka do pliku wejściowego CSV
 CSV_INPUT_FILE = 'dane_transakcji.csv'
 
-# Ścieżka do pliku wyjściowego SVG
+# Ścieżka do pliku wyjściowego SVG (rozszerzenie .svgz = plik skompresowany gzipem)
 SVG_OUTPUT_FILE = 'wykres_przeplywow.svg'
 
 # NAZWY KOLUMN w pliku CSV (dostosuj do swojego pliku)
@@ -58,12 +64,33 @@ SVG_WIDTH = 800                    # Szerokość wykresu w pikselach
 SVG_HEIGHT = 600                   # Wysokość wykresu w pikselach
 SVG_MARGIN = 100                   # Margines wokół wykresu w pikselach
 NODE_WIDTH = 20                    # Szerokość węzła (podmiotu) w pikselach
+SVG_PRECISION = 1                  # Miejsca po przecinku we współrzędnych
+
+# POMIARY (pozostaw '' aby nie mierzyć)
+METRICS_FILE = ''                  # Plik, do którego dopisywany jest rekord JSON z czasami
+                                    # i pamięcią etapów, np. 'pomiary.jsonl'
+PROFILE_FILE = ''                  # Plik profilu cProfile (.prof), np. 'profil.prof'
 
 # =============================================================================
 # KONIEC SEKCJI PARAMETRÓW - KOD PROGRAMU PONIŻEJ
 # =============================================================================
 
 
+def iter_csv(csv_path):
+    """
+    Czyta plik CSV wiersz po wierszu, bez budowania listy w pamięci.
+    
+    Args:
+        csv_path (str): Ścieżka do pliku CSV
+        
+    Yields:
+        dict: Jeden wiersz danych
+    """
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
 def parse_csv(csv_path):
     """
     Wczytuje dane z pliku CSV i zwraca listę wierszy jako słowniki.
@@ -74,15 +101,10 @@ def parse_csv(csv_path):
     Returns:
         list: Lista słowników, każdy reprezentuje jeden wiersz danych
     """
-    flows = []
-    
     print(f"📂 Wczytywanie pliku: {csv_path}")
     
     try:
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                flows.append(row)
+        flows = list(iter_csv(csv_path))
         
         print(f"✅ Wczytano {len(flows)} rekordów")
         return flows
@@ -96,6 +118,63 @@ def parse_csv(csv_path):
         return []
 
 
+def parse_date_bound(value):
+    """
+    Parsuje granicę zakresu dat (raz, a nie dla każdego wiersza).
+    
+    Args:
+        value (str): Data w formacie 'YYYY-MM-DD' lub pusta wartość
+        
+    Returns:
+        datetime: Sparsowana data lub None (brak ograniczenia)
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def iter_filtered(flows, entities=None, date_from=None, date_to=None):
+    """
+    Filtruje przepływy według podmiotów i zakresu dat, wiersz po wierszu.
+    
+    Args:
+        flows (iterable): Strumień przepływów (lista lub generator)
+        entities (list): Lista podmiotów do uwzględnienia (None = wszystkie)
+        date_from (str): Data początkowa w formacie 'YYYY-MM-DD' (None = bez ograniczenia)
+        date_to (str): Data końcowa w formacie 'YYYY-MM-DD' (None = bez ograniczenia)
+        
+    Yields:
+        dict: Przepływy spełniające kryteria
+    """
+    entity_set = set(entities) if entities else None
+    start_date = parse_date_bound(date_from)
+    end_date = parse_date_bound(date_to)
+    
+    for f in flows:
+        # Filtrowanie według podmiotów
+        if entity_set is not None:
+            if f.get(COLUMN_SENDER) not in entity_set and f.get(COLUMN_RECEIVER) not in entity_set:
+                continue
+        
+        # Filtrowanie według dat (wiersze bez daty lub z niepoprawną datą zostają)
+        if (start_date or end_date) and f.get(COLUMN_DATE):
+            try:
+                flow_date = datetime.strptime(f[COLUMN_DATE], '%Y-%m-%d')
+            except ValueError:
+                yield f
+                continue
+            
+            if start_date and flow_date < start_date:
+                continue
+            if end_date and flow_date > end_date:
+                continue
+        
+        yield f
+
+
 def filter_flows(flows, entities=None, date_from=None, date_to=None):
     """
     Filtruje przepływy według podmiotów i zakresu dat.
@@ -109,66 +188,28 @@ def filter_flows(flows, entities=None, date_from=None, date_to=None):
     Returns:
         list: Przefiltrowana lista przepływów
     """
-    filtered = flows
-    
-    # Filtrowanie według podmiotów
     if entities and len(entities) > 0:
         print(f"🔍 Filtrowanie według {len(entities)} podmiotów: {entities}")
-        filtered = [
-            f for f in filtered 
-            if f.get(COLUMN_SENDER) in entities or f.get(COLUMN_RECEIVER) in entities
-        ]
-    
-    # Filtrowanie według dat
     if date_from or date_to:
         print(f"📅 Filtrowanie według zakresu dat: {date_from or '(brak)'} → {date_to or '(brak)'}")
-        filtered_by_date = []
-        
-        for f in filtered:
-            if COLUMN_DATE in f and f[COLUMN_DATE]:
-                try:
-                    flow_date = datetime.strptime(f[COLUMN_DATE], '%Y-%m-%d')
-                    
-                    # Sprawdź datę początkową
-                    if date_from:
-                        start_date = datetime.strptime(date_from, '%Y-%m-%d')
-                        if flow_date < start_date:
-                            continue
-                    
-                    # Sprawdź datę końcową
-                    if date_to:
-                        end_date = datetime.strptime(date_to, '%Y-%m-%d')
-                        if flow_date > end_date:
-                            continue
-                    
-                    filtered_by_date.append(f)
-                except ValueError:
-                    # Jeśli nie można sparsować daty, dodaj przepływ
-                    filtered_by_date.append(f)
-            else:
-                # Jeśli brak daty, dodaj przepływ
-                filtered_by_date.append(f)
-        
-        filtered = filtered_by_date
+    
+    filtered = list(iter_filtered(flows, entities, date_from, date_to))
     
     print(f"✅ Po filtrowaniu: {len(filtered)} rekordów")
     return filtered
 
 
-def aggregate_flows(flows):
+def fold_flows(flows, aggregated):
     """
-    Agreguje przepływy między tymi samymi podmiotami (sumuje kwoty).
+    Dodaje kwoty ze strumienia przepływów do słownika agregacji.
     
     Args:
-        flows (list): Lista przepływów do agregacji
+        flows (iterable): Strumień przepływów do agregacji
+        aggregated (dict): Słownik {klucz: kwota} uzupełniany w miejscu
         
     Returns:
-        dict: Słownik {klucz: kwota}, gdzie klucz to 'Nadawca→Odbiorca'
+        dict: Ten sam słownik aggregated
     """
-    aggregated = defaultdict(float)
-    
-    print(f"📊 Agregowanie przepływów...")
-    
     # Możliwe nazwy kolumn z kwotą
     amount_columns = [COLUMN_AMOUNT, 'Amount', 'Value', 'Wartość', 'Wartosc']
     
@@ -193,37 +234,147 @@ def aggregate_flows(flows):
             key = f"{sender}→{receiver}"
             aggregated[key] += amount
     
+    return aggregated
+
+
+def aggregate_flows(flows):
+    """
+    Agreguje przepływy między tymi samymi podmiotami (sumuje kwoty).
+    
+    Args:
+        flows (iterable): Lista lub strumień przepływów do agregacji
+        
+    Returns:
+        dict: Słownik {klucz: kwota}, gdzie klucz to 'Nadawca→Odbiorca'
+    """
+    print(f"📊 Agregowanie przepływów...")
+    
+    aggregated = fold_flows(flows, defaultdict(float))
+    
     print(f"✅ Zagregowano do {len(aggregated)} unikalnych przepływów")
     return aggregated
 
 
-def generate_sankey_svg(aggregated_flows, width=800, height=600, margin=100, node_width=20):
+def count_rows(flows, stats, key):
     """
-    Generuje wykres Sankey w formacie SVG.
+    Przepuszcza strumień bez zmian, zliczając wiersze w stats[key].
+    """
+    for f in flows:
+        stats[key] += 1
+        yield f
+
+
+def stream_aggregate(csv_path, entities=None, date_from=None, date_to=None, stats=None):
+    """
+    Jednoprzebiegowy potok: czytanie → filtrowanie → agregacja.
+    
+    Każdy wiersz jest wczytywany, filtrowany i dodawany do sumy, po czym
+    przestaje być potrzebny - pamięć zależy od liczby par nadawca/odbiorca,
+    a nie od rozmiaru pliku.
+    
+    Args:
+        csv_path (str): Ścieżka do pliku CSV
+        entities (list): Lista podmiotów do uwzględnienia (None = wszystkie)
+        date_from (str): Data początkowa (None = bez ograniczenia)
+        date_to (str): Data końcowa (None = bez ograniczenia)
+        stats (dict): Opcjonalny słownik na liczniki 'read' i 'filtered'
+        
+    Returns:
+        dict: Słownik {klucz: kwota}, gdzie klucz to 'Nadawca→Odbiorca'
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault('read', 0)
+    stats.setdefault('filtered', 0)
+    
+    print(f"📂 Przetwarzanie pliku: {csv_path}")
+    if entities:
+        print(f"🔍 Filtrowanie według {len(entities)} podmiotów: {entities}")
+    if date_from or date_to:
+        print(f"📅 Filtrowanie według zakresu dat: {date_from or '(brak)'} → {date_to or '(brak)'}")
+    
+    rows = count_rows(iter_csv(csv_path), stats, 'read')
+    filtered = count_rows(iter_filtered(rows, entities, date_from, date_to), stats, 'filtered')
+    
+    try:
+        aggregated = fold_flows(filtered, defaultdict(float))
+    except FileNotFoundError:
+        print(f"❌ BŁĄD: Nie znaleziono pliku: {csv_path}")
+        print(f"   Sprawdź czy plik istnieje i czy ścieżka jest poprawna.")
+        return defaultdict(float)
+    except Exception as e:
+        print(f"❌ BŁĄD podczas wczytywania pliku: {e}")
+        return defaultdict(float)
+    
+    print(f"✅ Wczytano {stats['read']} rekordów, po filtrowaniu: {stats['filtered']}")
+    print(f"✅ Zagregowano do {len(aggregated)} unikalnych przepływów")
+    return aggregated
+
+
+def format_number(value, precision=SVG_PRECISION):
+    """
+    Formatuje współrzędną z podaną liczbą miejsc po przecinku, bez końcowych zer.
+    
+    Args:
+        value (float): Liczba do sformatowania
+        precision (int): Liczba miejsc po przecinku
+        
+    Returns:
+        str: Liczba jako tekst, np. 120.5 lub 300
+    """
+    if precision <= 0:
+        return '%d' % round(value)
+    text = ('%.*f' % (precision, value)).rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+def open_svg_output(path):
+    """
+    Otwiera plik wyjściowy do zapisu SVG; pliki .svgz są kompresowane gzipem.
+    
+    Args:
+        path (str): Ścieżka do pliku wyjściowego
+        
+    Returns:
+        Strumień tekstowy (UTF-8)
+    """
+    if path.endswith('.svgz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='\n')
+    return open(path, 'w', encoding='utf-8', newline='\n')
+
+
+def write_sankey_svg(aggregated_flows, stream, width=800, height=600, margin=100, node_width=20,
+                     precision=SVG_PRECISION):
+    """
+    Zapisuje wykres Sankey w formacie SVG bezpośrednio do strumienia.
+    
+    Powtarzające się style są w bloku <style> (klasy CSS), a współrzędne
+    zaokrąglone do podanej precyzji - plik jest kilka razy mniejszy.
     
     Args:
         aggregated_flows (dict): Słownik zagregowanych przepływów
+        stream: Strumień tekstowy (plik, io.StringIO)
         width (int): Szerokość wykresu
         height (int): Wysokość wykresu
         margin (int): Margines
         node_width (int): Szerokość węzła
-        
-    Returns:
-        str: Kod SVG jako string
+        precision (int): Liczba miejsc po przecinku we współrzędnych
     """
     print(f"🎨 Generowanie wykresu SVG ({width}x{height})...")
     
     if not aggregated_flows:
-        return generate_empty_svg(width, height)
+        stream.write(generate_empty_svg(width, height))
+        return
     
-    # Zbierz wszystkie węzły (podmioty)
-    nodes = set()
+    # Zbierz wszystkie węzły (podmioty) i ich role jednym przejściem
+    senders = set()
+    receivers = set()
     for key in aggregated_flows.keys():
         sender, receiver = key.split('→')
-        nodes.add(sender)
-        nodes.add(receiver)
+        senders.add(sender)
+        receivers.add(receiver)
     
-    nodes_list = sorted(list(nodes))
+    nodes_list = sorted(senders | receivers)
     print(f"   Znaleziono {len(nodes_list)} podmiotów")
     
     # Podziel węzły na lewą i prawą stronę
@@ -231,8 +382,8 @@ def generate_sankey_svg(aggregated_flows, width=800, height=600, margin=100, nod
     right_nodes = []
     
     for node in nodes_list:
-        is_sender = any(key.startswith(f"{node}→") for key in aggregated_flows.keys())
-        is_receiver = any(key.endswith(f"→{node}") for key in aggregated_flows.keys())
+        is_sender = node in senders
+        is_receiver = node in receivers
         
         if is_sender and not is_receiver:
             left_nodes.append(node)
@@ -243,10 +394,6 @@ def generate_sankey_svg(aggregated_flows, width=800, height=600, margin=100, nod
             left_nodes.append(node)
             right_nodes.append(node)
     
-    # Usuń duplikaty zachowując kolejność
-    left_nodes = list(dict.fromkeys(left_nodes))
-    right_nodes = list(dict.fromkeys(right_nodes))
-    
     # Jeśli nie ma podziału, umieść połowę po lewej, połowę po prawej
     if not left_nodes or not right_nodes:
         mid = len(nodes_list) // 2
@@ -273,28 +420,29 @@ def generate_sankey_svg(aggregated_flows, width=800, height=600, margin=100, nod
     print(f"   Maksymalna wartość przepływu: {max_value:,.2f}")
     print(f"   Suma wszystkich przepływów: {total_value:,.2f}")
     
-    # Generuj kod SVG
-    svg_parts = [
-        f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">',
-        '<!-- Gradien dla przepływów -->',
-        '<defs>',
-        '<linearGradient id="flowGradient" x1="0%" y1="0%" x2="100%" y2="0%">',
-        '<stop offset="0%" style="stop-color:rgb(99,102,241);stop-opacity:0.6" />',
-        '<stop offset="100%" style="stop-color:rgb(139,92,246);stop-opacity:0.6" />',
-        '</linearGradient>',
-        '</defs>',
-        '',
-        '<!-- Tło -->',
-        '<rect width="100%" height="100%" fill="#f9fafb"/>',
-        '',
-        '<!-- Tytuł -->',
-        '<text x="' + str(width//2) + '" y="30" text-anchor="middle" font-size="20" font-weight="bold" fill="#1f2937">',
-        'Diagram Przepływów Finansowych',
-        '</text>'
-    ]
+    def number(value):
+        return format_number(value, precision)
+    
+    write = stream.write
+    write(f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">\n')
+    write(
+        '<style>'
+        '.t{font-size:20px;font-weight:bold;fill:#1f2937;text-anchor:middle}'
+        '.f{fill:none;stroke:url(#flowGradient);opacity:.7}'
+        '.n{fill:#6366f1}'
+        '.l{font-size:14px;font-weight:500;fill:#1f2937}'
+        '.e{text-anchor:end}'
+        '.g{font-size:12px;fill:#6b7280}'
+        '</style>\n'
+        '<defs><linearGradient id="flowGradient" x1="0%" y1="0%" x2="100%" y2="0%">'
+        '<stop offset="0%" stop-color="#6366f1" stop-opacity=".6"/>'
+        '<stop offset="100%" stop-color="#8b5cf6" stop-opacity=".6"/>'
+        '</linearGradient></defs>\n'
+    )
+    write('<rect width="100%" height="100%" fill="#f9fafb"/>\n')
+    write(f'<text x="{width // 2}" y="30" class="t">Diagram Przepływów Finansowych</text>\n')
     
     # Rysuj połączenia (przepływy) - od największych do najmniejszych
-    svg_parts.append('\n<!-- Przepływy -->')
     for key, value in sorted(aggregated_flows.items(), key=lambda x: x[1], reverse=True):
         sender, receiver = key.split('→')
         
@@ -307,47 +455,53 @@ def generate_sankey_svg(aggregated_flows, width=800, height=600, margin=100, nod
         # Szerokość przepływu proporcjonalna do wartości
         stroke_width = max(2, (value / max_value) * 30)
         
-        # Oblicz punkty kontrolne dla krzywej Beziera
-        cx1 = x1 + (x2 - x1) * 0.5
-        cx2 = x1 + (x2 - x1) * 0.5
-        
-        # Ścieżka przepływu (krzywa Beziera)
-        path = f'M {x1+node_width} {y1} C {cx1} {y1}, {cx2} {y2}, {x2-node_width} {y2}'
+        # Punkt kontrolny krzywej Beziera (wspólny dla obu końców)
+        cx = number(x1 + (x2 - x1) * 0.5)
+        y1 = number(y1)
+        y2 = number(y2)
         
-        svg_parts.extend([
-            f'<path d="{path}" stroke="url(#flowGradient)" ',
-            f'stroke-width="{stroke_width}" fill="none" opacity="0.7">',
-            f'<title>{sender} → {receiver}: {value:,.2f} PLN</title>',
-            '</path>'
-        ])
+        write(
+            f'<path class="f" d="M{number(x1 + node_width)} {y1}C{cx} {y1} {cx} {y2} {number(x2 - node_width)} {y2}" '
+            f'stroke-width="{number(stroke_width)}"><title>{escape(sender)} → {escape(receiver)}: {value:,.2f} PLN</title></path>\n'
+        )
     
     # Rysuj węzły (podmioty)
-    svg_parts.append('\n<!-- Węzły (podmioty) -->')
     for node, (x, y) in node_positions.items():
-        svg_parts.extend([
-            f'<rect x="{x-node_width/2}" y="{y-30}" width="{node_width}" height="60" ',
-            'fill="#6366f1" rx="5"/>',
-            f'<text x="{x + (node_width if x < width/2 else -node_width) + (10 if x < width/2 else -10)}" ',
-            f'y="{y+5}" font-size="14" font-weight="500" fill="#1f2937" ',
-            f'text-anchor="{"start" if x < width/2 else "end"}">{node}</text>'
-        ])
+        left = x < width / 2
+        label_x = x + (node_width + 10 if left else -node_width - 10)
+        write(
+            f'<rect x="{number(x - node_width / 2)}" y="{number(y - 30)}" width="{node_width}" height="60" rx="5" class="n"/>\n'
+            f'<text x="{number(label_x)}" y="{number(y + 5)}" class="{"l" if left else "l e"}">{escape(node)}</text>\n'
+        )
     
     # Dodaj legendę
     legend_y = height - 50
-    svg_parts.extend([
-        '\n<!-- Legenda -->',
-        f'<text x="20" y="{legend_y}" font-size="12" fill="#6b7280">',
-        f'Maksymalna wartość: {max_value:,.2f} PLN',
-        '</text>',
-        f'<text x="20" y="{legend_y + 20}" font-size="12" fill="#6b7280">',
-        f'Liczba przepływów: {len(aggregated_flows)} | Suma: {total_value:,.2f} PLN',
-        '</text>'
-    ])
-    
-    svg_parts.append('</svg>')
+    write(f'<text x="20" y="{legend_y}" class="g">Maksymalna wartość: {max_value:,.2f} PLN</text>\n')
+    write(f'<text x="20" y="{legend_y + 20}" class="g">Liczba przepływów: {len(aggregated_flows)} | Suma: {total_value:,.2f} PLN</text>\n')
+    write('</svg>\n')
     
     print(f"✅ Wykres SVG wygenerowany pomyślnie")
-    return '\n'.join(svg_parts)
+
+
+def generate_sankey_svg(aggregated_flows, width=800, height=600, margin=100, node_width=20,
+                        precision=SVG_PRECISION):
+    """
+    Generuje wykres Sankey w formacie SVG.
+    
+    Args:
+        aggregated_flows (dict): Słownik zagregowanych przepływów
+        width (int): Szerokość wykresu
+        height (int): Wysokość wykresu
+        margin (int): Margines
+        node_width (int): Szerokość węzła
+        precision (int): Liczba miejsc po przecinku we współrzędnych
+        
+    Returns:
+        str: Kod SVG jako string
+    """
+    buffer = io.StringIO()
+    write_sankey_svg(aggregated_flows, buffer, width, height, margin, node_width, precision)
+    return buffer.getvalue()
 
 
 def generate_empty_svg(width=800, height=600):
@@ -372,7 +526,85 @@ def generate_empty_svg(width=800, height=600):
     </svg>'''
 
 
+class RunMetrics:
+    """
+    Pomiar etapów (czas rzeczywisty, CPU, wiersze, szczyt pamięci) zapisywany
+    jako jedna linia JSON - ten sam format co flows_metrics w pełnej wersji.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = []
+        self._peak = 0
+        if path:
+            tracemalloc.start()
+        self._started = datetime.now().astimezone()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+
+    def measure(self, name, function, *args, **kwargs):
+        """Wywołuje function jako etap name; zwraca jej wynik i rekord etapu"""
+        if not self.path:
+            return function(*args, **kwargs), {}
+        tracemalloc.reset_peak()
+        memory = tracemalloc.get_traced_memory()[0]
+        cpu, wall = time.process_time(), time.perf_counter()
+        result = function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        self._peak = max(self._peak, peak)
+        record = {
+            'name': name,
+            'wall_s': round(time.perf_counter() - wall, 6),
+            'cpu_s': round(time.process_time() - cpu, 6),
+            'rows_in': None,
+            'rows_out': None,
+            'peak_bytes': peak - memory,
+        }
+        self.stages.append(record)
+        return result, record
+
+    def finish(self, ok=True):
+        """Dopisuje rekord wywołania do pliku METRICS_FILE"""
+        if not self.path:
+            return
+        record = {
+            'event': 'flows_run',
+            'version': 1,
+            'started': self._started.isoformat(timespec='milliseconds'),
+            'pid': os.getpid(),
+            'mode': 'standalone',
+            'ok': ok,
+            'wall_s': round(time.perf_counter() - self._wall, 6),
+            'cpu_s': round(time.process_time() - self._cpu, 6),
+            'peak_bytes': max(self._peak, tracemalloc.get_traced_memory()[1]),
+            'csv_path': CSV_INPUT_FILE,
+            'entities': len(FILTER_ENTITIES),
+            'from': FILTER_DATE_FROM or None,
+            'to': FILTER_DATE_TO or None,
+            'stages': self.stages,
+        }
+        tracemalloc.stop()
+        path, self.path = self.path, ''
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print(f"⏱️  Pomiary zapisano w: {path}")
+
+
 def main():
+    """
+    Uruchamia run() z opcjonalnym profilem cProfile (PROFILE_FILE).
+    """
+    if not PROFILE_FILE:
+        run()
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.runcall(run)
+    profiler.dump_stats(PROFILE_FILE)
+    print(f"⏱️  Profil zapisano w: {PROFILE_FILE}")
+
+
+def run():
     """
     Główna funkcja programu - wykonuje cały proces generowania wykresu.
     """
@@ -398,46 +630,57 @@ def main():
         print("3. Uruchom ponownie ten skrypt")
         return
     
-    # Krok 1: Wczytaj dane z CSV
-    flows = parse_csv(CSV_INPUT_FILE)
-    if not flows:
-        print("❌ Nie udało się wczytać danych. Sprawdź format pliku CSV.")
-        return
+    metrics = RunMetrics(METRICS_FILE)
     
-    # Krok 2: Filtruj dane
-    filtered_flows = filter_flows(
-        flows, 
+    # Krok 1-3: Wczytaj, przefiltruj i zagreguj dane w jednym przebiegu
+    # (w pomiarach jeden etap aggregate obejmujący parse i filter)
+    stats = {}
+    aggregated, stage = metrics.measure(
+        'aggregate',
+        stream_aggregate,
+        CSV_INPUT_FILE,
         entities=FILTER_ENTITIES if FILTER_ENTITIES else None,
         date_from=FILTER_DATE_FROM if FILTER_DATE_FROM else None,
-        date_to=FILTER_DATE_TO if FILTER_DATE_TO else None
+        date_to=FILTER_DATE_TO if FILTER_DATE_TO else None,
+        stats=stats
     )
+    stage.update(rows_in=stats['read'], rows_out=len(aggregated),
+                 rows_filtered=stats['filtered'], includes=['parse', 'filter'])
     
-    if not filtered_flows:
+    if not stats['read']:
+        print("❌ Nie udało się wczytać danych. Sprawdź format pliku CSV.")
+        metrics.finish(ok=False)
+        return
+    
+    if not stats['filtered']:
         print("⚠️  Po filtrowaniu nie pozostały żadne dane.")
         print("   Spróbuj zmienić filtry w sekcji PARAMETRY UŻYTKOWNIKA.")
+        metrics.finish()
         return
     
-    # Krok 3: Agreguj przepływy
-    aggregated = aggregate_flows(filtered_flows)
-    
     if not aggregated:
         print("⚠️  Nie znaleziono żadnych przepływów do wyświetlenia.")
         print("   Sprawdź czy plik CSV zawiera poprawne dane (kwoty, nadawców, odbiorców).")
+        metrics.finish()
         return
     
-    # Krok 4: Generuj wykres SVG
-    svg_content = generate_sankey_svg(
-        aggregated,
-        width=SVG_WIDTH,
-        height=SVG_HEIGHT,
-        margin=SVG_MARGIN,
-        node_width=NODE_WIDTH
-    )
-    
-    # Krok 5: Zapisz wykres do pliku
+    # Krok 4-5: Generuj wykres SVG prosto do pliku
+    # (w pomiarach jeden etap serialize obejmujący layout)
     try:
-        with open(SVG_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            f.write(svg_content)
+        with open_svg_output(SVG_OUTPUT_FILE) as f:
+            _, stage = metrics.measure(
+                'serialize',
+                write_sankey_svg,
+                aggregated,
+                f,
+                width=SVG_WIDTH,
+                height=SVG_HEIGHT,
+                margin=SVG_MARGIN,
+                node_width=NODE_WIDTH,
+                precision=SVG_PRECISION
+            )
+        stage.update(rows_in=len(aggregated), rows_out=len(aggregated), includes=['layout'])
+        metrics.finish()
         
         print()
         print("=" * 80)
@@ -445,8 +688,8 @@ def main():
         print("=" * 80)
         print()
         print("PODSUMOWANIE:")
-        print(f"  • Wczytano rekordów: {len(flows)}")
-        print(f"  • Po filtrowaniu: {len(filtered_flows)}")
+        print(f"  • Wczytano rekordów: {stats['read']}")
+        print(f"  • Po filtrowaniu: {stats['filtered']}")
         print(f"  • Unikalnych przepływów: {len(aggregated)}")
         print(f"  • Rozmiar pliku: {os.path.getsize(SVG_OUTPUT_FILE) / 1024:.2f} KB")
         print()
@@ -454,6 +697,7 @@ def main():
         
     except Exception as e:
         print(f"❌ BŁĄD podczas zapisywania pliku: {e}")
+        metrics.finish(ok=False)
 
 
 # =============================================================================
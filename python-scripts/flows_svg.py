@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# python-scripts/flows_svg.py
+"""
+Zwarty zapis wykresu Sankey do SVG.
+
+Elementy są zapisywane od razu do strumienia (plik, stdout, gzip), bez
+budowania listy napisów i łączenia jej w jeden duży tekst. Powtarzające się
+atrybuty (gradient, przezroczystość, czcionki) są w bloku <style> jako klasy
+CSS, a współrzędne zaokrąglane do `precision` miejsc po przecinku.
+Plik z rozszerzeniem .svgz (lub compress=True) jest kompresowany gzipem.
+"""
+
+import contextlib
+import gzip
+import io
+import sys
+from xml.sax.saxutils import escape
+
+# Domyślna liczba miejsc po przecinku we współrzędnych
+DEFAULT_PRECISION = 1
+
+STYLE = (
+    '<style>'
+    '.t{font-size:20px;font-weight:bold;fill:#1f2937;text-anchor:middle}'
+    '.f{fill:none;stroke:url(#flowGradient);opacity:.7}'
+    '.n{fill:#6366f1}'
+    '.l{font-size:14px;font-weight:500;fill:#1f2937}'
+    '.e{text-anchor:end}'
+    '.g{font-size:12px;fill:#6b7280}'
+    '</style>'
+)
+
+GRADIENT = (
+    '<defs><linearGradient id="flowGradient" x1="0%" y1="0%" x2="100%" y2="0%">'
+    '<stop offset="0%" stop-color="#6366f1" stop-opacity=".6"/>'
+    '<stop offset="100%" stop-color="#8b5cf6" stop-opacity=".6"/>'
+    '</linearGradient></defs>'
+)
+
+
+def number_format(precision=DEFAULT_PRECISION):
+    """Funkcja formatująca liczbę z `precision` miejscami po przecinku, bez końcowych zer"""
+    if precision <= 0:
+        return lambda value: '%d' % round(value)
+    pattern = '%%.%df' % precision
+
+    def number(value):
+        text = (pattern % value).rstrip('0').rstrip('.')
+        return '0' if text == '-0' else text
+    return number
+
+
+def wants_gzip(path, compress=None):
+    """Czy kompresować wyjście: jawnie (compress) lub według rozszerzenia .svgz"""
+    if compress is not None:
+        return compress
+    return path.endswith('.svgz')
+
+
+@contextlib.contextmanager
+def open_output(path, compress=None):
+    """
+    Strumień tekstowy (UTF-8) do zapisu SVG: plik lub stdout (path == '-'),
+    opcjonalnie skompresowany gzipem. Standardowe wyjście nie jest zamykane.
+    """
+    compress = wants_gzip(path, compress)
+    if path == '-':
+        raw = sys.stdout.buffer
+        target = gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) if compress else raw
+        stream = io.TextIOWrapper(target, encoding='utf-8', newline='\n')
+        try:
+            yield stream
+        finally:
+            stream.flush()
+            stream.detach()
+            if compress:
+                target.close()
+            raw.flush()
+        return
+
+    if compress:
+        stream = gzip.open(path, 'wt', encoding='utf-8', newline='\n')
+    else:
+        stream = open(path, 'w', encoding='utf-8', newline='\n')
+    with stream:
+        yield stream
+
+
+def write_sankey(stream, edges, layout, collapsed, node_width=20, precision=DEFAULT_PRECISION):
+    """Zapisuje wykres (EdgeList + Layout z flows_layout) do strumienia tekstowego"""
+    number = number_format(precision)
+    write = stream.write
+    width, height = layout.width, layout.height
+    # str - etykiety węzłów „Inne” (flows_layout.OtherNode)
+    names = [escape(str(name)) for name in edges.names]
+    values = edges.values
+
+    write(f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">\n')
+    write(STYLE + '\n' + GRADIENT + '\n')
+    write('<rect width="100%" height="100%" fill="#f9fafb"/>\n')
+    write(f'<text x="{number(width / 2)}" y="30" class="t">Diagram przepływów finansowych</text>\n')
+
+    # Końce krawędzi na bokach węzłów - współrzędne x formatowane raz na węzeł
+    half = node_width / 2
+    node_x = layout.node_x
+    right_x = [x + half for x in node_x]
+    left_x = [x - half for x in node_x]
+    right_text = [number(x) for x in right_x]
+    left_text = [number(x) for x in left_x]
+
+    # Połączenia od największych, żeby małe były na wierzchu
+    sources, targets = edges.sources, edges.targets
+    edge_width, edge_y0, edge_y1 = layout.edge_width, layout.edge_y0, layout.edge_y1
+    min_bend = 3 * node_width
+    for i in sorted(range(len(values)), key=values.__getitem__, reverse=True):
+        s = sources[i]
+        t = targets[i]
+        x1 = right_x[s]
+        x2 = left_x[t]
+        y1 = number(edge_y0[i])
+        y2 = number(edge_y1[i])
+        # Krawędzie zwrotne (cykle) zataczają pętlę
+        bend = max((x2 - x1) * 0.5, min_bend)
+        write(
+            f'<path class="f" d="M{right_text[s]} {y1}C{number(x1 + bend)} {y1} '
+            f'{number(x2 - bend)} {y2} {left_text[t]} {y2}" stroke-width="{number(edge_width[i])}">'
+            f'<title>{names[s]} → {names[t]}: {values[i]:,.2f}</title></path>\n'
+        )
+
+    # Węzły; etykiety ostatniej warstwy po lewej stronie, pozostałych - po prawej
+    adjacency = layout.adjacency
+    node_y, node_height = layout.node_y, layout.node_height
+    last_layer = len(layout.layers) - 1
+    for index, order in enumerate(layout.layers):
+        at_end = index == last_layer and last_layer > 0
+        labels = layout.labels[index]
+        for v in order:
+            y = node_y[v]
+            h = node_height[v]
+            write(
+                f'<rect x="{left_text[v]}" y="{number(y)}" width="{node_width}" height="{number(h)}" '
+                f'rx="3" class="n"><title>{names[v]}: {adjacency.throughput(v):,.2f}</title></rect>\n'
+            )
+            if labels:
+                if at_end:
+                    write(f'<text x="{number(left_x[v] - 6)}" y="{number(y + h / 2 + 5)}" class="l e">{names[v]}</text>\n')
+                else:
+                    write(f'<text x="{number(right_x[v] + 6)}" y="{number(y + h / 2 + 5)}" class="l">{names[v]}</text>\n')
+
+    # Legenda
+    legend_y = height - 50
+    write(f'<text x="20" y="{legend_y}" class="g">Maksymalna wartość: {max(values):,.2f}</text>\n')
+    write(f'<text x="20" y="{legend_y + 20}" class="g">Liczba przepływów: {len(edges)}</text>\n')
+    if collapsed['edges']:
+        share = collapsed['value'] / sum(values) * 100
+        write(
+            f'<text x="20" y="{legend_y + 40}" class="g">Zwinięte do „Inne”: {collapsed["edges"]} przepływów, '
+            f'{collapsed["value"]:,.2f} ({share:.1f}%)</text>\n'
+        )
+    write('</svg>\n')
@@ -0,0 +1,802 @@
+#!/usr/bin/env python3
+# python-scripts/flows_table.py
+"""
+Kolumnowa reprezentacja przepływów finansowych (FlowTable).
+
+Zamiast listy słowników z csv.DictReader każdy wiersz zajmuje kilka liczb:
+- nazwy podmiotów są internowane (słownik nazwa -> id),
+- nadawcy i odbiorcy to identyfikatory w array('i'),
+- kwoty w array('d'),
+- daty jako numery dni (date.toordinal) w array('i'), 0 = brak/niepoprawna data.
+Kolumna i format kwot (AmountFormat) oraz format dat (DateFormat) są rozpoznawane
+raz na plik, z pierwszych wierszy.
+Pozostałe kolumny (np. Opis) są wczytywane z pliku dopiero na żądanie.
+"""
+
+import csv
+import itertools
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+from fractions import Fraction
+
+SENDER_COLUMN = 'Nadawca'
+RECEIVER_COLUMN = 'Odbiorca'
+DATE_COLUMN = 'Data'
+AMOUNT_COLUMNS = ['Kwota', 'Amount', 'Value', 'Wartość']
+
+# Identyfikator podmiotu, gdy w pliku brak kolumny Nadawca/Odbiorca
+MISSING = -1
+# Nazwa używana w agregacji dla brakującej kolumny (jak flow.get(..., 'Unknown'))
+MISSING_NAME = 'Unknown'
+# Numer dnia oznaczający brak lub niepoprawną datę
+NO_DATE = 0
+# Liczba wierszy, z których rozpoznawana jest kolumna i format kwot
+AMOUNT_SAMPLE_ROWS = 1000
+# Separatory tysięcy inne niż '.' i ',': spacja, twarda spacja, wąska twarda spacja, apostrof
+GROUP_SPACES = " \xa0\u202f'"
+# Numer dnia 1970-01-01 (początek znaczników czasu)
+EPOCH_DAY = date(1970, 1, 1).toordinal()
+# Maksymalna liczba zapamiętanych numerów dni dla wartości dat (DateFormat.day)
+MAX_DATE_VALUES = 65536
+# Kwota w próbce: jednostka waluty przed lub za liczbą (np. '1 234,50 zł', '$1,234.50')
+_AMOUNT_PATTERN = re.compile(r"([^\d+\-.,]*?)\s*([+-]?[\d.,' \xa0\u202f]*\d)\s*([^\d.,]*)")
+
+
+def parse_amount(value):
+    """Parsuje kwotę jak aggregate_flows; zwraca None, gdy się nie da"""
+    try:
+        return float(str(value).replace(' ', '').replace(',', '.'))
+    except ValueError:
+        return None
+
+
+class AmountFormat:
+    """
+    Kolumna i format kwot pliku, rozpoznawane raz z próbki wartości (detect):
+    separator dziesiętny ('.' lub ','), separatory tysięcy (GROUP_SPACES,
+    '.' lub ',') i jednostka waluty przed lub za liczbą ('zł', 'PLN', '€').
+
+    convert to funkcja dobrana do formatu (dla '1234.56' - sam float), która
+    rzuca wyjątek dla wartości w innym formacie; parse() parsuje je wtedy jak
+    parse_amount, więc błędne lub nietypowe wiersze dają ten sam wynik co wcześniej.
+    """
+
+    __slots__ = ('column', 'decimal', 'groups', 'unit', 'convert')
+
+    def __init__(self, column=None, decimal='.', groups='', unit=''):
+        self.column = column
+        self.decimal = decimal
+        self.groups = groups
+        self.unit = unit
+        if not groups and not unit:
+            self.convert = float if decimal == '.' else _decimal_comma
+        else:
+            table = {ord(c): None for c in groups}
+            if decimal == ',':
+                table[ord(',')] = '.'
+            strip = GROUP_SPACES + '\t' + unit
+            self.convert = lambda value: float(value.strip(strip).translate(table))
+
+    def __reduce__(self):
+        # convert bywa lambdą - do procesów roboczych trafia sam opis formatu
+        return (AmountFormat, (self.column, self.decimal, self.groups, self.unit))
+
+    def __eq__(self, other):
+        return isinstance(other, AmountFormat) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'AmountFormat({self.column!r}, {self.decimal!r}, {self.groups!r}, {self.unit!r})'
+
+    def parse(self, value):
+        """Parsuje kwotę; zwraca None, gdy się nie da"""
+        try:
+            return self.convert(value)
+        except (AttributeError, TypeError, ValueError):
+            return parse_amount(value)
+
+    def to_dict(self):
+        return {'column': self.column, 'decimal': self.decimal, 'groups': self.groups, 'unit': self.unit}
+
+    @classmethod
+    def from_dict(cls, description):
+        return cls(**description)
+
+    @classmethod
+    def detect(cls, samples):
+        """
+        Wybiera kolumnę i format z próbek [(kolumna, wartości)] w kolejności
+        AMOUNT_COLUMNS: wygrywa kolumna z największą liczbą poprawnych kwot
+        (przy remisie - wcześniejsza), a bez próbek - pierwsza kolumna.
+        """
+        best = None
+        for column, values in samples:
+            found = cls._detect_format(column, values)
+            score = sum(found.parse(v) is not None for v in values)
+            if best is None or score > best[0]:
+                best = (score, found)
+        return best[1] if best else cls()
+
+    @classmethod
+    def _detect_format(cls, column, values):
+        """
+        Format kwot jednej kolumny. Separator dziesiętny rozstrzygają wartości
+        jednoznaczne ('1.234,50', '1,5', '1 234.5'); '1,234' lub '1.234' bez
+        innych wskazówek jest czytane jak w parse_amount (przecinek i kropka
+        to separatory dziesiętne).
+        """
+        votes = {'.': 0, ',': 0}
+        groups = set()
+        units = {}
+        ambiguous_comma = False
+        for value in values:
+            match = _AMOUNT_PATTERN.fullmatch(str(value).strip())
+            if match is None:
+                continue
+            prefix, number, suffix = match.groups()
+            unit = (prefix or suffix).strip()
+            if unit:
+                units[unit] = units.get(unit, 0) + 1
+            groups.update(c for c in GROUP_SPACES if c in number)
+            digits = number.translate(_NO_SPACES)
+            dot, comma = digits.rfind('.'), digits.rfind(',')
+            if dot >= 0 and comma >= 0:
+                decimal = '.' if dot > comma else ','
+                votes[decimal] += 1
+                groups.add(',' if decimal == '.' else '.')
+            elif dot >= 0 or comma >= 0:
+                mark = '.' if dot >= 0 else ','
+                if digits.count(mark) > 1:
+                    groups.add(mark)
+                    votes[',' if mark == '.' else '.'] += 1
+                elif len(digits) - max(dot, comma) - 1 != 3:
+                    votes[mark] += 1
+                elif mark == ',':
+                    ambiguous_comma = True
+
+        if votes[','] > votes['.'] or (not votes['.'] and ambiguous_comma):
+            decimal = ','
+        else:
+            decimal = '.'
+        groups.discard(decimal)
+        unit = max(units, key=units.get) if units else ''
+        return cls(column, decimal, ''.join(sorted(groups)), unit)
+
+
+_NO_SPACES = {ord(c): None for c in GROUP_SPACES}
+
+
+def _decimal_comma(value):
+    return float(value.replace(',', '.'))
+
+
+def amount_format(header, rows):
+    """Kolumna i format kwot z nagłówka i próbki wierszy csv.reader (list pól)"""
+    index = {name: i for i, name in enumerate(header)}
+    return AmountFormat.detect([
+        (c, [row[index[c]] for row in rows if index[c] < len(row)])
+        for c in AMOUNT_COLUMNS if c in index
+    ])
+
+
+def record_amount_format(records):
+    """Kolumna i format kwot z próbki słowników (np. z csv.DictReader)"""
+    return AmountFormat.detect([
+        (c, [record[c] for record in records if c in record])
+        for c in AMOUNT_COLUMNS if any(c in record for record in records)
+    ])
+
+
+class ExactSum:
+    """
+    Dokładna suma liczb zmiennoprzecinkowych (częściowe sumy Shewchuka, jak math.fsum).
+    Wynik nie zależy od kolejności dodawania ani od podziału na części, więc
+    sumy częściowe z wielu procesów można scalić bez utraty dokładności.
+    Obsługuje `+=`, dzięki czemu działa jako defaultdict(ExactSum).
+    """
+
+    __slots__ = ('partials', 'special')
+
+    def __init__(self):
+        self.partials = []
+        # inf / nan nie mieszczą się w sumach częściowych - dodawane osobno
+        self.special = 0.0
+
+    def __iadd__(self, x):
+        if not math.isfinite(x):
+            self.special += x
+            return self
+        partials = self.partials
+        i = 0
+        for y in partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo:
+                partials[i] = lo
+                i += 1
+            x = hi
+        partials[i:] = [x]
+        return self
+
+    def merge(self, other):
+        """Dodaje inną ExactSum (np. wynik częściowy z procesu roboczego)"""
+        for x in other.partials:
+            self += x
+        self.special += other.special
+        return self
+
+    def __float__(self):
+        if self.special:
+            return self.special
+        return math.fsum(self.partials)
+
+
+def exact_total(cents, rest=None):
+    """
+    Poprawnie zaokrąglona suma całkowitej liczby groszy (centów) i ExactSum
+    pozostałych kwot (None - brak); bez reszty to po prostu cents / 100.
+    """
+    if rest is None:
+        return cents / 100
+    if rest.special:
+        return rest.special
+    return float(Fraction(cents, 100) + sum(map(Fraction, rest.partials)))
+
+
+def _date_part(value):
+    """Data bez godziny ('2024-01-15T10:30:00', '15.01.2024 10:30')"""
+    return value.split('T', 1)[0].split(' ', 1)[0]
+
+
+def _iso_day(value):
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date.fromisoformat(value).toordinal()
+    year, month, day = _date_part(value).split('-')
+    if len(year) != 4:
+        raise ValueError(value)
+    return date(int(year), int(month), int(day)).toordinal()
+
+
+def _day_month_year(separator):
+    def convert(value):
+        day, month, year = _date_part(value).split(separator)
+        if len(year) != 4:
+            raise ValueError(value)
+        return date(int(year), int(month), int(day)).toordinal()
+    return convert
+
+
+def _timestamp_day(value):
+    """Znacznik czasu uniksowego w sekundach (9-10 cyfr) lub milisekundach (11-13), UTC"""
+    whole, _, fraction = value.partition('.')
+    if not (whole.isdigit() and 9 <= len(whole) <= 13 and (not fraction or fraction.isdigit())):
+        raise ValueError(value)
+    seconds = int(whole) // 1000 if len(whole) > 10 else int(whole)
+    return EPOCH_DAY + seconds // 86400
+
+
+# Rozpoznawane formaty dat (kolejność rozstrzyga remisy w DateFormat.detect)
+DATE_FORMATS = {
+    'YYYY-MM-DD': _iso_day,
+    'DD.MM.YYYY': _day_month_year('.'),
+    'DD/MM/YYYY': _day_month_year('/'),
+    'timestamp': _timestamp_day,
+}
+
+
+def parse_day(value):
+    """
+    Zamienia datę w jednym z DATE_FORMATS (także z godziną) na numer dnia;
+    NO_DATE, gdy się nie da
+    """
+    for convert in DATE_FORMATS.values():
+        try:
+            return convert(value)
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return NO_DATE
+
+
+class DateFormat:
+    """
+    Format dat pliku, rozpoznawany raz z próbki wartości (detect). day()
+    zamienia wartość na numer dnia funkcją tego formatu i zapamiętuje wynik,
+    bo daty w pliku się powtarzają; wartości w innym formacie parsuje parse_day,
+    więc wynik nie zależy od próbki.
+    """
+
+    __slots__ = ('name', 'convert', 'days')
+
+    def __init__(self, name='YYYY-MM-DD'):
+        self.name = name
+        self.convert = DATE_FORMATS[name]
+        # Znaczniki czasu rzadko się powtarzają - bez zapamiętywania
+        self.days = None if name == 'timestamp' else {}
+
+    def __reduce__(self):
+        return (DateFormat, (self.name,))
+
+    def __eq__(self, other):
+        return isinstance(other, DateFormat) and self.name == other.name
+
+    def __repr__(self):
+        return f'DateFormat({self.name!r})'
+
+    def day(self, value):
+        """Numer dnia wartości; NO_DATE, gdy to nie jest poprawna data"""
+        days = self.days
+        if days is not None:
+            day = days.get(value)
+            if day is not None:
+                return day
+        try:
+            day = self.convert(value)
+        except (AttributeError, TypeError, ValueError):
+            day = parse_day(value)
+        if days is not None:
+            if len(days) >= MAX_DATE_VALUES:
+                days.clear()
+            days[value] = day
+        return day
+
+    @classmethod
+    def detect(cls, values):
+        """Format z największą liczbą poprawnych dat w próbce; bez dat - YYYY-MM-DD"""
+        best, best_count = 'YYYY-MM-DD', 0
+        for name, convert in DATE_FORMATS.items():
+            count = 0
+            for value in values:
+                try:
+                    convert(value)
+                    count += 1
+                except (AttributeError, TypeError, ValueError):
+                    pass
+            if count > best_count:
+                best, best_count = name, count
+        return cls(best)
+
+
+def date_format(header, rows):
+    """Format dat z nagłówka i próbki wierszy csv.reader (list pól)"""
+    if DATE_COLUMN not in header:
+        return DateFormat()
+    i = len(header) - 1 - header[::-1].index(DATE_COLUMN)
+    return DateFormat.detect([row[i] for row in rows if i < len(row)])
+
+
+def record_date_format(records):
+    """Format dat z próbki słowników (np. z csv.DictReader)"""
+    return DateFormat.detect([record[DATE_COLUMN] for record in records if DATE_COLUMN in record])
+
+
+class FlowTable:
+    """Kolumnowy, internowany zbiór przepływów"""
+
+    __slots__ = ('names', 'name_ids', 'senders', 'receivers', 'amounts', 'dates',
+                 'row_ids', 'csv_path', '_columns', '_buffer', '_date_index', '_entity_index')
+
+    def __init__(self, names=None, csv_path=None, name_ids=None):
+        self.names = names if names is not None else []
+        if name_ids is None:
+            name_ids = {name: i for i, name in enumerate(self.names)}
+        self.name_ids = name_ids
+        self.senders = array('i')
+        self.receivers = array('i')
+        self.amounts = array('d')
+        self.dates = array('i')
+        # Numery wierszy w pliku źródłowym (None = wszystkie wiersze po kolei)
+        self.row_ids = None
+        self.csv_path = csv_path
+        # Kolumny wczytane na żądanie: nazwa -> lista wartości dla całego pliku
+        self._columns = {}
+        # Obiekt trzymający pamięć kolumn (np. mmap pliku cache), gdy nie są to array
+        self._buffer = None
+        # Indeksy budowane przy pierwszym zapytaniu (patrz date_index, entity_index)
+        self._date_index = None
+        self._entity_index = None
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def intern(self, name):
+        """Zwraca identyfikator nazwy podmiotu, dodając ją w razie potrzeby"""
+        entity_id = self.name_ids.get(name)
+        if entity_id is None:
+            entity_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = entity_id
+        return entity_id
+
+    def name(self, entity_id):
+        """Zwraca nazwę podmiotu używaną w agregacji"""
+        return MISSING_NAME if entity_id == MISSING else self.names[entity_id]
+
+    @classmethod
+    def from_columns(cls, names, senders, receivers, amounts, dates, csv_path=None, buffer=None,
+                     name_ids=None):
+        """
+        Buduje tabelę z gotowych kolumn. Kolumny mogą być array lub memoryview
+        (np. zmapowany plik cache) - wystarczy indeksowanie i len().
+        """
+        table = cls(names, csv_path=csv_path, name_ids=name_ids)
+        table.senders = senders
+        table.receivers = receivers
+        table.amounts = amounts
+        table.dates = dates
+        table._buffer = buffer
+        return table
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        """Wczytuje plik CSV bezpośrednio do kolumn"""
+        table = cls(csv_path=csv_path)
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header:
+                table.load_rows(reader, header)
+        return table
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Buduje tabelę z iterowalnego zbioru słowników (np. z parse_csv)"""
+        table = cls()
+        rows = iter(rows)
+        sample = list(itertools.islice(rows, AMOUNT_SAMPLE_ROWS))
+        amount = record_amount_format(sample)
+        day = record_date_format(sample).day
+        column, parse = amount.column, amount.parse
+        for row in itertools.chain(sample, rows):
+            value = parse(row[column]) if column in row else None
+            table.append(
+                row.get(SENDER_COLUMN) if SENDER_COLUMN in row else MISSING,
+                row.get(RECEIVER_COLUMN) if RECEIVER_COLUMN in row else MISSING,
+                0.0 if value is None else value,
+                day(row[DATE_COLUMN]) if DATE_COLUMN in row else NO_DATE
+            )
+        return table
+
+    def append(self, sender, receiver, amount, day):
+        """Dodaje jeden przepływ; nadawca/odbiorca to nazwa lub MISSING"""
+        self._date_index = self._entity_index = None
+        self.senders.append(MISSING if sender is MISSING else self.intern(sender or ''))
+        self.receivers.append(MISSING if receiver is MISSING else self.intern(receiver or ''))
+        self.amounts.append(amount)
+        self.dates.append(day)
+
+    def load_rows(self, reader, header, amount=None, dates=None):
+        """
+        Dopisuje do kolumn wiersze z csv.reader (header - nazwy kolumn).
+        Kolumna i format kwot (AmountFormat) oraz format dat (DateFormat) są
+        rozpoznawane raz, z pierwszych AMOUNT_SAMPLE_ROWS wierszy, chyba że
+        podano je w amount i dates.
+        """
+        self._date_index = self._entity_index = None
+        if amount is None or dates is None:
+            reader = iter(reader)
+            sample = list(itertools.islice(reader, AMOUNT_SAMPLE_ROWS))
+            amount = amount or amount_format(header, sample)
+            dates = dates or date_format(header, sample)
+            reader = itertools.chain(sample, reader)
+        # Przy powtórzonej nazwie kolumny wygrywa ostatnia (jak w DictReader)
+        index = {name: i for i, name in enumerate(header)}
+        sender_idx = index.get(SENDER_COLUMN)
+        receiver_idx = index.get(RECEIVER_COLUMN)
+        date_idx = index.get(DATE_COLUMN)
+        amount_idx = index.get(amount.column)
+        convert, fallback = amount.convert, parse_amount
+        known, day = dates.days or {}, dates.day
+
+        intern = self.intern
+        senders, receivers = self.senders, self.receivers
+        amounts, days = self.amounts, self.dates
+
+        for row in reader:
+            if not row:
+                continue
+            width = len(row)
+
+            if sender_idx is None:
+                senders.append(MISSING)
+            else:
+                senders.append(intern(row[sender_idx] if sender_idx < width else ''))
+            if receiver_idx is None:
+                receivers.append(MISSING)
+            else:
+                receivers.append(intern(row[receiver_idx] if receiver_idx < width else ''))
+
+            if amount_idx is not None and amount_idx < width:
+                value = row[amount_idx]
+                try:
+                    amounts.append(convert(value))
+                except ValueError:
+                    parsed = fallback(value)
+                    amounts.append(0.0 if parsed is None else parsed)
+            else:
+                amounts.append(0.0)
+
+            if date_idx is not None and date_idx < width:
+                value = row[date_idx]
+                parsed = known.get(value)
+                days.append(day(value) if parsed is None else parsed)
+            else:
+                days.append(NO_DATE)
+
+    def take(self, indices):
+        """Zwraca nową tabelę z wybranymi wierszami (ten sam słownik nazw)"""
+        subset = FlowTable.__new__(FlowTable)
+        subset.names = self.names
+        subset.name_ids = self.name_ids
+        subset.senders = array('i', (self.senders[i] for i in indices))
+        subset.receivers = array('i', (self.receivers[i] for i in indices))
+        subset.amounts = array('d', (self.amounts[i] for i in indices))
+        subset.dates = array('i', (self.dates[i] for i in indices))
+        subset._buffer = None
+        subset._date_index = None
+        subset._entity_index = None
+        if self.row_ids is None:
+            subset.row_ids = array('i', indices)
+        else:
+            subset.row_ids = array('i', (self.row_ids[i] for i in indices))
+        subset.csv_path = self.csv_path
+        subset._columns = self._columns
+        return subset
+
+    def column(self, name):
+        """Wczytuje z pliku dodatkową kolumnę (np. 'Opis') dla wierszy tabeli"""
+        values = self._columns.get(name)
+        if values is None:
+            values = []
+            if self.csv_path:
+                with open(self.csv_path, 'r', encoding='utf-8', newline='') as f:
+                    reader = csv.reader(f)
+                    header = next(reader, None) or []
+                    index = {h: i for i, h in enumerate(header)}.get(name)
+                    for row in reader:
+                        if not row:
+                            continue
+                        values.append(row[index] if index is not None and index < len(row) else None)
+            self._columns[name] = values
+
+        if self.row_ids is None:
+            return list(values)
+        return [values[i] for i in self.row_ids]
+
+    def date_index(self):
+        """
+        Indeks dat: (dni rosnąco, numery wierszy w tej kolejności, wiersze bez daty).
+        Budowany raz na tabelę; zapytanie o zakres to dwa wyszukiwania binarne.
+        """
+        if self._date_index is None:
+            dates = self.dates
+            rows = range(len(dates))
+            order = array('i', sorted((i for i in rows if dates[i] != NO_DATE), key=dates.__getitem__))
+            days = array('i', (dates[i] for i in order))
+            undated = array('i', (i for i in rows if dates[i] == NO_DATE))
+            self._date_index = (days, order, undated)
+        return self._date_index
+
+    def _range_bounds(self, start, end):
+        """Zakres [lo, hi) w posortowanym indeksie dat dla granic start/end"""
+        days = self.date_index()[0]
+        lo = bisect_left(days, start) if start != NO_DATE else 0
+        hi = bisect_right(days, end) if end != NO_DATE else len(days)
+        return lo, hi
+
+    def rows_in_range(self, start=NO_DATE, end=NO_DATE):
+        """
+        Numery wierszy (rosnąco) z datą w [start, end] oraz wszystkie wiersze
+        bez poprawnej daty. NO_DATE jako granica oznacza brak ograniczenia.
+        """
+        _, order, undated = self.date_index()
+        lo, hi = self._range_bounds(start, end)
+        return sorted(itertools.chain(order[lo:hi], undated))
+
+    def entity_index(self):
+        """
+        Indeks odwrócony: id podmiotu -> array('i') numerów wierszy, w których
+        podmiot jest nadawcą lub odbiorcą (rosnąco). Budowany raz na tabelę.
+        """
+        if self._entity_index is None:
+            postings = [array('i') for _ in self.names]
+            senders, receivers = self.senders, self.receivers
+            for i in range(len(senders)):
+                s = senders[i]
+                r = receivers[i]
+                if s != MISSING:
+                    postings[s].append(i)
+                if r != MISSING and r != s:
+                    postings[r].append(i)
+            self._entity_index = postings
+        return self._entity_index
+
+    def rows_for_entities(self, entity_ids):
+        """Numery wierszy (rosnąco) z udziałem któregokolwiek z podmiotów (suma list)"""
+        postings = self.entity_index()
+        lists = [postings[e] for e in entity_ids if 0 <= e < len(postings)]
+        if len(lists) == 1:
+            return list(lists[0])
+        rows = set()
+        for posting in lists:
+            rows.update(posting)
+        return sorted(rows)
+
+    def filter(self, entities=None, date_from=None, date_to=None):
+        """
+        Filtruje wiersze jak filter_flows; zwraca nową tabelę.
+        Korzysta z indeksu podmiotów i indeksu dat, więc koszt zależy od liczby
+        pasujących wierszy, a nie od rozmiaru pliku.
+        """
+        start = parse_day(date_from) if date_from else NO_DATE
+        end = parse_day(date_to) if date_to else NO_DATE
+        by_date = start != NO_DATE or end != NO_DATE
+
+        if not entities:
+            if not by_date:
+                return self
+            return self.take(self.rows_in_range(start, end))
+
+        ids = {self.name_ids[e] for e in entities if e in self.name_ids}
+        entity_rows = self.rows_for_entities(ids)
+        if not by_date:
+            return self.take(entity_rows)
+
+        # Przecięcie: sprawdzamy mniejszy z dwóch zbiorów kandydatów
+        undated = self.date_index()[2]
+        lo, hi = self._range_bounds(start, end)
+        if len(entity_rows) <= hi - lo + len(undated):
+            dates = self.dates
+            selected = [
+                i for i in entity_rows
+                if dates[i] == NO_DATE
+                or ((start == NO_DATE or dates[i] >= start) and (end == NO_DATE or dates[i] <= end))
+            ]
+        else:
+            senders, receivers = self.senders, self.receivers
+            selected = [
+                i for i in self.rows_in_range(start, end)
+                if senders[i] in ids or receivers[i] in ids
+            ]
+        return self.take(selected)
+
+    def aggregate_pairs(self, exact=False):
+        """
+        Sumuje kwoty dla par (nadawca, odbiorca) kluczowanych liczbą 64-bit
+        (id nadawcy << 32 | id odbiorcy), bez budowania napisów. Zwraca EdgeList.
+
+        Z exact=True sumy nie zależą od liczby i kolejności wierszy: kwoty w
+        pełnych groszach (centach) są sumowane jako liczby całkowite, pozostałe
+        dokładnie (ExactSum); wynik to poprawnie zaokrąglona suma dokładna.
+        """
+        if exact:
+            return self._exact_pairs()
+        sums = {}
+        names = self.names
+        senders, receivers, amounts = self.senders, self.receivers, self.amounts
+        for i in range(len(amounts)):
+            amount = amounts[i]
+            if amount > 0:
+                s = senders[i]
+                r = receivers[i]
+                if (s == MISSING or names[s]) and (r == MISSING or names[r]):
+                    key = ((s + 1) << 32) | (r + 1)
+                    sums[key] = sums.get(key, 0.0) + amount
+        return self._edges(sums)
+
+    def _exact_pairs(self):
+        """aggregate_pairs(exact=True): grosze jako int, reszta w ExactSum"""
+        cents = {}
+        rest = {}
+        names = self.names
+        senders, receivers, amounts = self.senders, self.receivers, self.amounts
+        for i in range(len(amounts)):
+            amount = amounts[i]
+            if amount > 0:
+                s = senders[i]
+                r = receivers[i]
+                if (s == MISSING or names[s]) and (r == MISSING or names[r]):
+                    key = ((s + 1) << 32) | (r + 1)
+                    if amount < math.inf:
+                        whole = round(amount * 100)
+                        # Kwota z najwyżej dwoma miejscami po przecinku
+                        if whole / 100 == amount:
+                            cents[key] = cents.get(key, 0) + whole
+                            continue
+                    # cents trzyma wszystkie pary w kolejności pierwszego wystąpienia
+                    cents.setdefault(key, 0)
+                    total = rest.get(key)
+                    if total is None:
+                        total = rest[key] = ExactSum()
+                    total += amount
+
+        return self._edges({key: exact_total(whole, rest.get(key)) for key, whole in cents.items()})
+
+    def _edges(self, sums):
+        """EdgeList z sum par kluczowanych jak w aggregate_pairs"""
+        edges = EdgeList()
+        for key, value in sums.items():
+            edges.add(self.name((key >> 32) - 1), self.name((key & 0xFFFFFFFF) - 1), value)
+        return edges
+
+    def aggregate(self):
+        """Sumuje kwoty dla par; zwraca słownik 'Nadawca→Odbiorca' (format aggregate_flows)"""
+        return self.aggregate_pairs().to_dict()
+
+
+class EdgeList:
+    """
+    Zagregowane przepływy jako lista krawędzi: równoległe kolumny sources,
+    targets (id węzłów w names) i values. Kolejność krawędzi to kolejność
+    pierwszego wystąpienia pary w danych.
+    """
+
+    __slots__ = ('names', 'node_ids', 'sources', 'targets', 'values', '_positions')
+
+    def __init__(self):
+        self.names = []
+        self.node_ids = {}
+        self.sources = array('i')
+        self.targets = array('i')
+        self.values = array('d')
+        # (źródło, cel) -> pozycja krawędzi
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def node(self, name):
+        """Zwraca id węzła o danej nazwie, dodając go w razie potrzeby"""
+        node_id = self.node_ids.get(name)
+        if node_id is None:
+            node_id = len(self.names)
+            self.names.append(name)
+            self.node_ids[name] = node_id
+        return node_id
+
+    def add(self, source, target, value):
+        """Dodaje wartość do krawędzi source → target (nazwy węzłów)"""
+        s = self.node(source)
+        t = self.node(target)
+        position = self._positions.get((s, t))
+        if position is None:
+            self._positions[(s, t)] = len(self.values)
+            self.sources.append(s)
+            self.targets.append(t)
+            self.values.append(value)
+        else:
+            self.values[position] += value
+
+    def items(self):
+        """Iteruje po krawędziach jako (nazwa źródła, nazwa celu, wartość)"""
+        names = self.names
+        for s, t, value in zip(self.sources, self.targets, self.values):
+            yield names[s], names[t], value
+
+    def to_dict(self):
+        """Adapter zgodności: słownik {'Nadawca→Odbiorca': kwota}"""
+        aggregated = defaultdict(float)
+        for source, target, value in self.items():
+            aggregated[f"{source}→{target}"] += value
+        return aggregated
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Buduje listę krawędzi ze słownika {(nadawca, odbiorca): kwota}"""
+        edges = cls()
+        for (source, target), value in pairs.items():
+            edges.add(source, target, value)
+        return edges
+
+    @classmethod
+    def from_dict(cls, aggregated):
+        """Buduje listę krawędzi ze starego słownika {'Nadawca→Odbiorca': kwota}"""
+        edges = cls()
+        for key, value in aggregated.items():
+            source, _, target = key.partition('→')
+            edges.add(source, target, value)
+        return edges
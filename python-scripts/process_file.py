@@ -1,13 +1,426 @@
 # python-scripts/process_file.py
 import sys
 import os
+import csv
 import json
-from datetime import datetime
+import math
+import codecs
+import itertools
+import tempfile
+from datetime import date, datetime
+
+import flows_cache
+import flows_entities
+from flows_table import (
+    SENDER_COLUMN, RECEIVER_COLUMN, DATE_COLUMN, AMOUNT_COLUMNS, AMOUNT_SAMPLE_ROWS, NO_DATE,
+    AmountFormat, DateFormat, ExactSum, parse_amount
+)
+
+# Plik jest czytany blokami tej wielkości - pamięć nie zależy od rozmiaru pliku
+CHUNK_SIZE = 1024 * 1024
+# Dłuższy fragment bez \n jest oddawany jako osobna (niepełna) linia - pamięć
+# nie rośnie bez końca dla plików bez nowych linii (np. binarnych)
+MAX_LINE_CHARS = 16 * CHUNK_SIZE
+PREVIEW_CHARS = 200
+# Wersja formatu profilu CSV (zmiana wymusza ponowne profilowanie)
+PROFILE_VERSION = 4
+# Separatory rozpoznawane w nagłówku CSV
+DELIMITERS = ',;\t|'
+# Liczba kwot sumowanych w jednej partii
+CHUNK_ROWS = 65536
+
+
+def translate_newlines(text):
+    """Końce linii \\r\\n i \\r jako \\n (jak przy odczycie w trybie tekstowym)"""
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+class TextStats:
+    """
+    Liczniki linii i słów oraz podgląd, aktualizowane blok po bloku - wynik
+    jak dla całej treści odczytanej w trybie tekstowym: content.split('\\n'),
+    content.split() i pierwsze 200 znaków (końce linii \\r\\n i \\r jako \\n).
+    """
+
+    def __init__(self):
+        self.newlines = 0
+        self.words = 0
+        self.preview = ''
+        self.preview_done = False
+        # Czy poprzedni blok kończył się wewnątrz słowa / znakiem \r
+        self.in_word = False
+        self.after_cr = False
+
+    def feed(self, text):
+        if not text:
+            return
+        self.newlines += text.count('\n') + text.count('\r') - text.count('\r\n')
+        if self.after_cr and text[0] == '\n':
+            self.newlines -= 1
+        self.after_cr = text[-1] == '\r'
+
+        self.words += len(text.split())
+        if self.in_word and not text[0].isspace():
+            self.words -= 1
+        self.in_word = not text[-1].isspace()
+
+        if not self.preview_done:
+            # \r\n daje jeden znak, więc wystarczy dwa razy tyle znaków;
+            # ostatni znak może się jeszcze zmienić (\r + \n z kolejnego bloku)
+            self.preview += text[:2 * (PREVIEW_CHARS + 2)]
+            self.preview_done = len(translate_newlines(self.preview)) > PREVIEW_CHARS + 1
+
+    def result(self):
+        """(line_count, word_count, content_preview)"""
+        preview = translate_newlines(self.preview)
+        if len(preview) > PREVIEW_CHARS:
+            preview = preview[:PREVIEW_CHARS] + "..."
+        return self.newlines + 1, self.words, preview
+
+
+def iter_text(stream, stats, chunk_size=CHUNK_SIZE):
+    """Dekoduje strumień binarny (UTF-8) blokami, licząc po drodze linie i słowa"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        data = stream.read(chunk_size)
+        text = decoder.decode(data, final=not data)
+        stats.feed(text)
+        if text:
+            yield text
+        if not data:
+            break
+
+
+def _line_batches(chunks, max_line=None):
+    limit = MAX_LINE_CHARS if max_line is None else max_line
+    # Niedokończona linia z poprzednich bloków (części i ich łączna długość)
+    rest = []
+    size = 0
+    for text in chunks:
+        lines = text.split('\n')
+        tail = lines.pop()
+        if lines:
+            lines[0] = ''.join(rest) + lines[0]
+            rest, size = [], 0
+            yield [line + '\n' for line in lines]
+        if tail:
+            rest.append(tail)
+            size += len(tail)
+            if size > limit:
+                yield [''.join(rest)]
+                rest, size = [], 0
+    if rest:
+        yield [''.join(rest)]
+
+
+def iter_lines(chunks, max_line=None):
+    """
+    Dzieli bloki tekstu na linie zakończone \\n (jak plik otwarty z newline='').
+    Fragment bez \\n dłuższy niż max_line (domyślnie MAX_LINE_CHARS) jest
+    oddawany jako niepełna linia, zamiast trzymać go w pamięci w całości.
+    """
+    return itertools.chain.from_iterable(_line_batches(chunks, max_line))
+
+
+def analyze_text(stream, chunk_size=CHUNK_SIZE):
+    """Zlicza linie i słowa strumienia binarnego; zwraca (line_count, word_count, content_preview)"""
+    stats = TextStats()
+    for _ in iter_text(stream, stats, chunk_size):
+        pass
+    return stats.result()
+
+
+def detect_delimiter(line):
+    """Separator z pierwszej linii (nagłówka); domyślnie przecinek"""
+    try:
+        return csv.Sniffer().sniff(line, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return ','
+
+
+def detect_columns(header):
+    """
+    Kolumny przepływów: nazwy jak w flows.py, a gdy ich brak - pierwsza kolumna
+    zawierająca nazwę bez względu na wielkość liter (np. 'nadawca_firma').
+    """
+    def find(names):
+        for name in names:
+            if name in header:
+                return name
+        for name in names:
+            for column in header:
+                if name.lower() in column.lower():
+                    return column
+        return None
+
+    return {
+        'sender': find([SENDER_COLUMN]),
+        'receiver': find([RECEIVER_COLUMN]),
+        'amount': [c for c in AMOUNT_COLUMNS if c in header] or [c for c in [find(AMOUNT_COLUMNS)] if c],
+        'date': find([DATE_COLUMN]),
+    }
+
+
+def flows_compatible(delimiter, columns):
+    """
+    Czy flows.py czyta plik tak samo jak profil: przecinek jako separator
+    i kolumny o dokładnie tych nazwach (bez dopasowania fragmentu nazwy).
+    """
+    return (delimiter == ',' and columns['sender'] in (None, SENDER_COLUMN)
+            and columns['receiver'] in (None, RECEIVER_COLUMN) and columns['date'] in (None, DATE_COLUMN)
+            and all(column in AMOUNT_COLUMNS for column in columns['amount']))
+
+
+def flows_ready(profile):
+    """
+    Czy wykres ma z czego liczyć podmioty: profil bez błędu, z nagłówkiem,
+    kolumnami nadawcy i odbiorcy, zgodny z flows.py (flows_compatible).
+    """
+    columns = profile.get('columns') or {}
+    return ('error' not in profile and bool(profile.get('header')) and bool(columns.get('sender'))
+            and bool(columns.get('receiver')) and profile.get('flows_compatible', True))
+
+
+def profile_csv(lines):
+    """
+    Profil pliku CSV z iteratora linii: separator, kolumny, liczba wierszy,
+    podmioty (w kolejności pierwszego wystąpienia), zakres i suma kwot,
+    zakres dat oraz liczba błędnych wierszy (inna liczba pól niż w nagłówku,
+    pusty nadawca lub odbiorca albo brak poprawnej, skończonej kwoty).
+    'amount_format' to rozpoznana kolumna i format kwot (AmountFormat.to_dict),
+    a 'date_format' - format dat (nazwa z DATE_FORMATS).
+    'entities' to {nazwa: [liczba przepływów, suma kwot]} - z przepływów
+    rysowanych na wykresie (kwota > 0, obie nazwy), dla słownika podmiotów.
+    'flows_compatible' - czy wykres (flows.py) odczyta plik tak samo (flows_compatible).
+    """
+    profile = {
+        'delimiter': None, 'header': None, 'columns': None, 'rows': 0,
+        'malformed_rows': 0, 'invalid_dates': 0, 'entity_count': 0,
+        'amount': {'min': None, 'max': None, 'sum': 0.0},
+        'amount_format': None,
+        'date_format': None,
+        'flows_compatible': True,
+        'dates': {'min': None, 'max': None},
+        'entities': {},
+    }
+    first = next(lines, None)
+    if first is None:
+        return profile
+
+    delimiter = detect_delimiter(first)
+    reader = csv.reader(itertools.chain([first], lines), delimiter=delimiter)
+    header = next(reader, None) or []
+    columns = detect_columns(header)
+    profile.update(delimiter=delimiter, header=header, columns=columns,
+                   flows_compatible=flows_compatible(delimiter, columns))
+
+    index = {name: i for i, name in enumerate(header)}
+    sender_idx = index.get(columns['sender'])
+    receiver_idx = index.get(columns['receiver'])
+    date_idx = index.get(columns['date'])
+    width = len(header)
+
+    # Kolumna i format kwot - raz, z pierwszych wierszy (jak w FlowTable)
+    sample = list(itertools.islice(reader, AMOUNT_SAMPLE_ROWS))
+    amount_format = AmountFormat.detect([
+        (c, [row[index[c]] for row in sample if index[c] < len(row)]) for c in columns['amount']
+    ])
+    reader = itertools.chain(sample, reader)
+    amount_idx = index.get(amount_format.column)
+    convert = amount_format.convert
+    profile['amount_format'] = amount_format.to_dict() if amount_idx is not None else None
+    date_format = DateFormat.detect(
+        [row[date_idx] for row in sample if date_idx < len(row)] if date_idx is not None else [])
+    day_of = date_format.day
+    profile['date_format'] = date_format.name if date_idx is not None else None
+
+    entities = {}
+    # Kwoty są zbierane partiami: minimum, maksimum i suma (math.fsum) partii
+    amounts = []
+    batches = []
+
+    def fold():
+        batches.append((min(amounts), max(amounts), math.fsum(amounts)))
+        amounts.clear()
+
+    day_min = day_max = None
+    rows = malformed = invalid_dates = 0
+
+    for row in reader:
+        if not row:
+            continue
+        rows += 1
+        size = len(row)
+        bad = size != width
+
+        named = []
+        for i in (sender_idx, receiver_idx):
+            if i is None:
+                continue
+            name = row[i] if i < size else ''
+            if name:
+                named.append(entities.get(name) or entities.setdefault(name, [0, 0.0]))
+            else:
+                bad = True
+
+        amount = None
+        if amount_idx is not None and amount_idx < size:
+            value = row[amount_idx]
+            try:
+                amount = convert(value)
+            except ValueError:
+                amount = parse_amount(value)
+        if amount is None or not math.isfinite(amount):
+            bad = bad or amount_idx is not None
+        else:
+            amounts.append(amount)
+            if len(amounts) >= CHUNK_ROWS:
+                fold()
+            if amount > 0 and len(named) == 2:
+                for entry in named:
+                    entry[0] += 1
+                    entry[1] += amount
+
+        if date_idx is not None and date_idx < size:
+            value = row[date_idx]
+            day = day_of(value)
+            if day == NO_DATE:
+                invalid_dates += value != ''
+            else:
+                if day_min is None or day < day_min:
+                    day_min = day
+                if day_max is None or day > day_max:
+                    day_max = day
+
+        malformed += bad
+
+    if amounts:
+        fold()
+    total = ExactSum()
+    for _, _, batch_sum in batches:
+        total += batch_sum
+
+    profile.update(
+        rows=rows,
+        malformed_rows=malformed,
+        invalid_dates=invalid_dates,
+        entity_count=len(entities),
+        amount={
+            'min': min(low for low, _, _ in batches) if batches else None,
+            'max': max(high for _, high, _ in batches) if batches else None,
+            'sum': float(total),
+        },
+        dates={
+            'min': date.fromordinal(day_min).isoformat() if day_min else None,
+            'max': date.fromordinal(day_max).isoformat() if day_max else None,
+        },
+        entities=entities,
+    )
+    return profile
+
+
+def analyze_csv(stream, chunk_size=CHUNK_SIZE):
+    """
+    Jeden przebieg po pliku: liczniki jak analyze_text i profil CSV.
+    Zwraca ((line_count, word_count, content_preview), profil); gdy CSV nie
+    daje się sparsować, profil zawiera tylko 'error', a liczniki są pełne.
+    """
+    stats = TextStats()
+    lines = iter_lines(iter_text(stream, stats, chunk_size))
+    try:
+        profile = profile_csv(lines)
+    except csv.Error as e:
+        profile = {'error': f"CSV error: {e}"}
+    # Dokończ przebieg (liczniki), jeśli profil przerwał czytanie
+    for _ in lines:
+        pass
+    return stats.result(), profile
+
+
+def profile_path_for(csv_path):
+    """Plik profilu w katalogu cache flows (ten sam klucz co .flt)"""
+    return os.path.join(
+        flows_cache.cache_dir_for(csv_path),
+        flows_cache.cache_key(csv_path) + flows_cache.PROFILE_SUFFIX
+    )
+
+
+def public_profile(profile):
+    """Profil bez statystyk podmiotów (te są w słowniku flows_entities)"""
+    return {key: value for key, value in profile.items() if key != 'entities'}
+
+
+def save_profile(csv_path, profile, stats=None):
+    """
+    Zapisuje profil (atomowo) z opisem źródła: ścieżka, rozmiar, mtime,
+    a statystyki podmiotów - jako słownik podmiotów (flows_entities).
+    Dla pliku, z którego wykres nie liczy podmiotów (błąd, brak kolumn, inny
+    separator, przybliżone nazwy kolumn - flows_ready), zapisywany jest sam
+    profil: kolejne zapytania od razu dostają wynik negatywny, a słownik nie
+    podpowiada podmiotów bez wykresu.
+    """
+    if not flows_cache.cache_enabled():
+        return None
+    stats = stats or os.stat(csv_path)
+    path = profile_path_for(csv_path)
+    directory = os.path.dirname(path)
+    stored = dict(public_profile(profile), version=PROFILE_VERSION, source={
+        'path': os.path.abspath(csv_path),
+        'size': stats.st_size,
+        'mtime_ns': stats.st_mtime_ns,
+    })
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(stored, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        flows_cache.enforce_limit(directory, flows_cache.cache_max_bytes(), keep=path)
+        if flows_ready(profile):
+            dictionary = flows_entities.EntityDictionary.from_stats(profile['entities'])
+            flows_entities.save_dictionary(dictionary, csv_path, stats)
+    except OSError as e:
+        print(f"Flows profile unavailable: {e}", file=sys.stderr)
+        return None
+    return path
+
+
+def load_profile(csv_path):
+    """Zapisany profil, jeśli odpowiada plikowi (rozmiar i mtime); inaczej None"""
+    try:
+        stats = os.stat(csv_path)
+        path = profile_path_for(csv_path)
+        with open(path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    source = profile.get('source') or {}
+    if (profile.get('version') != PROFILE_VERSION or source.get('path') != os.path.abspath(csv_path)
+            or source.get('size') != stats.st_size or source.get('mtime_ns') != stats.st_mtime_ns):
+        return None
+    # Oznacz jako ostatnio używany (LRU w flows_cache.enforce_limit)
+    os.utime(path)
+    return profile
+
+
+def get_profile(csv_path):
+    """Profil pliku CSV: zapisany, a gdy go brak lub jest nieaktualny - liczony i zapisywany"""
+    profile = load_profile(csv_path)
+    if profile is not None:
+        return profile
+    stats = os.stat(csv_path)
+    with open(csv_path, 'rb') as f:
+        _, profile = analyze_csv(f)
+    save_profile(csv_path, profile, stats)
+    return public_profile(profile)
+
 
 def process_file(file_path):
     """
     Przetwarza plik i zwraca informacje o nim.
     Tutaj możesz dodać swoją własną logikę przetwarzania.
+    Dla plików CSV w tym samym przebiegu liczony jest profil i słownik
+    podmiotów (zapisywane w katalogu cache flows).
     """
     
     if not os.path.exists(file_path):
@@ -26,20 +439,22 @@ def process_file(file_path):
     line_count = None
     word_count = None
     content_preview = None
+    profile = None
     
     text_extensions = ['.txt', '.csv', '.json', '.xml', '.html', '.py', '.js', '.ts']
     
     if file_ext.lower() in text_extensions:
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                lines = content.split('\n')
-                line_count = len(lines)
-                word_count = len(content.split())
-                # Pobierz pierwsze 200 znaków jako podgląd
-                content_preview = content[:200] + "..." if len(content) > 200 else content
+            with open(file_path, 'rb') as f:
+                if file_ext.lower() == '.csv':
+                    (line_count, word_count, content_preview), profile = analyze_csv(f)
+                else:
+                    line_count, word_count, content_preview = analyze_text(f)
         except Exception as e:
             content_preview = f"Error reading file: {str(e)}"
+        if profile is not None and 'error' not in profile:
+            save_profile(file_path, profile, file_stats)
+            profile = public_profile(profile)
     
     # Przygotuj wynik
     result = {
@@ -59,6 +474,8 @@ def process_file(file_path):
             "content_preview": content_preview
         }
     }
+    if profile is not None:
+        result["profile"] = profile
     
     return result
 
@@ -67,6 +484,14 @@ def main():
         print(json.dumps({"error": "No file path provided"}))
         sys.exit(1)
     
+    # process_file.py --profile plik.csv - profil CSV
+    if sys.argv[1] == '--profile':
+        if len(sys.argv) < 3 or not os.path.exists(sys.argv[2]):
+            print(json.dumps({"error": "File not found"}))
+            sys.exit(1)
+        print(json.dumps(get_profile(sys.argv[2]), ensure_ascii=False))
+        return
+    
     file_path = sys.argv[1]
     result = process_file(file_path)
     
@@ -74,4 +499,4 @@ def main():
     print(json.dumps(result, indent=2))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -8,8 +8,44 @@ import unittest
 import os
 import json
 import tempfile
+import io
+import subprocess
+import sys
+import tracemalloc
+import shutil
+import atexit
+import csv
+import math
+import gzip
+import pickle
+import re
+from unittest import mock
 from datetime import datetime
-from flows import parse_csv, filter_flows, aggregate_flows, generate_sankey_svg
+from flows import (
+    parse_csv, filter_flows, aggregate_flows, generate_sankey_svg, serve,
+    iter_csv, iter_filtered, stream_aggregate
+)
+from flows_table import FlowTable, EdgeList, ExactSum, AmountFormat, DateFormat, NO_DATE, parse_day
+from flows_layout import Adjacency, compute_layout, collapse_edges, OTHER_SENDER, OTHER_RECEIVER
+import flows_cache
+import flows_cube
+import flows_entities
+import flows_results
+import flows_incremental
+import flows_metrics
+import process_file
+import flows_numpy
+import flows_parallel
+import flows_svg
+import flows_layout
+import flows
+import flows_batch
+import bench_flows
+
+# Cache binarny testów trafia do katalogu tymczasowego, a nie obok plików CSV
+if 'FLOWS_CACHE_DIR' not in os.environ:
+    os.environ['FLOWS_CACHE_DIR'] = tempfile.mkdtemp(prefix='flows_cache_test_')
+    atexit.register(shutil.rmtree, os.environ['FLOWS_CACHE_DIR'], True)
 
 class TestFlows(unittest.TestCase):
     """Testy dla funkcji przepływów finansowych"""
@@ -176,6 +212,32 @@ class TestFlows(unittest.TestCase):
                     f"Data {flow['Data']} powinna być w styczniu 2024"
                 )
 
+    
+    def test_stream_aggregate_matches_list_pipeline(self):
+        """Test potoku strumieniowego - wynik taki sam jak parse → filter → aggregate"""
+        cases = [
+            {},
+            {'entities': ['Firma C']},
+            {'date_from': '2024-01-01', 'date_to': '2024-01-31'},
+            {'entities': ['Firma A'], 'date_from': '2024-01-20'},
+        ]
+        for case in cases:
+            expected = aggregate_flows(filter_flows(parse_csv(self.test_csv.name), **case))
+            streamed = stream_aggregate(self.test_csv.name, **case)
+            self.assertEqual(dict(streamed.to_dict()), dict(expected), f"Różny wynik dla {case}")
+    
+    def test_pipeline_is_lazy(self):
+        """Test że iter_csv i iter_filtered nie budują list (generatory)"""
+        rows = iter_csv(self.test_csv.name)
+        filtered = iter_filtered(rows, entities=['Firma C'])
+        
+        self.assertFalse(isinstance(rows, list))
+        self.assertEqual(next(filtered)['Odbiorca'], 'Firma C')
+    
+    def test_stream_aggregate_invalid_path(self):
+        """Test potoku strumieniowego dla nieistniejącego pliku"""
+        self.assertEqual(len(stream_aggregate('/nieistniejacy/plik.csv')), 0)
+
 
 class TestFlowsIntegration(unittest.TestCase):
     """Testy integracyjne - pełny flow"""
@@ -209,6 +271,1648 @@ class TestFlowsIntegration(unittest.TestCase):
         self.assertIn('</svg>', svg, "SVG powinien być kompletny")
 
 
+class TestFlowsServer(unittest.TestCase):
+    """Testy trybu serwera (JSON lines na stdin/stdout)"""
+    
+    def setUp(self):
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        self.test_csv.write('Firma A,Firma B,1000.50,2024-01-15,Test 1\n')
+        self.test_csv.write('Firma B,Firma C,2000.00,2024-02-20,Test 2\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        if os.path.exists(self.test_csv.name):
+            os.remove(self.test_csv.name)
+    
+    def run_server(self, requests):
+        """Uruchamia serwer na liście żądań i zwraca odpowiedzi"""
+        input_stream = io.StringIO(''.join(
+            (r if isinstance(r, str) else json.dumps(r)) + '\n' for r in requests
+        ))
+        output_stream = io.StringIO()
+        serve(input_stream, output_stream)
+        return [json.loads(line) for line in output_stream.getvalue().splitlines()]
+    
+    def test_serve_multiple_requests(self):
+        """Test obsługi wielu żądań w jednym procesie"""
+        responses = self.run_server([
+            {'id': 1, 'csv_path': self.test_csv.name},
+            {'id': 2, 'csv_path': self.test_csv.name, 'entities': ['Firma C']},
+            {'id': 3, 'csv_path': self.test_csv.name, 'from': '2024-02-01', 'to': '2024-02-28'},
+        ])
+        
+        self.assertEqual([r['id'] for r in responses], [1, 2, 3])
+        self.assertTrue(all(r['ok'] for r in responses))
+        self.assertEqual(responses[0]['flows'], 2)
+        self.assertEqual(responses[1]['flows'], 1)
+        self.assertEqual(responses[2]['flows'], 1)
+        self.assertIn('<svg', responses[0]['svg'])
+        self.assertIn('Firma A', responses[0]['svg'])
+    
+    def test_serve_invalid_request(self):
+        """Test błędnego żądania - serwer odpowiada błędem i działa dalej"""
+        responses = self.run_server([
+            'to nie jest JSON',
+            {'id': 'b', 'csv_path': self.test_csv.name},
+        ])
+        
+        self.assertEqual(len(responses), 2)
+        self.assertFalse(responses[0]['ok'])
+        self.assertIn('error', responses[0])
+        self.assertTrue(responses[1]['ok'])
+        self.assertEqual(responses[1]['id'], 'b')
+    
+    def test_serve_reloads_changed_file(self):
+        """Test ponownego wczytania pliku po jego zmianie"""
+        first = self.run_server([{'id': 1, 'csv_path': self.test_csv.name}])
+        
+        with open(self.test_csv.name, 'a', encoding='utf-8') as f:
+            f.write('Firma C,Firma D,300.00,2024-03-01,Test 3\n')
+        stats = os.stat(self.test_csv.name)
+        os.utime(self.test_csv.name, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10**9))
+        
+        second = self.run_server([{'id': 2, 'csv_path': self.test_csv.name}])
+        self.assertEqual(first[0]['flows'], 2)
+        self.assertEqual(second[0]['flows'], 3)
+
+
+class TestFlowsCli(unittest.TestCase):
+    """Testy wywołania z argumentami (SVG na stdout)"""
+    
+    SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flows.py')
+    
+    def setUp(self):
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        self.test_csv.write('Firma A,Firma B,1000.50,2024-01-15,Test 1\n')
+        self.test_csv.write('Firma B,Firma C,2000.00,2024-02-20,Test 2\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        if os.path.exists(self.test_csv.name):
+            os.remove(self.test_csv.name)
+    
+    def run_script(self, args, stdin=None):
+        return subprocess.run(
+            [sys.executable, self.SCRIPT] + args,
+            input=stdin, capture_output=True, check=True
+        )
+    
+    def test_cli_arguments_to_stdout(self):
+        """Test parametrów z argumentów - SVG na stdout, komunikaty na stderr"""
+        result = self.run_script([
+            '--csv-path', self.test_csv.name,
+            '--entity', 'Firma C',
+            '--from', '2024-02-01', '--to', '2024-02-28'
+        ])
+        svg = result.stdout.decode('utf-8')
+        
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('Firma C', svg)
+        self.assertNotIn('Firma A', svg)
+        self.assertIn('Liczba przepływów: 1', result.stderr.decode('utf-8'))
+    
+    def test_cli_json_stdin(self):
+        """Test parametrów JSON ze standardowego wejścia"""
+        params = json.dumps({'csv_path': self.test_csv.name, 'entities': ['Firma A']})
+        result = self.run_script(['--stdin'], stdin=params.encode('utf-8'))
+        svg = result.stdout.decode('utf-8')
+        
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('Firma A', svg)
+        self.assertTrue(svg.rstrip().endswith('</svg>'))
+    
+    def test_cli_gzip_output(self):
+        """Test zapisu skompresowanego pliku .svgz"""
+        output = self.test_csv.name + '.svgz'
+        self.addCleanup(os.remove, output)
+        self.run_script(['--csv-path', self.test_csv.name, '-o', output])
+        
+        with gzip.open(output, 'rt', encoding='utf-8') as f:
+            svg = f.read()
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('Firma A → Firma B: 1,000.50', svg)
+    
+    def test_cli_top_edges(self):
+        """Test opcji --top - mniejszy przepływ zwinięty do „Inne”"""
+        result = self.run_script(['--csv-path', self.test_csv.name, '--top', '1'])
+        svg = result.stdout.decode('utf-8')
+        
+        self.assertIn('Firma B → Firma C: 2,000.00', svg)
+        self.assertNotIn('Firma A → Firma B', svg)
+        self.assertIn('Zwinięte do „Inne”: 1 przepływów', svg)
+
+
+class TestFlowTable(unittest.TestCase):
+    """Testy kolumnowej reprezentacji FlowTable"""
+    
+    def setUp(self):
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        self.test_csv.write('Firma A,Firma B,1000.50,2024-01-15,Test 1\n')
+        self.test_csv.write('Firma B,Firma C,2000.00,2024-02-20,Test 2\n')
+        self.test_csv.write('Firma A,Firma C,1500.75,2024-01-25,Test 3\n')
+        self.test_csv.write('Firma C,Firma A,500.00,2024-03-10,Test 4\n')
+        self.test_csv.write('Firma A,Firma B,1000.50,2024-01-20,Test 5\n')
+        self.test_csv.write('Firma D,Firma A,"1 200,50",zła data,Test 6\n')
+        self.test_csv.write('Firma D,Firma B,abc,2024-01-02,Test 7\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        if os.path.exists(self.test_csv.name):
+            os.remove(self.test_csv.name)
+    
+    def test_interned_columns(self):
+        """Test internowania nazw i typów kolumn"""
+        table = FlowTable.from_csv(self.test_csv.name)
+        
+        self.assertEqual(len(table), 7)
+        self.assertEqual(sorted(table.names), ['Firma A', 'Firma B', 'Firma C', 'Firma D'])
+        self.assertEqual(table.senders.typecode, 'i')
+        self.assertEqual(table.amounts.typecode, 'd')
+        self.assertEqual(table.amounts[5], 1200.5)
+        self.assertEqual(table.dates[5], 0, "Niepoprawna data powinna mieć numer dnia 0")
+    
+    def test_matches_dict_pipeline(self):
+        """Test zgodności filtrowania i agregacji z wersją na słownikach"""
+        flows = parse_csv(self.test_csv.name)
+        table = FlowTable.from_csv(self.test_csv.name)
+        cases = [
+            {},
+            {'entities': ['Firma C']},
+            {'entities': ['Firma A', 'Firma D', 'Nieznana']},
+            {'date_from': '2024-01-01', 'date_to': '2024-01-31'},
+            {'date_from': '2024-02-01'},
+            {'entities': ['Firma A'], 'date_to': '2024-01-20'},
+        ]
+        for case in cases:
+            expected = filter_flows(flows, **case)
+            filtered = filter_flows(table, **case)
+            self.assertEqual(len(filtered), len(expected), f"Różna liczba wierszy dla {case}")
+            self.assertEqual(
+                dict(aggregate_flows(filtered)), dict(aggregate_flows(expected)),
+                f"Różna agregacja dla {case}"
+            )
+    
+    def test_generate_svg_from_table(self):
+        """Test generowania SVG bezpośrednio z FlowTable"""
+        table = FlowTable.from_csv(self.test_csv.name)
+        self.assertEqual(generate_sankey_svg(table), generate_sankey_svg(aggregate_flows(parse_csv(self.test_csv.name))))
+    
+    def test_description_loaded_on_demand(self):
+        """Test wczytywania kolumny Opis dopiero na żądanie (także dla podzbioru)"""
+        table = FlowTable.from_csv(self.test_csv.name)
+        subset = table.filter(entities=['Firma D'])
+        
+        self.assertEqual(subset.column('Opis'), ['Test 6', 'Test 7'])
+        self.assertEqual(len(table.column('Opis')), 7)
+    
+    def test_date_index_matches_scan(self):
+        """Test indeksu dat - zakres z wyszukiwania binarnego jak pełne przeszukanie"""
+        table = FlowTable()
+        for i in range(500):
+            day = 0 if i % 17 == 0 else 738900 + (i * 37) % 200
+            table.append(f'Firma {i % 7}', f'Firma {i % 5}', float(i), day)
+        
+        for start, end in [(0, 0), (738950, 0), (0, 738950), (738920, 738980), (739500, 739600)]:
+            expected = [
+                i for i, day in enumerate(table.dates)
+                if day == 0 or ((not start or day >= start) and (not end or day <= end))
+            ]
+            self.assertEqual(table.rows_in_range(start, end), expected, f"Zakres {start}-{end}")
+    
+    def test_entity_index_matches_scan(self):
+        """Test indeksu podmiotów - wiele podmiotów i kombinacja z zakresem dat"""
+        table = FlowTable()
+        for i in range(2000):
+            table.append(f'Firma {i % 97}', f'Firma {(i * 13) % 89}', float(i), 738900 + i % 300)
+        entities = [f'Firma {i}' for i in range(0, 97, 2)]
+        
+        # Wąski i szeroki zakres dat - oba warianty przecięcia
+        for date_from, date_to in [(None, None), ('2024-01-01', '2024-01-03'), ('2000-01-01', '2100-01-01')]:
+            expected = [
+                i for i in range(len(table))
+                if table.name(table.senders[i]) in entities or table.name(table.receivers[i]) in entities
+            ]
+            if date_from:
+                start = datetime.strptime(date_from, '%Y-%m-%d').toordinal()
+                end = datetime.strptime(date_to, '%Y-%m-%d').toordinal()
+                expected = [i for i in expected if start <= table.dates[i] <= end]
+            
+            filtered = table.filter(entities, date_from, date_to)
+            self.assertEqual(list(filtered.row_ids), expected, f"Zakres {date_from}-{date_to}")
+    
+    def test_aggregate_pairs_edge_list(self):
+        """Test agregacji po parach id - lista krawędzi i nazwy zawierające '→'"""
+        table = FlowTable()
+        table.append('Firma A', 'Firma B', 100.0, 0)
+        table.append('Dział →X', 'Firma B', 50.0, 0)
+        table.append('Firma A', 'Firma B', 25.0, 0)
+        table.append('Firma B', 'Firma A', 0.0, 0)
+        
+        edges = table.aggregate_pairs()
+        self.assertIsInstance(edges, EdgeList)
+        self.assertEqual(len(edges), 2)
+        self.assertEqual(list(edges.values), [125.0, 50.0])
+        self.assertEqual(list(edges.items())[1], ('Dział →X', 'Firma B', 50.0))
+        self.assertEqual(edges.to_dict()['Firma A→Firma B'], 125.0)
+        
+        svg = generate_sankey_svg(edges)
+        self.assertIn('Dział →X → Firma B: 50.00', svg)
+    
+    def test_adjacency_single_pass(self):
+        """Test list sąsiedztwa, stopni i sum przepływów węzłów"""
+        edges = EdgeList.from_dict({'A→B': 10.0, 'A→C': 5.0, 'B→C': 7.0, 'C→A': 1.0})
+        adjacency = Adjacency.from_edges(edges)
+        a, b, c = (edges.node_ids[n] for n in 'ABC')
+        
+        self.assertEqual(adjacency.out_degree[a], 2)
+        self.assertEqual(adjacency.in_degree[c], 2)
+        self.assertEqual(adjacency.in_total[c], 12.0)
+        self.assertEqual(adjacency.throughput(b), 10.0)
+        self.assertEqual([edges.targets[i] for i in adjacency.out_edges[a]], [b, c])
+    
+    def test_memory_reduction(self):
+        """Test co najmniej 5x mniejszego zużycia pamięci niż lista słowników"""
+        big_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        big_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        for i in range(5000):
+            big_csv.write(f'Firma {i % 50},Firma {(i * 7) % 50},{i % 1000}.25,2024-{i % 12 + 1:02d}-{i % 28 + 1:02d},Opis {i}\n')
+        big_csv.close()
+        
+        try:
+            sizes = []
+            for loader in (parse_csv, FlowTable.from_csv):
+                tracemalloc.start()
+                data = loader(big_csv.name)
+                sizes.append(tracemalloc.get_traced_memory()[0])
+                tracemalloc.stop()
+                del data
+            self.assertGreaterEqual(sizes[0] / sizes[1], 5)
+        finally:
+            os.remove(big_csv.name)
+
+
+class TestSankeyLayout(unittest.TestCase):
+    """Testy wielowarstwowego układu wykresu Sankey"""
+    
+    def layer_names(self, edges, layout):
+        return [[edges.names[v] for v in order] for order in layout.layers]
+    
+    def test_supply_chain_layers(self):
+        """Test warstw łańcucha dostaw - każdy węzeł rysowany tylko raz"""
+        edges = EdgeList.from_dict({
+            'Huta→Fabryka': 100.0, 'Kopalnia→Fabryka': 50.0,
+            'Fabryka→Montownia': 140.0, 'Montownia→Klient': 130.0, 'Huta→Klient': 5.0
+        })
+        layout = compute_layout(edges)
+        
+        self.assertEqual(self.layer_names(edges, layout),
+                         [['Huta', 'Kopalnia'], ['Fabryka'], ['Montownia'], ['Klient']])
+        self.assertEqual(sum(len(order) for order in layout.layers), len(edges.names))
+    
+    def test_cycle_is_broken(self):
+        """Test przerwania cyklu - jedna krawędź zwrotna, wszystkie węzły umieszczone"""
+        edges = EdgeList.from_dict({'A→B': 10.0, 'B→C': 10.0, 'C→A': 10.0, 'C→D': 5.0})
+        layout = compute_layout(edges)
+        
+        back = [i for i in range(len(edges)) if layout.is_back_edge(edges, i)]
+        self.assertEqual(len(back), 1)
+        self.assertEqual(sorted(v for order in layout.layers for v in order), list(range(4)))
+    
+    def test_node_height_follows_throughput(self):
+        """Test wysokości węzłów proporcjonalnej do przepływu"""
+        edges = EdgeList.from_dict({'A→X': 300.0, 'B→X': 100.0})
+        layout = compute_layout(edges)
+        a, b, x = (edges.node_ids[n] for n in 'ABX')
+        
+        self.assertAlmostEqual(layout.node_height[a], 3 * layout.node_height[b])
+        self.assertAlmostEqual(layout.node_height[x], layout.node_height[a] + layout.node_height[b])
+        self.assertAlmostEqual(layout.edge_width[0], layout.node_height[a])
+    
+    def test_barycenter_removes_crossing(self):
+        """Test usunięcia przecięcia przez porządkowanie barycentrami"""
+        edges = EdgeList.from_dict({'A→Y': 10.0, 'B→X': 10.0})
+        
+        self.assertEqual(self.layer_names(edges, compute_layout(edges, iterations=0)), [['A', 'B'], ['X', 'Y']])
+        self.assertEqual(self.layer_names(edges, compute_layout(edges)), [['A', 'B'], ['Y', 'X']])
+    
+    def test_barycenter_stops_when_order_oscillates(self):
+        """Test przerwania iteracji, gdy przejścia przesuwają prawie tyle samo węzłów (gęsty losowy graf)"""
+        edges = bench_flows.random_edges(300, 3000)
+        with mock.patch('flows_layout._reorder', wraps=flows_layout._reorder) as reorder:
+            layout = compute_layout(edges)
+        sweeps = 2 * (len(layout.layers) - 1)
+        self.assertLess(reorder.call_count, flows_layout.LAYOUT_ITERATIONS * sweeps)
+        
+        # Graf, który się porządkuje, dochodzi do stanu bez zmian
+        edges = EdgeList.from_dict({'A→Y': 10.0, 'B→X': 10.0, 'X→P': 5.0, 'Y→Q': 5.0})
+        self.assertEqual(self.layer_names(edges, compute_layout(edges)), [['A', 'B'], ['Y', 'X'], ['Q', 'P']])
+    
+    def test_collapse_top_edges(self):
+        """Test zostawienia K największych krawędzi i zwinięcia reszty do „Inne”"""
+        edges = EdgeList.from_dict({'A→B': 100.0, 'A→C': 1.0, 'D→B': 2.0, 'E→F': 3.0, 'C→B': 50.0})
+        reduced, collapsed = collapse_edges(edges, top=2)
+        
+        # A→C łączy dwa widoczne węzły - zostaje między nimi, a nie trafia do „Inne”
+        self.assertEqual(reduced.to_dict(), {
+            'A→B': 100.0, 'A→C': 1.0, 'C→B': 50.0,
+            f'{OTHER_SENDER}→B': 2.0, f'{OTHER_SENDER}→{OTHER_RECEIVER}': 3.0
+        })
+        self.assertEqual(collapsed, {'edges': 2, 'value': 5.0})
+        self.assertEqual(sum(reduced.values), sum(edges.values))
+    
+    def test_collapse_keeps_visible_throughput(self):
+        """Test przepływów widocznych węzłów - wpływ i wypływ jak w pełnym grafie"""
+        edges = EdgeList.from_dict({'A→B': 100.0, 'B→C': 90.0, 'A→C': 5.0, 'B→D': 1.0, 'E→C': 2.0})
+        reduced, collapsed = collapse_edges(edges, top=2)
+        
+        full, shown = Adjacency.from_edges(edges), Adjacency.from_edges(reduced)
+        for name in 'ABC':
+            v, w = edges.node_ids[name], reduced.node_ids[name]
+            self.assertEqual((shown.in_total[w], shown.out_total[w]), (full.in_total[v], full.out_total[v]), name)
+        self.assertEqual(collapsed, {'edges': 2, 'value': 3.0})
+    
+    def test_collapse_keeps_entity_named_like_bucket(self):
+        """Test podmiotu o nazwie jak węzeł „Inne” - osobny węzeł, sumy bez zmian"""
+        edges = EdgeList.from_dict({'A→B': 100.0, 'Inne (nadawcy)→B': 50.0, 'D→B': 2.0})
+        reduced, _ = collapse_edges(edges, top=2)
+        
+        self.assertEqual([(str(s), t, value) for s, t, value in reduced.items()],
+                         [('A', 'B', 100.0), ('Inne (nadawcy)', 'B', 50.0), ('Inne (nadawcy)', 'B', 2.0)])
+        self.assertIs(reduced.names[-1], OTHER_SENDER)
+        # Ten sam węzeł po przekazaniu do procesu roboczego
+        self.assertIs(pickle.loads(pickle.dumps(OTHER_SENDER)), OTHER_SENDER)
+        self.assertEqual(generate_sankey_svg(edges, top=2).count('>Inne (nadawcy)</text>'), 2)
+    
+    def test_collapse_thresholds(self):
+        """Test progów kwotowego i procentowego"""
+        edges = EdgeList.from_dict({'A→B': 80.0, 'A→C': 15.0, 'B→C': 5.0})
+        
+        # B→C (5) jest poniżej progu, ale łączy widoczne B i C - zostaje
+        self.assertEqual(collapse_edges(edges, min_value=10)[1]['edges'], 0)
+        self.assertEqual(collapse_edges(EdgeList.from_dict({'A→B': 80.0, 'C→D': 5.0}), min_value=10)[1]['edges'], 1)
+        self.assertEqual(collapse_edges(edges, min_percent=20)[1], {'edges': 2, 'value': 20.0})
+        self.assertIs(collapse_edges(edges)[0], edges)
+    
+    def test_svg_legend_reports_collapsed(self):
+        """Test legendy z informacją o zwiniętych przepływach"""
+        edges = EdgeList.from_dict({'A→B': 90.0, 'A→C': 10.0})
+        
+        self.assertIn('Zwinięte do „Inne”: 1 przepływów, 10.00 (10.0%)', generate_sankey_svg(edges, top=1))
+        self.assertNotIn('Zwinięte', generate_sankey_svg(edges))
+    
+    def test_compact_svg(self):
+        """Test zwartego SVG - style w bloku <style>, zaokrąglone współrzędne, znaki specjalne"""
+        edges = EdgeList.from_dict({'A & B→C': 10.0, 'C→D': 3.0})
+        svg = generate_sankey_svg(edges, precision=1)
+        
+        self.assertEqual(svg.count('<style>'), 1)
+        self.assertNotIn('stroke="url(#flowGradient)"', svg)
+        self.assertIn('A &amp; B → C: 10.00', svg)
+        attributes = ' '.join(re.findall(r'"([^"]*)"', svg))
+        self.assertIsNone(re.search(r'\d\.\d\d', attributes))
+        uneven = EdgeList.from_dict({'X→Y': 7.0, 'X→Z': 3.0, 'W→Y': 11.0})
+        self.assertLess(len(generate_sankey_svg(uneven, precision=0)), len(generate_sankey_svg(uneven, precision=3)))
+    
+    def test_number_format(self):
+        """Test formatowania współrzędnych"""
+        number = flows_svg.number_format(1)
+        self.assertEqual([number(v) for v in (100.0, 2.25, -0.01, 1 / 3)], ['100', '2.2', '0', '0.3'])
+        self.assertEqual(flows_svg.number_format(0)(12.6), '13')
+    
+    def test_svg_draws_each_node_once(self):
+        """Test SVG - węzeł pośredni ma jeden prostokąt"""
+        edges = EdgeList.from_dict({'A→B': 10.0, 'B→C': 5.0})
+        svg = generate_sankey_svg(edges)
+        
+        self.assertEqual(svg.count('<rect x='), 3)
+        self.assertEqual(svg.count('>B</text>'), 1)
+
+
+class TestParallelAggregation(unittest.TestCase):
+    """Testy podziału pliku na zakresy rekordów i równoległej agregacji"""
+    
+    def setUp(self):
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv',
+                                                    encoding='utf-8', newline='')
+        writer = csv.writer(self.test_csv)
+        writer.writerow(['Nadawca', 'Odbiorca', 'Kwota', 'Data', 'Opis'])
+        for i in range(400):
+            description = 'Opis "w cudzysłowie"\nz nową linią' if i % 7 == 0 else 'Zwykły, opis'
+            writer.writerow([f'Firma {i % 5}', f'Firma {i % 3 + 5}', f'{0.1 * (i + 1):.2f}',
+                             f'2024-{i % 12 + 1:02d}-01', description])
+        self.test_csv.close()
+    
+    def tearDown(self):
+        os.remove(self.test_csv.name)
+    
+    def test_ranges_start_on_record_boundaries(self):
+        """Test granic zakresów - nowe linie w polach w cudzysłowie nie dzielą rekordów"""
+        header, ranges = flows_parallel.split_ranges(self.test_csv.name, 9)
+        rows = []
+        for start, end in ranges:
+            rows.extend(csv.reader(flows_parallel.RecordReader(self.test_csv.name, start, end)))
+        
+        with open(self.test_csv.name, encoding='utf-8', newline='') as f:
+            expected = list(csv.reader(f))
+        self.assertEqual(header, expected[0])
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(rows, expected[1:])
+        
+        # Granica szukana w kolejnych blokach daje ten sam wynik
+        offsets = [start + 3 for start, _ in ranges]
+        self.assertEqual(flows_parallel.record_starts(self.test_csv.name, offsets, block_size=16),
+                         flows_parallel.record_starts(self.test_csv.name, offsets))
+        
+        # Granice z liczników cudzysłowów fragmentów - jak przy liczeniu od początku pliku
+        quotes = [flows_parallel.count_quotes((self.test_csv.name, 0, offset)) for offset in offsets]
+        self.assertEqual(flows_parallel.next_records(self.test_csv.name, offsets, quotes, block_size=16),
+                         flows_parallel.record_starts(self.test_csv.name, offsets))
+    
+    def test_parent_reads_only_header(self):
+        """Test podziału bez szeregowego czytania pliku - cudzysłowy liczą procesy robocze"""
+        serial = flows_parallel.split_ranges(self.test_csv.name, 9)
+        with mock.patch('flows_parallel.record_starts', wraps=flows_parallel.record_starts) as scan, \
+                mock.patch('flows_parallel.map_ranges', wraps=flows_parallel.map_ranges) as pool:
+            self.assertEqual(flows_parallel.split_ranges(self.test_csv.name, 9, workers=2), serial)
+        self.assertEqual([call.args[1] for call in scan.call_args_list], [[0]])
+        self.assertEqual(pool.call_args.args[0], flows_parallel.count_quotes)
+    
+    def test_parallel_matches_exact_serial(self):
+        """Test identycznego wyniku (kolejność krawędzi, sumy co do bitu) z wersją szeregową"""
+        with mock.patch.dict(os.environ, {'FLOWS_PARALLEL_MIN_BYTES': '0'}):
+            parallel = flows.parallel_aggregate(self.test_csv.name, date_from='2024-03-01', workers=2)
+        serial = stream_aggregate(self.test_csv.name, date_from='2024-03-01', exact=True)
+        
+        self.assertEqual(list(parallel.items()), list(serial.items()))
+    
+    def test_small_file_is_serial(self):
+        """Test automatycznego przetwarzania szeregowego małych plików"""
+        self.assertEqual(flows_parallel.workers_for(self.test_csv.name, 8), 1)
+        with mock.patch.dict(os.environ, {'FLOWS_PARALLEL_MIN_BYTES': '0'}):
+            self.assertEqual(flows_parallel.workers_for(self.test_csv.name, 8), 8)
+            self.assertEqual(flows_parallel.workers_for(self.test_csv.name, 1), 1)
+    
+    def test_exact_sum(self):
+        """Test dokładnej sumy niezależnej od kolejności i podziału"""
+        values = [1e16, 1.0, -1e16, 0.1, 0.2]
+        total = ExactSum()
+        for value in values:
+            total += value
+        left, right = ExactSum(), ExactSum()
+        for value in values[:2]:
+            left += value
+        for value in values[2:]:
+            right += value
+        
+        self.assertEqual(float(total), math.fsum(values))
+        self.assertEqual(float(left.merge(right)), float(total))
+
+
+class TestFlowsCache(unittest.TestCase):
+    """Testy binarnego cache sparsowanych plików"""
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='flows_cache_')
+        self.env = mock.patch.dict(os.environ, {'FLOWS_CACHE_DIR': self.cache_dir})
+        self.env.start()
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        self.test_csv.write('Firma A,Firma B,1000.50,2024-01-15,Test 1\n')
+        self.test_csv.write('Firma B,Firma C,2000.00,2024-02-20,Test 2\n')
+        self.test_csv.write('Firma A,Firma B,1000.50,2024-01-20,Test 3\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        if os.path.exists(self.test_csv.name):
+            os.remove(self.test_csv.name)
+    
+    def load(self):
+        """Wczytuje tabelę z cache, zwraca (tabela, czy cache był budowany)"""
+        with mock.patch('flows_cache.build_cache', wraps=flows_cache.build_cache) as build:
+            table = flows_cache.load_cached_table(self.test_csv.name)
+        return table, build.called
+    
+    def test_cache_roundtrip(self):
+        """Test zgodności tabeli z cache z tabelą z CSV"""
+        first, built = self.load()
+        self.assertTrue(built)
+        second, built = self.load()
+        self.assertFalse(built, "Drugie wczytanie powinno użyć cache")
+        
+        expected = FlowTable.from_csv(self.test_csv.name)
+        self.assertEqual(second.names, expected.names)
+        self.assertEqual(list(second.amounts), list(expected.amounts))
+        self.assertEqual(list(second.dates), list(expected.dates))
+        self.assertEqual(dict(second.filter(date_to='2024-01-31').aggregate()), {'Firma A→Firma B': 2001.0})
+        self.assertEqual(second.column('Opis'), ['Test 1', 'Test 2', 'Test 3'])
+    
+    def test_cache_invalidated_on_change(self):
+        """Test unieważnienia cache po zmianie pliku"""
+        self.load()
+        with open(self.test_csv.name, 'a', encoding='utf-8') as f:
+            f.write('Firma C,Firma D,300.00,2024-03-01,Test 4\n')
+        
+        table, built = self.load()
+        self.assertTrue(built)
+        self.assertEqual(len(table), 4)
+    
+    def test_cache_survives_touch(self):
+        """Test że sama zmiana mtime (ta sama treść) nie przebudowuje cache"""
+        self.load()
+        stats = os.stat(self.test_csv.name)
+        os.utime(self.test_csv.name, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10**9))
+        
+        table, built = self.load()
+        self.assertFalse(built)
+        self.assertEqual(len(table), 3)
+    
+    def test_lru_eviction(self):
+        """Test usuwania najdawniej używanych plików cache po przekroczeniu limitu"""
+        self.load()
+        first_cache = flows_cache.cache_path_for(self.test_csv.name)
+        size = os.path.getsize(first_cache)
+        os.utime(first_cache, ns=(0, 0))
+        
+        other_csv = self.test_csv.name + '.copy.csv'
+        shutil.copy(self.test_csv.name, other_csv)
+        try:
+            with mock.patch.dict(os.environ, {'FLOWS_CACHE_MAX_BYTES': str(size + 10)}):
+                flows_cache.load_cached_table(other_csv)
+            self.assertFalse(os.path.exists(first_cache))
+            self.assertTrue(os.path.exists(flows_cache.cache_path_for(other_csv)))
+        finally:
+            os.remove(other_csv)
+
+
+class TestTimeCube(unittest.TestCase):
+    """Testy kostki czasu (sumy narastające par wzdłuż osi dat)"""
+    
+    QUERIES = [
+        {},
+        {'date_from': '2024-02-01'},
+        {'date_to': '2024-02-15'},
+        {'date_from': '2024-01-10', 'date_to': '2024-03-05'},
+        {'date_from': '2024-05-01', 'date_to': '2024-05-31'},
+        {'entities': ['Firma B'], 'date_from': '2024-02-01', 'date_to': '2024-03-31'},
+        {'entities': ['Firma A', 'Firma D', 'Nieznana']},
+    ]
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='flows_cube_')
+        self.env = mock.patch.dict(os.environ, {'FLOWS_CACHE_DIR': self.cache_dir})
+        self.env.start()
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        # Daty nie po kolei, wiersze bez daty, brak nadawcy, kwoty ujemne
+        rows = [
+            ('Firma A', 'Firma B', '100.10', '2024-03-01'),
+            ('Firma C', 'Firma D', '50.00', '2024-01-05'),
+            ('Firma A', 'Firma B', '0.20', '2024-01-15'),
+            ('Firma B', 'Firma C', '75.30', ''),
+            ('', 'Firma D', '10.00', '2024-02-10'),
+            ('Firma A', 'Firma B', '-5.00', '2024-02-01'),
+            ('Firma D', 'Firma A', '12.75', 'zła data'),
+            ('Firma B', 'Firma C', '0.10', '2024-02-20'),
+            ('Firma C', 'Firma D', '0.20', '2024-01-05'),
+            ('Firma D', 'Firma A', '30.00', '2024-02-14'),
+        ]
+        for sender, receiver, amount, day in rows:
+            self.test_csv.write(f'{sender},{receiver},{amount},{day},Opis\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.remove(self.test_csv.name)
+    
+    def assertMatchesTable(self, cube, table):
+        for query in self.QUERIES:
+            expected = flows.aggregate_table(flows.filter_table(table, query.get('entities'),
+                                                                query.get('date_from'), query.get('date_to')))
+            result = cube.query(**query)
+            self.assertEqual([edge[:2] for edge in result.items()],
+                             [edge[:2] for edge in expected.items()], query)
+            for (_, _, value), (_, _, expected_value) in zip(result.items(), expected.items()):
+                self.assertAlmostEqual(value, expected_value, places=9)
+    
+    def test_query_matches_filter_and_aggregate(self):
+        """Test zgodności zapytań (kolejność krawędzi i sumy) z filtrowaniem tabeli"""
+        table = FlowTable.from_csv(self.test_csv.name)
+        self.assertMatchesTable(flows_cube.TimeCube.from_table(table), table)
+    
+    def test_prefix_difference_keeps_small_amounts(self):
+        """Test różnicy sum narastających przy bardzo różnych kwotach"""
+        table = FlowTable.from_rows([
+            {'Nadawca': 'A', 'Odbiorca': 'B', 'Kwota': '1e16', 'Data': '2024-01-01'},
+            {'Nadawca': 'A', 'Odbiorca': 'B', 'Kwota': '0.01', 'Data': '2024-01-02'},
+            {'Nadawca': 'A', 'Odbiorca': 'B', 'Kwota': '0.02', 'Data': '2024-01-02'},
+            {'Nadawca': 'A', 'Odbiorca': 'B', 'Kwota': '1e16', 'Data': '2024-01-03'},
+        ])
+        cube = flows_cube.TimeCube.from_table(table)
+        self.assertEqual(list(cube.query(date_from='2024-01-02', date_to='2024-01-02').items()),
+                         [('A', 'B', 0.03)])
+        self.assertEqual(list(cube.query().items()), [('A', 'B', math.fsum([2e16, 0.01, 0.02]))])
+    
+    def test_first_row_from_sparse_minima(self):
+        """Test pierwszego wiersza zakresu komórek z tablicy rzadkiej (bez przeglądania zakresu)"""
+        rows = [{'Nadawca': 'A' if i % 4 else 'C', 'Odbiorca': 'B', 'Kwota': '1',
+                 'Data': f'2024-01-{(i * 7) % 23 + 1:02d}'} for i in range(60)]
+        cube = flows_cube.TimeCube.from_table(FlowTable.from_rows(rows))
+        for p in range(len(cube)):
+            first, stop = cube.offsets[p], cube.offsets[p + 1]
+            for lo in range(first, stop):
+                for hi in range(lo + 1, stop + 1):
+                    self.assertEqual(cube.first_row(lo, hi), min(cube.first_rows[lo:hi]), (p, lo, hi))
+    
+    def test_saved_cube(self):
+        """Test zapisu kostki i jej unieważnienia po zmianie pliku"""
+        self.assertEqual(flows.prepare(self.test_csv.name), 4)
+        cube = flows_cube.open_cube(self.test_csv.name)
+        self.assertIsNotNone(cube)
+        self.assertMatchesTable(cube, FlowTable.from_csv(self.test_csv.name))
+        
+        with open(self.test_csv.name, 'a', encoding='utf-8') as f:
+            f.write('Firma E,Firma A,1.00,2024-01-01,Nowy\n')
+        self.assertIsNone(flows_cube.open_cube(self.test_csv.name))
+        self.assertTrue(flows_cache.invalidate(self.test_csv.name))
+        self.assertFalse(os.path.exists(flows_cube.cube_path_for(self.test_csv.name)))
+    
+    def test_server_uses_cube(self):
+        """Test odpowiedzi serwera z kostki - budowanej raz na plik"""
+        flows._cubes.clear()
+        self.addCleanup(flows._cubes.clear)
+        requests = [{'id': i, 'csv_path': self.test_csv.name, 'from': day, 'to': '2024-12-31'}
+                    for i, day in enumerate(['2024-01-01', '2024-02-15', '2024-03-01'])]
+        output = io.StringIO()
+        with mock.patch('flows_cube.TimeCube.from_table', wraps=flows_cube.TimeCube.from_table) as build:
+            serve(io.StringIO(''.join(json.dumps(r) + '\n' for r in requests)), output)
+        self.assertEqual(build.call_count, 1)
+        responses = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([r['flows'] for r in responses], [4, 3, 3])
+        self.assertTrue(os.path.exists(flows_cube.cube_path_for(self.test_csv.name)))
+
+
+class TestResultCache(unittest.TestCase):
+    """Testy cache gotowych wykresów (klucz: treść pliku + zapytanie)"""
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='flows_results_')
+        self.env = mock.patch.dict(os.environ, {'FLOWS_CACHE_DIR': self.cache_dir})
+        self.env.start()
+        flows_results.clear()
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        self.test_csv.write('Firma Q,Firma R,10.00,2024-01-15,Test 1\n')
+        self.test_csv.write('Firma R,Firma S,20.00,2024-02-20,Test 2\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        self.env.stop()
+        flows_results.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        if os.path.exists(self.test_csv.name):
+            os.remove(self.test_csv.name)
+    
+    def run_server(self, requests):
+        output = io.StringIO()
+        serve(io.StringIO(''.join(json.dumps(r) + '\n' for r in requests)), output)
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+    
+    def results_on_disk(self):
+        return sorted(name for name in os.listdir(self.cache_dir) if name.endswith(flows_cache.RESULT_SUFFIX))
+    
+    def test_repeated_request_is_served_from_cache(self):
+        """Test trafienia dla tego samego zapytania (kolejność podmiotów bez znaczenia)"""
+        request = {'csv_path': self.test_csv.name, 'entities': ['Firma R', 'Firma Q'], 'top': 5}
+        with mock.patch('flows.aggregate_params', wraps=flows.aggregate_params) as aggregate:
+            responses = self.run_server([
+                dict(request, id=1),
+                dict(request, id=2, entities=['Firma Q', 'Firma R', 'Firma Q']),
+                dict(request, id=3, to='2024-01-31'),
+                {'id': 4, 'command': 'stats'},
+            ])
+        self.assertEqual(aggregate.call_count, 2)
+        self.assertEqual(responses[0]['svg'], responses[1]['svg'])
+        self.assertEqual(responses[1]['flows'], 2)
+        self.assertEqual(responses[2]['flows'], 1)
+        stats = responses[3]['stats']
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 2, 2))
+        self.assertEqual(len(self.results_on_disk()), 2)
+    
+    def test_disk_results_shared_between_processes(self):
+        """Test wyniku z dysku w nowym procesie (bez pamięci) i w trybie CLI"""
+        first = self.run_server([{'id': 1, 'csv_path': self.test_csv.name}])[0]
+        flows_results.clear()
+        
+        output = self.test_csv.name + '.svg'
+        self.addCleanup(os.remove, output)
+        with mock.patch('flows.aggregate_params') as aggregate:
+            self.assertEqual(flows.write_chart({'csv_path': self.test_csv.name}, output), 2)
+        aggregate.assert_not_called()
+        with open(output, encoding='utf-8') as f:
+            self.assertEqual(f.read(), first['svg'])
+        self.assertEqual(flows_results.stats()['disk_hits'], 1)
+    
+    def test_changed_file_misses_and_drops_stale_results(self):
+        """Test unieważnienia po zmianie pliku - nowy klucz, stare wyniki usunięte"""
+        first = self.run_server([{'id': 1, 'csv_path': self.test_csv.name}])[0]
+        old_results = self.results_on_disk()
+        
+        with open(self.test_csv.name, 'a', encoding='utf-8') as f:
+            f.write('Firma S,Firma T,5.00,2024-03-01,Test 3\n')
+        second = self.run_server([{'id': 2, 'csv_path': self.test_csv.name}])[0]
+        
+        self.assertEqual((first['flows'], second['flows']), (2, 3))
+        self.assertEqual(flows_results.stats()['misses'], 2)
+        self.assertEqual(len(self.results_on_disk()), 1)
+        self.assertNotEqual(self.results_on_disk(), old_results)
+    
+    def test_invalidate_command(self):
+        """Test polecenia invalidate (usunięcie pliku przez /api/files)"""
+        responses = self.run_server([
+            {'id': 1, 'csv_path': self.test_csv.name},
+            {'id': 2, 'command': 'invalidate', 'csv_path': self.test_csv.name},
+            {'id': 3, 'command': 'stats'},
+            {'id': 4, 'command': 'nieznane'},
+        ])
+        self.assertTrue(responses[1]['removed'])
+        self.assertEqual(responses[2]['stats']['entries'], 0)
+        self.assertFalse(responses[3]['ok'])
+        self.assertEqual(self.results_on_disk(), [])
+    
+    def test_memory_limit_evicts_least_recently_used(self):
+        """Test limitu pamięci - najdawniej używane wyniki są usuwane"""
+        size = len(self.run_server([{'id': 0, 'csv_path': self.test_csv.name, 'top': 5}])[0]['svg'])
+        limit = size * 5 // 2
+        with mock.patch.dict(os.environ, {'FLOWS_RESULTS_MEMORY_BYTES': str(limit), 'FLOWS_CACHE': '0'}):
+            responses = self.run_server([{'id': i, 'csv_path': self.test_csv.name, 'top': i} for i in range(1, 5)]
+                                        + [{'id': 5, 'command': 'stats'}])
+        stats = responses[-1]['stats']
+        self.assertEqual((stats['entries'], stats['evictions']), (2, 3))
+        self.assertLessEqual(stats['memory_bytes'], limit)
+        # Najnowsze wyniki zostały w pamięci
+        self.assertIsNotNone(flows_results.get(self.test_csv.name, flows_results.result_key(
+            {'csv_path': self.test_csv.name, 'top': 4})))
+
+
+class TestIncrementalAggregation(unittest.TestCase):
+    """Testy agregacji przyrostowej plików, do których dopisuje się wiersze"""
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='flows_state_')
+        self.env = mock.patch.dict(os.environ, {'FLOWS_CACHE_DIR': self.cache_dir})
+        self.env.start()
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+        for i in range(50):
+            self.test_csv.write(f'Firma {i % 4},Firma {i % 3 + 4},{0.1 * (i + 1):.2f},2024-01-{i % 28 + 1:02d},"Opis\n{i}"\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.remove(self.test_csv.name)
+    
+    def append(self, text):
+        with open(self.test_csv.name, 'a', encoding='utf-8') as f:
+            f.write(text)
+    
+    def aggregate(self, **filters):
+        """Agregacja przyrostowa, zwraca (wynik, czy stan był użyty)"""
+        states = []
+        load_state = flows_incremental.load_state
+        with mock.patch('flows_incremental.load_state', lambda *args: states.append(load_state(*args)) or states[0]):
+            edges = flows.incremental_aggregate(self.test_csv.name, **filters)
+        return edges, states[0] is not None
+    
+    def assertMatchesSerial(self, edges, **filters):
+        serial = stream_aggregate(self.test_csv.name, exact=True, **filters)
+        self.assertEqual(list(edges.items()), list(serial.items()))
+    
+    def test_append_resumes_from_watermark(self):
+        """Test dopisania wierszy - wczytywany jest tylko koniec pliku"""
+        edges, resumed = self.aggregate(date_to='2024-01-20')
+        self.assertFalse(resumed)
+        self.assertMatchesSerial(edges, date_to='2024-01-20')
+        
+        self.append('Firma 9,Firma 0,12.5,2024-01-02,Nowy\nFirma 0,Firma 4,0.3,2024-02-01,Poza zakresem\n')
+        with mock.patch('flows._scan_pairs', wraps=flows._scan_pairs) as scan:
+            edges, resumed = self.aggregate(date_to='2024-01-20')
+        self.assertTrue(resumed)
+        self.assertGreater(scan.call_args.args[2], 0, "Odczyt powinien zacząć się od znacznika")
+        self.assertMatchesSerial(edges, date_to='2024-01-20')
+        self.assertIn(('Firma 9', 'Firma 0', 12.5), list(edges.items()))
+    
+    def test_state_per_filters(self):
+        """Test osobnego stanu dla każdego zestawu filtrów"""
+        self.aggregate(entities=['Firma 1'])
+        self.aggregate()
+        states = [name for name in os.listdir(self.cache_dir) if name.endswith(flows_cache.STATE_SUFFIX)]
+        self.assertEqual(len(states), 2)
+        
+        edges, resumed = self.aggregate(entities=['Firma 1'])
+        self.assertTrue(resumed)
+        self.assertMatchesSerial(edges, entities=['Firma 1'])
+    
+    def test_rewritten_prefix_rebuilds(self):
+        """Test przeliczenia od nowa po zmianie lub skróceniu wcześniejszej części pliku"""
+        self.aggregate()
+        with open(self.test_csv.name, encoding='utf-8') as f:
+            text = f.read()
+        with open(self.test_csv.name, 'w', encoding='utf-8') as f:
+            f.write(text.replace('Firma 0,', 'Firma X,', 1) + 'Firma 1,Firma 5,1.0,2024-01-01,x\n')
+        edges, resumed = self.aggregate()
+        self.assertFalse(resumed)
+        self.assertMatchesSerial(edges)
+        
+        with open(self.test_csv.name, 'w', encoding='utf-8') as f:
+            f.write(text[:len(text) // 2].rsplit('\n', 1)[0] + '\n')
+        edges, resumed = self.aggregate()
+        self.assertFalse(resumed)
+        self.assertMatchesSerial(edges)
+    
+    def test_unterminated_record_is_not_persisted(self):
+        """Test niedokończonego ostatniego wiersza - liczony teraz, zapisany dopiero po dokończeniu"""
+        self.aggregate()
+        self.append('Firma 7,Firma 8,5')
+        edges, resumed = self.aggregate()
+        self.assertTrue(resumed)
+        self.assertIn(('Firma 7', 'Firma 8', 5.0), list(edges.items()))
+        
+        self.append('0.25,2024-01-03,Dokończony\n')
+        edges, resumed = self.aggregate()
+        self.assertTrue(resumed)
+        self.assertIn(('Firma 7', 'Firma 8', 50.25), list(edges.items()))
+        self.assertMatchesSerial(edges)
+    
+    def test_result_key_is_sha256_from_full_pass(self):
+        """Test klucza wyniku - SHA-256 pliku policzony przy pełnym przebiegu, zapisany w stanie"""
+        output = self.test_csv.name + '.svg'
+        self.addCleanup(os.remove, output)
+        self.addCleanup(flows_results.clear)
+        sha256 = flows_cache.file_sha256(self.test_csv.name)
+        for jobs in (1, 2):
+            flows_results.clear()
+            flows_cache.invalidate(self.test_csv.name)
+            params = {'csv_path': self.test_csv.name, 'to': '2024-01-20', 'jobs': jobs}
+            with mock.patch.dict(os.environ, {'FLOWS_PARALLEL_MIN_BYTES': '0'}):
+                if jobs == 1:
+                    with mock.patch('flows_cache.file_sha256', side_effect=AssertionError('osobny odczyt pliku')):
+                        flows.write_chart(params, output)
+                else:
+                    flows.write_chart(params, output)
+                self.assertEqual(flows_results.result_key(params)[0], sha256)
+                
+                flows_results.clear()
+                self.assertEqual(flows_results.result_key(params)[0], sha256)
+                with mock.patch('flows.aggregate_params') as aggregate:
+                    self.assertEqual(flows.write_chart(params, output), 12)
+                aggregate.assert_not_called()
+        self.assertFalse(flows_cache.is_fresh(self.test_csv.name))
+    
+    def test_append_does_not_key_results_by_fingerprint(self):
+        """Test dopisania - bez SHA-256 całego pliku wynik nie jest zapamiętywany (odcisk to nie klucz)"""
+        output = self.test_csv.name + '.svg'
+        self.addCleanup(os.remove, output)
+        self.addCleanup(flows_results.clear)
+        params = {'csv_path': self.test_csv.name, 'to': '2024-01-20', 'jobs': 1}
+        with mock.patch.dict(os.environ, {'FLOWS_PARALLEL_MIN_BYTES': '0'}):
+            flows.write_chart(params, output)
+            self.append('Firma 9,Firma 0,12.5,2024-01-02,Nowy\n')
+            with mock.patch('flows_cache.file_sha256', side_effect=AssertionError('SHA-256 całego pliku')), \
+                    mock.patch('flows._scan_pairs', wraps=flows._scan_pairs) as scan:
+                self.assertEqual(flows.write_chart(params, output), 13)
+                self.assertGreater(scan.call_args.args[2], 0, "Odczyt powinien zacząć się od znacznika")
+                self.assertIsNone(flows_results.result_key(params))
+            filters = flows_incremental.filters_key(date_to='2024-01-20')
+            self.assertIsNone(flows_incremental.load_state(self.test_csv.name, filters)['sha256'])
+            with mock.patch('flows.aggregate_params', wraps=flows.aggregate_params) as aggregate:
+                self.assertEqual(flows.write_chart(params, output), 13)
+            aggregate.assert_called_once()
+    
+    def test_corrupt_state_is_ignored(self):
+        """Test uszkodzonego pliku stanu - agregacja od nowa"""
+        self.aggregate()
+        path = flows_incremental.state_path(self.test_csv.name, flows_incremental.filters_key())
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 4)
+        with mock.patch('sys.stderr', new_callable=io.StringIO):
+            edges, resumed = self.aggregate()
+        self.assertFalse(resumed)
+        self.assertMatchesSerial(edges)
+
+
+class TestBenchmark(unittest.TestCase):
+    """Testy generatora syntetycznych plików i porównania z wynikiem bazowym"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='flows_bench_')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def generate(self, name, **options):
+        path = os.path.join(self.directory, name)
+        bench_flows.generate_ledger(path, **options)
+        return path
+    
+    def test_generator_is_deterministic(self):
+        """Test powtarzalności generatora dla tego samego ziarna"""
+        first = self.generate('a.csv', rows=300, entities=20, malformed=0.1)
+        second = self.generate('b.csv', rows=300, entities=20, malformed=0.1)
+        third = self.generate('c.csv', rows=300, entities=20, malformed=0.1, seed=7)
+        with open(first, 'rb') as a, open(second, 'rb') as b, open(third, 'rb') as c:
+            content = a.read()
+            self.assertEqual(content, b.read())
+            self.assertNotEqual(content, c.read())
+    
+    def test_generator_shapes(self):
+        """Test kształtów grafu, zakresu dat i udziału błędnych wierszy"""
+        star = parse_csv(self.generate('star.csv', rows=500, entities=30, shape='star', days=10))
+        self.assertEqual(len(star), 500)
+        self.assertTrue(all('Podmiot 00000' in (row['Nadawca'], row['Odbiorca']) for row in star))
+        self.assertLessEqual(max(row['Data'] for row in star), '2024-01-10')
+        
+        chain = parse_csv(self.generate('chain.csv', rows=500, entities=30, shape='chain'))
+        self.assertTrue(all(row['Nadawca'] < row['Odbiorca'] for row in chain))
+        
+        noisy = self.generate('noisy.csv', rows=2000, entities=30, malformed=0.25)
+        edges = stream_aggregate(noisy)
+        self.assertGreater(len(edges), 0)
+        rows = parse_csv(noisy)
+        total_rows = len(rows)
+        valid = sum(1 for row in rows if (row.get('Opis') or '').startswith('Przelew'))
+        self.assertEqual(total_rows, 2000)
+        self.assertAlmostEqual(1 - valid / total_rows, 0.25, delta=0.05)
+    
+    def test_pipeline_stages_and_regressions(self):
+        """Test pomiaru etapów potoku i wykrywania regresji"""
+        path = self.generate('ledger.csv', rows=300, entities=15)
+        stages = bench_flows.bench_pipeline(path, 'dicts', date_from='2024-02-01')
+        self.assertEqual(list(stages), ['parse_csv', 'filter_flows', 'aggregate_flows', 'generate_sankey_svg'])
+        self.assertTrue(all(stage['seconds'] >= 0 and stage['peak_bytes'] > 0 for stage in stages.values()))
+        
+        baseline = {'parse_csv': {'seconds': 1.0, 'peak_bytes': 10 ** 7},
+                    'aggregate_flows': {'seconds': 0.001, 'peak_bytes': 1000}}
+        current = {'parse_csv': {'seconds': 1.3, 'peak_bytes': 10 ** 7},
+                   'aggregate_flows': {'seconds': 0.003, 'peak_bytes': 2000}}
+        regressions = bench_flows.compare_results(current, baseline, threshold=0.2)
+        # Małe bezwzględne zmiany (szum) nie są regresją
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('parse_csv.seconds'))
+        self.assertEqual(bench_flows.compare_results(current, baseline, threshold=0.5), [])
+
+
+class TestFlowsMetrics(unittest.TestCase):
+    """Testy pomiarów etapów (FLOWS_METRICS, --metrics) i profilu"""
+    
+    SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flows.py')
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='flows_metrics_')
+        self.csv_path = os.path.join(self.directory, 'dane.csv')
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write('Nadawca,Odbiorca,Kwota,Data,Opis\n')
+            f.write('Firma A,Firma B,1000.50,2024-01-15,Test 1\n')
+            f.write('Firma B,Firma C,2000.00,2024-02-20,Test 2\n')
+            f.write('Firma A,Firma C,300.00,2024-03-01,Test 3\n')
+        self.metrics_path = os.path.join(self.directory, 'metrics.jsonl')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def read_records(self):
+        with open(self.metrics_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+    
+    def test_cli_metrics_record(self):
+        """Test rekordu wywołania z wiersza poleceń - etapy, wiersze, pamięć"""
+        env = dict(os.environ, FLOWS_RESULTS='0')
+        subprocess.run(
+            [sys.executable, self.SCRIPT, '--csv-path', self.csv_path,
+             '--from', '2024-02-01', '--metrics', self.metrics_path],
+            capture_output=True, check=True, env=env
+        )
+        [record] = self.read_records()
+        
+        self.assertEqual(record['event'], 'flows_run')
+        self.assertEqual(record['mode'], 'cli')
+        self.assertTrue(record['ok'])
+        self.assertEqual(record['from'], '2024-02-01')
+        self.assertGreater(record['peak_bytes'], 0)
+        stages = {stage['name']: stage for stage in record['stages']}
+        self.assertEqual(record['stages'][0]['name'], 'load_params')
+        self.assertIn('aggregate', stages)
+        self.assertEqual(stages['aggregate']['rows_out'], 2)
+        self.assertEqual(stages['layout']['rows_in'], 2)
+        self.assertIn('serialize', stages)
+        for stage in record['stages']:
+            self.assertGreaterEqual(stage['wall_s'], 0)
+            self.assertIn('peak_bytes', stage)
+    
+    def test_serve_attaches_metrics(self):
+        """Test odpowiedzi serwera z pomiarami (i bez nich, gdy wyłączone)"""
+        request = json.dumps({'id': 1, 'csv_path': self.csv_path, 'entities': ['Firma C']}) + '\n'
+        with mock.patch.dict(os.environ, {'FLOWS_METRICS': self.metrics_path}):
+            output = io.StringIO()
+            serve(io.StringIO(request), output)
+        response = json.loads(output.getvalue())
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['metrics']['mode'], 'serve')
+        self.assertEqual(response['metrics']['entities'], 1)
+        self.assertEqual(self.read_records(), [response['metrics']])
+        
+        with mock.patch.dict(os.environ, {'FLOWS_METRICS': ''}):
+            output = io.StringIO()
+            serve(io.StringIO(request), output)
+        self.assertNotIn('metrics', json.loads(output.getvalue()))
+    
+    def test_standalone_start_time(self):
+        """Test czasu startu w rekordzie flows_standalone.py - z początku pomiaru, nie z jego końca"""
+        import flows_standalone
+        before = datetime.now().astimezone()
+        measured = flows_standalone.RunMetrics(self.metrics_path)
+        later = datetime(2100, 1, 1).astimezone()
+        with mock.patch('flows_standalone.datetime') as clock, mock.patch('builtins.print'):
+            clock.now.return_value = later
+            measured.finish()
+        [record] = self.read_records()
+        started = datetime.fromisoformat(record['started'])
+        self.assertLess(started, later)
+        self.assertGreaterEqual(started, before.replace(microsecond=before.microsecond // 1000 * 1000))
+    
+    def test_stage_without_run(self):
+        """Test etapów poza pomiarem i etapów zagnieżdżonych - bez rekordu"""
+        with flows_metrics.stage('parse') as stage:
+            stage.rows_out = 10
+        with flows_metrics.run('test', target=False) as measured:
+            with flows_metrics.stage('aggregate', rows_in=5) as outer:
+                with flows_metrics.stage('parse'):
+                    pass
+                outer.rows_out = 3
+        self.assertEqual([s['name'] for s in measured.record['stages']], ['aggregate'])
+        self.assertEqual(measured.record['stages'][0]['rows_in'], 5)
+        self.assertEqual(measured.record['stages'][0]['rows_out'], 3)
+        self.assertFalse(os.path.exists(self.metrics_path))
+    
+    def test_profile_dump(self):
+        """Test zapisu profilu cProfile dla wywołań ponad próg czasu"""
+        profiles = os.path.join(self.directory, 'profile')
+        env = {'FLOWS_PROFILE_DIR': profiles, 'FLOWS_PROFILE_MIN_SECONDS': '0',
+               'FLOWS_METRICS_MEMORY': '0'}
+        with mock.patch.dict(os.environ, env):
+            with flows_metrics.run('test', target=False) as measured:
+                flows.aggregate_params({'csv_path': self.csv_path})
+        self.assertIsNone(measured.record['peak_bytes'])
+        self.assertTrue(os.path.exists(measured.record['profile']))
+        
+        with mock.patch.dict(os.environ, dict(env, FLOWS_PROFILE_MIN_SECONDS='3600')):
+            with flows_metrics.run('test', target=False) as measured:
+                pass
+        self.assertNotIn('profile', measured.record)
+
+
+class TestProcessFile(unittest.TestCase):
+    """Testy analizy pliku po uploadzie (process_file.py)"""
+    
+    def reference(self, data):
+        """Wynik dla całej treści odczytanej w trybie tekstowym"""
+        content = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8').read()
+        preview = content[:200] + "..." if len(content) > 200 else content
+        return len(content.split('\n')), len(content.split()), preview
+    
+    def test_chunks_match_whole_content(self):
+        """Test zliczania blokami - granice bloków w słowach, \\r\\n i znakach UTF-8"""
+        samples = [
+            '',
+            'jedno',
+            'Nadawca,Odbiorca\r\nFirma A,Firma Ż\r\n',
+            'a\rb\r\rc\n\n d\xa0e\u3000f ',
+            ('słowo \r\n' * 100) + 'koniec',
+            'ąę' * 150 + '\n' + 'x y' * 50,
+        ]
+        for text in samples:
+            data = text.encode('utf-8')
+            for chunk_size in (1, 2, 3, 5, 64, process_file.CHUNK_SIZE):
+                with self.subTest(text=text[:20], chunk_size=chunk_size):
+                    result = process_file.analyze_text(io.BytesIO(data), chunk_size)
+                    self.assertEqual(result, self.reference(data))
+    
+    def test_lines_without_newline_are_capped(self):
+        """Test linii dłuższej niż limit - oddawana w częściach, pamięć ograniczona"""
+        chunks = ['a,b\nab', 'cd', 'e\nf', 'gh']
+        self.assertEqual(list(process_file.iter_lines(chunks)), ['a,b\n', 'abcde\n', 'fgh'])
+        self.assertEqual(list(process_file.iter_lines(chunks, max_line=3)), ['a,b\n', 'abcd', 'e\n', 'fgh'])
+        
+        data = b'Nadawca,Odbiorca,Kwota\n' + b'x' * 5000
+        with mock.patch('process_file.MAX_LINE_CHARS', 1000):
+            (line_count, _, _), profile = process_file.analyze_csv(io.BytesIO(data), chunk_size=256)
+        self.assertEqual(line_count, 2)
+        self.assertEqual(profile['header'], ['Nadawca', 'Odbiorca', 'Kwota'])
+        self.assertGreater(profile['malformed_rows'], 0)
+    
+    def test_process_file(self):
+        """Test wyniku dla pliku tekstowego i pliku z błędnym UTF-8"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dane.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('Nadawca,Odbiorca,Kwota\nFirma A,Firma B,10\n')
+            analysis = process_file.process_file(path)['analysis']
+            self.assertEqual(analysis['line_count'], 3)
+            self.assertEqual(analysis['word_count'], 4)
+            self.assertTrue(analysis['content_preview'].startswith('Nadawca'))
+            
+            with open(path, 'wb') as f:
+                f.write(b'Nadawca\n\xff\n')
+            analysis = process_file.process_file(path)['analysis']
+            self.assertIsNone(analysis['line_count'])
+            self.assertTrue(analysis['content_preview'].startswith('Error reading file'))
+    
+    def test_csv_profile(self):
+        """Test profilu CSV liczonego w tym samym przebiegu co liczniki"""
+        text = (
+            'Nadawca;Odbiorca;Kwota;Data;Opis\r\n'
+            'Firma B;Firma A;1 000,50;2024-03-01;"Opis\nw dwóch liniach"\r\n'
+            'Firma A;Firma C;20;2024-01-15;x\r\n'
+            ';Firma C;5;2024-02-01;brak nadawcy\r\n'
+            'Firma C;Firma A;abc;zła data;zła kwota\r\n'
+            'Firma A;Firma B;7.5\r\n'
+            '\r\n'
+        )
+        data = text.encode('utf-8')
+        (lines, words, _), profile = process_file.analyze_csv(io.BytesIO(data), chunk_size=7)
+        self.assertEqual((lines, words), self.reference(data)[:2])
+        
+        self.assertEqual(profile['delimiter'], ';')
+        self.assertEqual(profile['columns'], {'sender': 'Nadawca', 'receiver': 'Odbiorca',
+                                              'amount': ['Kwota'], 'date': 'Data'})
+        self.assertEqual(profile['rows'], 5)
+        self.assertEqual(profile['malformed_rows'], 3)
+        self.assertEqual(profile['invalid_dates'], 1)
+        # Liczba i suma przepływów rysowanych na wykresie (bez pustego nadawcy)
+        self.assertEqual(profile['entities'], {'Firma B': [2, 1008.0], 'Firma A': [3, 1028.0],
+                                               'Firma C': [1, 20.0]})
+        self.assertEqual(profile['entity_count'], 3)
+        self.assertEqual(profile['amount'], {'min': 5.0, 'max': 1000.5, 'sum': 1033.0})
+        self.assertEqual(profile['dates'], {'min': '2024-01-15', 'max': '2024-03-01'})
+    
+    def test_other_delimiter_saved_without_dictionary(self):
+        """Test pliku z separatorem ';' - zapisany sam profil (wynik negatywny), bez słownika podmiotów"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dane.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('Nadawca;Odbiorca;Kwota;Data\nFirma A;Firma B;10;2024-01-01\n')
+            result = process_file.process_file(path)
+            self.assertEqual(result['profile']['delimiter'], ';')
+            self.assertFalse(result['profile']['flows_compatible'])
+            self.assertFalse(process_file.flows_ready(result['profile']))
+            self.assertIsNone(flows_entities.open_dictionary(path))
+            self.assertFalse(process_file.load_profile(path)['flows_compatible'])
+            self.assertFalse(process_file.get_profile(path)['flows_compatible'])
+            
+            # Przybliżona nazwa kolumny też nie jest czytana przez flows.py
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('nadawca_firma,Odbiorca,Kwota\nFirma A,Firma B,10\n')
+            self.assertFalse(process_file.process_file(path)['profile']['flows_compatible'])
+            self.assertIsNone(flows_entities.open_dictionary(path))
+    
+    def test_profile_saved_with_upload(self):
+        """Test zapisu profilu przy analizie uploadu, odczytu i unieważnienia"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dane.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('Nadawca,Odbiorca,Kwota,Data\nFirma A,Firma B,10,2024-01-01\n')
+            result = process_file.process_file(path)
+            self.assertEqual(result['profile']['entity_count'], 2)
+            self.assertNotIn('entities', result['profile'])
+            
+            with mock.patch.object(process_file, 'analyze_csv') as analyze:
+                profile = process_file.get_profile(path)
+                dictionary = flows_entities.open_dictionary(path)
+            analyze.assert_not_called()
+            self.assertEqual(profile['dates'], {'min': '2024-01-01', 'max': '2024-01-01'})
+            self.assertEqual([item['name'] for item in dictionary.search()['items']], ['Firma A', 'Firma B'])
+            
+            # Zmieniony plik - profil i słownik są liczone od nowa
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('Firma C,Firma A,5,2024-01-02\n')
+            self.assertIsNone(process_file.load_profile(path))
+            self.assertIsNone(flows_entities.open_dictionary(path))
+            self.assertEqual(process_file.get_profile(path)['entity_count'], 3)
+            self.assertEqual(len(flows_entities.open_dictionary(path)), 3)
+            
+            flows_cache.invalidate(path)
+            self.assertFalse(os.path.exists(process_file.profile_path_for(path)))
+            self.assertFalse(os.path.exists(flows_entities.dictionary_path_for(path)))
+
+
+class TestEntityDictionary(unittest.TestCase):
+    """Testy słownika podmiotów (prefiks, fragment, strony, największe podmioty)"""
+    
+    ROWS = [
+        ('Kowalski Sp. z o.o.', 'Nowak SA', '100'),
+        ('kowalczyk', 'Nowak SA', '50'),
+        ('Łódzka Spółdzielnia', 'Kowalski Sp. z o.o.', '1 000,5'),
+        ('Nowak SA', 'ZAKŁAD Kowala', '20'),
+        ('Nowak SA', 'Bez kwoty', '0'),
+        ('', 'Kowalski Sp. z o.o.', '5'),
+    ]
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='flows_entities_')
+        self.csv_path = os.path.join(self.directory, 'dane.csv')
+        with open(self.csv_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Nadawca', 'Odbiorca', 'Kwota', 'Data'])
+            for sender, receiver, amount in self.ROWS:
+                writer.writerow([sender, receiver, amount, '2024-01-01'])
+    
+    def tearDown(self):
+        flows.invalidate(self.csv_path)
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def names(self, result):
+        return [item['name'] for item in result['items']]
+    
+    def test_table_and_upload_pass_agree(self):
+        """Test tego samego słownika z FlowTable i z przebiegu process_file"""
+        from_table = flows_entities.EntityDictionary.from_table(FlowTable.from_csv(self.csv_path))
+        with open(self.csv_path, 'rb') as f:
+            _, profile = process_file.analyze_csv(f)
+        from_pass = flows_entities.EntityDictionary.from_stats(profile['entities'])
+        for name, _ in flows_entities.SECTIONS:
+            self.assertEqual(bytes(getattr(from_table, name)), bytes(getattr(from_pass, name)), name)
+        
+        nowak = from_table.search('nowak')['items'][0]
+        self.assertEqual(nowak, {'name': 'Nowak SA', 'count': 3, 'total': 170.0})
+        self.assertEqual(from_table.search('bez')['items'][0]['count'], 0)
+    
+    def test_prefix_substring_and_pages(self):
+        """Test wyszukiwania bez względu na wielkość liter, stron i sortowania po sumie"""
+        dictionary = flows_entities.EntityDictionary.from_table(FlowTable.from_csv(self.csv_path))
+        self.assertEqual(self.names(dictionary.search('KOWAL')), ['kowalczyk', 'Kowalski Sp. z o.o.'])
+        self.assertEqual(self.names(dictionary.search('łódz')), ['Łódzka Spółdzielnia'])
+        self.assertEqual(dictionary.search('x')['total'], 0)
+        
+        result = dictionary.search('kowal', match='substring')
+        self.assertEqual(result['total'], 3)
+        self.assertEqual(self.names(result), ['kowalczyk', 'Kowalski Sp. z o.o.', 'ZAKŁAD Kowala'])
+        
+        everything = dictionary.search(limit=2)
+        self.assertEqual(everything['total'], 6)
+        self.assertEqual(len(everything['items']), 2)
+        # Kolejność punktów kodowych: 'ł' po 'z'
+        self.assertEqual(self.names(dictionary.search(offset=4, limit=2)), ['ZAKŁAD Kowala', 'Łódzka Spółdzielnia'])
+        # limit=None - wszystkie trafienia (odpowiedź /api/entities bez stron), także ponad MAX_LIMIT
+        self.assertEqual(len(dictionary.search(limit=None)['items']), 6)
+        with mock.patch('flows_entities.MAX_LIMIT', 2):
+            self.assertEqual(len(flows.find_entities({'csv_path': self.csv_path, 'all': True})['items']), 6)
+        
+        top = dictionary.search(sort='volume', limit=3)
+        self.assertEqual(self.names(top), ['Kowalski Sp. z o.o.', 'Łódzka Spółdzielnia', 'Nowak SA'])
+        self.assertEqual(self.names(dictionary.search('kowal', 'substring', 'volume', offset=1)),
+                         ['kowalczyk', 'ZAKŁAD Kowala'])
+        with self.assertRaises(ValueError):
+            dictionary.search('a', match='regex')
+    
+    def test_saved_dictionary_and_server_command(self):
+        """Test zapisu i mapowania słownika oraz polecenia serwera"""
+        self.assertEqual(flows.prepare(self.csv_path), 4)
+        dictionary = flows_entities.open_dictionary(self.csv_path)
+        self.assertIsNotNone(dictionary)
+        self.assertEqual(self.names(dictionary.search('kowal', match='substring')),
+                         ['kowalczyk', 'Kowalski Sp. z o.o.', 'ZAKŁAD Kowala'])
+        self.assertEqual(dictionary.search('nowak')['items'][0]['total'], 170.0)
+        
+        request = {'id': 1, 'command': 'entities', 'csv_path': self.csv_path,
+                   'query': 'now', 'sort': 'volume', 'limit': 10}
+        output = io.StringIO()
+        serve(io.StringIO(json.dumps(request) + '\n'), output)
+        response = json.loads(output.getvalue())
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['total'], 1)
+        self.assertEqual(response['items'][0]['name'], 'Nowak SA')
+    
+    def test_unusable_profile_skips_table(self):
+        """Test pliku bez wykresu - wynik z profilu, bez tabeli, .flt i .ent; profil negatywny zapisany"""
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write('Nadawca;Odbiorca;Kwota\nFirma A;Firma B;10\n')
+        with mock.patch('flows.load_dataset', side_effect=AssertionError('budowa tabeli')):
+            result = flows.find_entities({'csv_path': self.csv_path})
+            self.assertEqual((result['total'], result['items']), (0, []))
+            self.assertFalse(result['profile']['flows_compatible'])
+            self.assertEqual(len(flows.load_entities(self.csv_path)), 0)
+        self.assertFalse(flows_cache.is_fresh(self.csv_path))
+        self.assertIsNone(flows_entities.open_dictionary(self.csv_path))
+        
+        # Nowy proces: profil negatywny z katalogu cache, bez ponownego czytania pliku
+        flows._profiles.clear()
+        flows._entities.clear()
+        with mock.patch('process_file.analyze_csv', side_effect=AssertionError('ponowne profilowanie')):
+            self.assertEqual(flows.find_entities({'csv_path': self.csv_path})['total'], 0)
+
+
+class TestAmountFormat(unittest.TestCase):
+    """Testy rozpoznawania kolumny i formatu kwot"""
+    
+    def setUp(self):
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv',
+                                                    encoding='utf-8', newline='')
+        writer = csv.writer(self.test_csv)
+        writer.writerow(['Nadawca', 'Odbiorca', 'Kwota', 'Data'])
+        writer.writerow(['Firma A', 'Firma B', '1 234,50 zł', '2024-01-15'])
+        writer.writerow(['Firma A', 'Firma B', '1\xa0000 zł', '2024-01-16'])
+        writer.writerow(['Firma B', 'Firma C', '12,5', '2024-02-20'])
+        writer.writerow(['Firma C', 'Firma A', '300.25', '2024-03-10'])
+        writer.writerow(['Firma C', 'Firma B', 'abc', '2024-03-11'])
+        self.test_csv.close()
+    
+    def tearDown(self):
+        os.remove(self.test_csv.name)
+    
+    def test_detect_format(self):
+        """Test separatorów dziesiętnych, tysięcy i jednostki waluty z próbki"""
+        cases = [
+            (['1000.50', '2000'], ('.', '', ''), 1000.5),
+            (['1000,50', '7'], (',', '', ''), 1000.5),
+            (['1.234.567,89', '12,5'], (',', '.', ''), 1234567.89),
+            (['$1,234,567.89', '$5'], ('.', ',', '$'), 1234567.89),
+            (['1 234,50 PLN', '-3 000 PLN'], (',', ' ', 'PLN'), 1234.5),
+            (['1,234'], (',', '', ''), 1.234),
+        ]
+        for values, (decimal, groups, unit), expected in cases:
+            found = AmountFormat.detect([('Kwota', values)])
+            self.assertEqual((found.decimal, found.groups, found.unit), (decimal, groups, unit), values)
+            self.assertEqual(found.parse(values[0]), expected)
+        
+        # Wartości w innym formacie niż próbka - jak parse_amount
+        plain = AmountFormat('Kwota')
+        self.assertIs(plain.convert, float)
+        self.assertEqual(plain.parse('1 200,50'), 1200.5)
+        self.assertIsNone(plain.parse('abc'))
+        self.assertIsNone(plain.parse(None))
+    
+    def test_detect_column(self):
+        """Test wyboru kolumny z największą liczbą poprawnych kwot"""
+        found = AmountFormat.detect([('Kwota', ['', 'brak', '5']), ('Amount', ['1.5', '2', '3'])])
+        self.assertEqual(found.column, 'Amount')
+        self.assertEqual(AmountFormat.detect([('Kwota', ['x']), ('Value', ['y'])]).column, 'Kwota')
+        self.assertIsNone(AmountFormat.detect([]).column)
+    
+    def test_paths_agree(self):
+        """Test tego samego formatu w tabeli, strumieniu, agregacji równoległej i profilu"""
+        table = FlowTable.from_csv(self.test_csv.name)
+        self.assertEqual(list(table.amounts), [1234.5, 1000.0, 12.5, 300.25, 0.0])
+        expected = dict(aggregate_flows(table))
+        
+        self.assertEqual(dict(aggregate_flows(parse_csv(self.test_csv.name))), expected)
+        self.assertEqual(dict(stream_aggregate(self.test_csv.name).to_dict()), expected)
+        with mock.patch.dict(os.environ, {'FLOWS_PARALLEL_MIN_BYTES': '0'}):
+            parallel = flows.parallel_aggregate(self.test_csv.name, workers=2)
+        self.assertEqual(dict(parallel.to_dict()), expected)
+        
+        with open(self.test_csv.name, 'rb') as f:
+            _, profile = process_file.analyze_csv(f)
+        self.assertEqual(profile['amount_format'],
+                         {'column': 'Kwota', 'decimal': ',', 'groups': ' \xa0', 'unit': 'zł'})
+        self.assertEqual(profile['malformed_rows'], 1)
+    
+    def test_exact_aggregation(self):
+        """Test dokładnych sum (grosze jako liczby całkowite) w tej samej kolejności krawędzi"""
+        table = FlowTable()
+        for i in range(1000):
+            table.append('A', 'B', 0.1, NO_DATE)
+            table.append('B', 'C', 1e16 if i == 0 else 1.0 / 3, NO_DATE)
+            table.append('A', 'C', 0.07, NO_DATE)
+        
+        approximate = table.aggregate_pairs()
+        exact = table.aggregate_pairs(exact=True)
+        self.assertNotEqual(approximate.values[0], 100.0)
+        self.assertEqual([(s, t) for s, t, _ in exact.items()], [(s, t) for s, t, _ in approximate.items()])
+        self.assertEqual(list(exact.values), [100.0, math.fsum([1e16] + [1.0 / 3] * 999), 70.0])
+        self.assertEqual(flows.aggregate_table(table, exact=True).values[0], 100.0)
+    
+    def test_incremental_state_keeps_format(self):
+        """Test formatu kwot zapisanego w stanie - dopisane wiersze czytane tak samo"""
+        with mock.patch('flows_incremental.save_state', wraps=flows_incremental.save_state) as save:
+            flows.incremental_aggregate(self.test_csv.name)
+        self.assertEqual(save.call_args.args[-1], AmountFormat('Kwota', ',', ' \xa0', 'zł'))
+        
+        with open(self.test_csv.name, 'a', encoding='utf-8') as f:
+            f.write('Firma A,Firma B,"2 000,00 zł",2024-04-01\n')
+        edges = flows.incremental_aggregate(self.test_csv.name)
+        self.assertEqual(dict(edges.to_dict())['Firma A→Firma B'], 4234.5)
+
+
+class TestDateFormat(unittest.TestCase):
+    """Testy rozpoznawania formatu dat"""
+    
+    def setUp(self):
+        self.test_csv = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv',
+                                                    encoding='utf-8', newline='')
+        self.test_csv.write('Nadawca,Odbiorca,Kwota,Data\n')
+        self.test_csv.write('Firma A,Firma B,100,15.01.2024\n')
+        self.test_csv.write('Firma A,Firma B,200,01.03.2024 12:30\n')
+        self.test_csv.write('Firma B,Firma C,300,2024-02-20\n')
+        self.test_csv.write('Firma C,Firma A,400,31.02.2024\n')
+        self.test_csv.write('Firma C,Firma B,500,1711929600\n')
+        self.test_csv.close()
+    
+    def tearDown(self):
+        os.remove(self.test_csv.name)
+    
+    def test_parse_day_formats(self):
+        """Test obsługiwanych formatów (także z godziną) i błędnych dat"""
+        expected = datetime(2024, 1, 15).toordinal()
+        for value in ['2024-01-15', '2024-1-15', '2024-01-15T10:30:00', '2024-01-15 10:30:00+01:00',
+                      '15.01.2024', '15.1.2024 10:30', '15/01/2024', '1705312800', '1705312800123']:
+            self.assertEqual(parse_day(value), expected, value)
+        for value in ['', 'zła data', '2024-13-45', '31.02.2024', '15-01-24', '20240115', '12345', None]:
+            self.assertEqual(parse_day(value), NO_DATE, value)
+    
+    def test_detect_and_memo(self):
+        """Test wyboru formatu z próbki i zapamiętywania powtarzających się dat"""
+        self.assertEqual(DateFormat.detect(['01.02.2024', '2024-01-01', '03.02.2024']).name, 'DD.MM.YYYY')
+        self.assertEqual(DateFormat.detect(['01/02/2024']).name, 'DD/MM/YYYY')
+        self.assertEqual(DateFormat.detect(['1705312800', '']).name, 'timestamp')
+        self.assertEqual(DateFormat.detect(['abc']).name, 'YYYY-MM-DD')
+        
+        dates = DateFormat('DD.MM.YYYY')
+        with mock.patch.object(dates, 'convert', wraps=dates.convert) as convert:
+            days = [dates.day('15.01.2024') for _ in range(3)] + [dates.day('2024-01-15')]
+        self.assertEqual(convert.call_count, 2)
+        self.assertEqual(set(days), {datetime(2024, 1, 15).toordinal()})
+        self.assertIsNone(DateFormat('timestamp').days)
+    
+    def test_paths_agree(self):
+        """Test tych samych dat w tabeli, filtrze na słownikach, strumieniu i profilu"""
+        table = FlowTable.from_csv(self.test_csv.name)
+        self.assertEqual([d and datetime.fromordinal(d).strftime('%Y-%m-%d') for d in table.dates],
+                         ['2024-01-15', '2024-03-01', '2024-02-20', 0, '2024-04-01'])
+        
+        flows_list = parse_csv(self.test_csv.name)
+        for case in [{'date_from': '2024-02-01'}, {'date_to': '2024-03-01'},
+                     {'date_from': '2024-02-20', 'date_to': '2024-02-20'}]:
+            expected = dict(aggregate_flows(filter_flows(table, **case)))
+            self.assertEqual(dict(aggregate_flows(filter_flows(flows_list, **case))), expected, case)
+            self.assertEqual(dict(stream_aggregate(self.test_csv.name, **case).to_dict()), expected, case)
+        
+        with open(self.test_csv.name, 'rb') as f:
+            _, profile = process_file.analyze_csv(f)
+        self.assertEqual(profile['date_format'], 'DD.MM.YYYY')
+        self.assertEqual(profile['dates'], {'min': '2024-01-15', 'max': '2024-04-01'})
+        self.assertEqual(profile['invalid_dates'], 1)
+
+
+class TestBatch(unittest.TestCase):
+    """Testy trybu wsadowego (wspólne agregacje, pula procesów, manifest)"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='flows_batch_')
+        self.env = mock.patch.dict(os.environ, {'FLOWS_CACHE_DIR': os.path.join(self.directory, 'cache')})
+        self.env.start()
+        self.csv_path = os.path.join(self.directory, 'dane.csv')
+        self.output = os.path.join(self.directory, 'wykresy')
+        with open(self.csv_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Nadawca', 'Odbiorca', 'Kwota', 'Data'])
+            for i in range(120):
+                writer.writerow([f'Firma {i % 5}', f'Firma {(i * 3 + 1) % 7}', f'{i * 1.37 + 0.1:.2f}',
+                                 f'2024-{i % 3 + 1:02d}-{i % 28 + 1:02d}' if i % 11 else ''])
+            writer.writerow(['', 'Firma 2', '9.99', '2024-02-02'])
+    
+    def tearDown(self):
+        flows.invalidate(self.csv_path)
+        flows_results.clear()
+        self.env.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def test_shared_aggregates_match_direct_queries(self):
+        """Test podzbioru krawędzi wspólnej agregacji identycznego z osobnym zapytaniem"""
+        queries = [{'csv_path': self.csv_path, 'entities': entities, 'from': '2024-01-10', 'to': '2024-02-20'}
+                   for entities in (['Firma 1'], ['Firma 3', 'Firma 6'], ['Firma 2', 'Brak'], ['Unknown'], [])]
+        aggregates = flows_batch.SharedAggregates(queries)
+        for query in queries:
+            self.assertEqual(list(aggregates.get(query).items()),
+                             list(flows.aggregate_params(query, use_cache=True).items()), query['entities'])
+        # Cały zakres raz, osobno tylko 'Unknown' (brak nadawcy nie jest węzłem podzbioru)
+        self.assertEqual(aggregates.computed, 2)
+    
+    def test_batch_writes_charts_and_manifest(self):
+        """Test plików, manifestu, kopii powtórzonego wykresu i błędu jednego zapytania"""
+        queries = [
+            {'csv_path': self.csv_path, 'name': 'całość'},
+            {'csv_path': self.csv_path, 'entities': ['Firma 1'], 'top': 3, 'name': 'firma/1'},
+            {'csv_path': self.csv_path, 'entities': ['Firma 1'], 'top': 3, 'gzip': True},
+            {'csv_path': self.csv_path, 'entities': ['Firma 1'], 'top': 3, 'name': 'firma/1'},
+            {'csv_path': os.path.join(self.directory, 'brak.csv')},
+        ]
+        manifest = flows_batch.run_batch(queries, self.output, jobs=1)
+        charts = manifest['charts']
+        self.assertEqual([chart.get('file') for chart in charts],
+                         ['całość.svg', 'firma_1.svg', 'wykres-0003.svgz', 'firma_1-2.svg', None])
+        self.assertEqual([chart.get('source') for chart in charts], ['render', 'render', 'render', 'copy', None])
+        self.assertIn('error', charts[4])
+        self.assertEqual(manifest['summary']['failed'], 1)
+        self.assertEqual(manifest['summary']['rendered'], 3)
+        
+        with open(os.path.join(self.output, flows_batch.MANIFEST), encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['charts'], charts)
+        svg, count = flows.render_chart(queries[1])
+        with open(os.path.join(self.output, 'firma_1.svg'), encoding='utf-8') as f:
+            self.assertEqual(f.read(), svg)
+        with gzip.open(os.path.join(self.output, 'wykres-0003.svgz'), 'rt', encoding='utf-8') as f:
+            self.assertEqual(f.read(), svg)
+        self.assertEqual(charts[1]['flows'], count)
+        
+        # Drugi wsad bierze gotowe wykresy z cache wyników
+        flows_results.clear()
+        again = flows_batch.run_batch(queries[:2], self.output, jobs=1)
+        self.assertEqual([chart['source'] for chart in again['charts']], ['cache', 'cache'])
+    
+    def test_process_pool_and_planned_queries(self):
+        """Test wykresów dla podmiotów × miesięcy rysowanych w puli procesów"""
+        queries = flows_batch.plan_queries(self.csv_path, per_entity=True, per_month=True, max_entities=2)
+        entities = flows.load_entities(self.csv_path)
+        largest = entities.name(entities.by_volume[0])
+        self.assertEqual([query['name'] for query in queries][:3],
+                         [f'{largest}_2024-01', f'{largest}_2024-02', f'{largest}_2024-03'])
+        self.assertEqual(len(queries), 6)
+        self.assertEqual((queries[1]['from'], queries[1]['to']), ('2024-02-01', '2024-02-29'))
+        
+        manifest = flows_batch.run_batch(queries, self.output, jobs=2)
+        self.assertEqual(manifest['summary']['failed'], 0)
+        for chart, query in zip(manifest['charts'], queries):
+            svg, count = flows.render_chart(query)
+            with open(os.path.join(self.output, chart['file']), encoding='utf-8') as f:
+                self.assertEqual(f.read(), svg, chart['file'])
+            self.assertEqual(chart['flows'], count)
+
+
+class TestNumpyEngine(unittest.TestCase):
+    """Testy zgodności silnika NumPy z silnikiem w czystym Pythonie"""
+    
+    def setUp(self):
+        self.table = FlowTable()
+        for i in range(3000):
+            day = 0 if i % 23 == 0 else 738900 + (i * 31) % 400
+            amount = ((i * 7919) % 100000) / 100.0 - 5
+            self.table.append(f'Firma {i % 41}', f'Firma {(i * 11) % 37}', amount, day)
+        self.table.append('', 'Firma 1', 100.0, 0)
+    
+    def run_engine(self, engine, **query):
+        with mock.patch.dict(os.environ, {'FLOWS_ENGINE': engine}):
+            filtered = flows.filter_flows(self.table, **query)
+            return list(filtered.row_ids or range(len(filtered))), flows.aggregate_table(filtered)
+    
+    def test_python_engine_forced(self):
+        """Test wymuszenia silnika Python zmienną FLOWS_ENGINE"""
+        with mock.patch.dict(os.environ, {'FLOWS_ENGINE': 'python'}):
+            self.assertFalse(flows_numpy.enabled())
+    
+    def test_missing_numpy_warns_once(self):
+        """Test ostrzeżenia o brakującym NumPy - raz na proces, nie przy każdym zapytaniu"""
+        with mock.patch.dict(os.environ, {'FLOWS_ENGINE': 'numpy'}), mock.patch('flows_numpy.np', None), \
+                mock.patch('flows_numpy._warned', False), mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertFalse(flows_numpy.enabled())
+            self.assertFalse(flows_numpy.enabled())
+        self.assertEqual(stderr.getvalue().count('NumPy is not installed'), 1)
+    
+    @unittest.skipUnless(flows_numpy.available(), "NumPy nie jest zainstalowany")
+    def test_engines_identical(self):
+        """Test identycznych wyników (wiersze, kolejność krawędzi, sumy co do bitu)"""
+        queries = [
+            {},
+            {'entities': ['Firma 3', 'Firma 7', 'Brak']},
+            {'date_from': '2024-02-01', 'date_to': '2024-03-15'},
+            {'entities': ['Firma 5'], 'date_to': '2024-01-31'},
+        ]
+        for query in queries:
+            python_rows, python_edges = self.run_engine('python', **query)
+            numpy_rows, numpy_edges = self.run_engine('numpy', **query)
+            self.assertEqual(numpy_rows, python_rows, f"Różne wiersze dla {query}")
+            self.assertEqual(list(numpy_edges.items()), list(python_edges.items()), f"Różna agregacja dla {query}")
+    
+    @unittest.skipUnless(flows_numpy.available(), "NumPy nie jest zainstalowany")
+    def test_numpy_filter_uses_indexes(self):
+        """Test domyślnej ścieżki NumPy - wiersze zawężane indeksami tabeli, maska tylko na kandydatach"""
+        query = {'entities': ['Firma 5'], 'date_from': '2024-02-01', 'date_to': '2024-03-15'}
+        python_rows, _ = self.run_engine('python', **query)
+        with mock.patch.object(FlowTable, 'entity_index', autospec=True, side_effect=FlowTable.entity_index) as entity_index, \
+                mock.patch.object(FlowTable, 'date_index', autospec=True, side_effect=FlowTable.date_index) as date_index, \
+                mock.patch('flows_numpy._in_range', wraps=flows_numpy._in_range) as in_range:
+            numpy_rows, _ = self.run_engine('auto', **query)
+        self.assertEqual(numpy_rows, python_rows)
+        entity_index.assert_called()
+        date_index.assert_called()
+        self.assertLess(len(in_range.call_args.args[0]), len(self.table) // 10, "Maska powinna obejmować tylko kandydatów")
+
+
 def run_tests():
     """Uruchom wszystkie testy"""
     # Utwórz test suite
@@ -218,6 +1922,23 @@ def run_tests():
     # Dodaj testy
     suite.addTests(loader.loadTestsFromTestCase(TestFlows))
     suite.addTests(loader.loadTestsFromTestCase(TestFlowsIntegration))
+    suite.addTests(loader.loadTestsFromTestCase(TestFlowsServer))
+    suite.addTests(loader.loadTestsFromTestCase(TestFlowsCli))
+    suite.addTests(loader.loadTestsFromTestCase(TestFlowTable))
+    suite.addTests(loader.loadTestsFromTestCase(TestSankeyLayout))
+    suite.addTests(loader.loadTestsFromTestCase(TestParallelAggregation))
+    suite.addTests(loader.loadTestsFromTestCase(TestFlowsCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestTimeCube))
+    suite.addTests(loader.loadTestsFromTestCase(TestResultCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestIncrementalAggregation))
+    suite.addTests(loader.loadTestsFromTestCase(TestBenchmark))
+    suite.addTests(loader.loadTestsFromTestCase(TestFlowsMetrics))
+    suite.addTests(loader.loadTestsFromTestCase(TestProcessFile))
+    suite.addTests(loader.loadTestsFromTestCase(TestEntityDictionary))
+    suite.addTests(loader.loadTestsFromTestCase(TestAmountFormat))
+    suite.addTests(loader.loadTestsFromTestCase(TestDateFormat))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatch))
+    suite.addTests(loader.loadTestsFromTestCase(TestNumpyEngine))
     
     # Uruchom z verbose output
     runner = unittest.TextTestRunner(verbosity=2)